@@ -1,4 +1,4 @@
-import re
+import re, json
 import traceback
 
 from .base import RecipeUtilBase
@@ -10,6 +10,7 @@ class RecipeAdmin(RecipeUtilBase, object):
         super(RecipeAdmin, self).__init__()
         self.mgr = mgr
         self.prompt = "admin: "
+        self.advice = [ ]
 
     def do_index(self, args):
         """
@@ -63,6 +64,30 @@ class RecipeAdmin(RecipeUtilBase, object):
 
         try:
             self.stdout.write("Total recipes %d\n" % self.mgr.count())
+            stats = self.mgr.read_collection_stats()
+            if stats is None:
+                self.stdout.write("Field stats not computed (use 'stats' to compute them)\n")
+            else:
+                self.stdout.write("Field stats updated %s UTC%s\n" % (stats["update_time"].strftime("%Y-%m-%d %H:%M:%S"),
+                                  ", out of date" if stats.get("stale") else ""))
+            text_index = self.mgr.text_index_info()
+            if text_index is not None:
+                self.stdout.write("Local text index %s: %d recipe(s), %d term(s), %d segment(s), %d deleted, %.1f MB, "
+                                  "indexed to %s UTC\n" % (text_index["path"], text_index["docs"], text_index["terms"],
+                                  text_index["segments"], text_index["deleted"], text_index["bytes"] / 1024.0 ** 2,
+                                  text_index["watermark"].strftime("%Y-%m-%d %H:%M:%S")))
+            pantry_index = self.mgr.pantry_index_info()
+            if pantry_index is not None:
+                self.stdout.write("Pantry index %s: %d recipe(s), %d ingredient phrase(s), %d segment(s), indexed to %s UTC\n" %
+                                  (pantry_index["path"], pantry_index["docs"], pantry_index["phrases"],
+                                  pantry_index["segments"], pantry_index["watermark"].strftime("%Y-%m-%d %H:%M:%S")))
+            cache = self.mgr.query_cache_info()
+            if cache is None:
+                self.stdout.write("Query cache off\n")
+            else:
+                self.stdout.write("Query cache %d search(es), %.1f KB: %d hit(s), %d miss(es), %d expired, "
+                                  "%d evicted, %d invalidation(s)\n" % (cache["entries"], cache["bytes"] / 1024.0,
+                                  cache["hits"], cache["misses"], cache["expired"], cache["evicted"], cache["invalidations"]))
             self.stdout.write("\nIndex Information\n")
             for name, index in self.mgr.list_indexes().items():
                 self.stdout.write("%-18s %-12s %s\n" % (name, index["type"], index["fields"]))
@@ -71,6 +96,119 @@ class RecipeAdmin(RecipeUtilBase, object):
             self.stderr.write("Unable to retrieve index info!\n")
             self.stderr.write(traceback.format_exc())
 
+    def do_advise(self, args):
+        """
+        Explain recent searches and suggest indexes for them.
+
+        advise                list recent query shapes, flagging collection scans and
+                              in-memory sorts, with a suggested index for each
+        advise create <n>     create the index suggested for query shape n
+        advise create all     create every suggested index
+        """
+
+        args = args.split()
+        if args and (args[0] != "create" or len(args) != 2):
+            self.stderr.write("Usage: advise [create <n>|all]\n")
+            return
+
+        if args:
+            if args[1] == "all":
+                selected = [ report for report in self.advice if report["index"] is not None ]
+            else:
+                try:
+                    selected = [ self.advice[int(args[1]) - 1] ]
+                except (ValueError, IndexError):
+                    self.stderr.write("No such query shape, run advise first\n")
+                    return
+            for report in selected:
+                if report["index"] is None:
+                    self.stderr.write("No index suggested\n")
+                    continue
+                try:
+                    name = self.mgr.create_index([ (field, "asc" if d == 1 else "desc") for field, d in report["index"] ])
+                    self.stdout.write("Created index %s\n" % name)
+                    report["index"] = None
+                except Exception as exc:
+                    self.stderr.write("Unable to create index\n")
+                    self.stderr.write(traceback.format_exc())
+            return
+
+        try:
+            self.advice = self.mgr.advise_indexes()
+        except Exception as exc:
+            self.stderr.write("Unable to explain queries!\n")
+            self.stderr.write(traceback.format_exc())
+            return
+
+        if not self.advice:
+            self.stdout.write("No searches recorded yet\n")
+            return
+        for n, report in enumerate(self.advice, 1):
+            sort = ", ".join([ field if isinstance(d, dict) else "%s:%s" % (field, "asc" if d == 1 else "desc")
+                               for field, d in report["sort"] or [ ] ])
+            self.stdout.write("%2d. %s sort %s (%d search(es))\n" % (n, json.dumps(report["shape"]), sort or "none", report["count"]))
+            if report["stages"]:
+                self.stdout.write("    plan %s, examined %s, returned %s\n" % (" <- ".join(report["stages"]),
+                                  report["examined"], report["returned"]))
+            if report["problems"]:
+                self.stdout.write("    %s\n" % "; ".join(report["problems"]))
+            if report["index"] is not None:
+                self.stdout.write("    suggested index %s (advise create %d)\n" % (", ".join([ "%s:%s" % (field, "asc" if d == 1 else "desc")
+                                  for field, d in report["index"] ]), n))
+        self.stdout.write("\n")
+
+    def do_reindex(self, args):
+        """
+        Rebuild the local text index (when searching with --engine local), or the pantry index.
+        They are otherwise brought up to date with new and updated recipes as they are stored.
+
+        reindex [pantry]
+        """
+
+        pantry = args.strip() == "pantry"
+        if args.strip() and not pantry:
+            self.stderr.write("Usage: reindex [pantry]\n")
+            return
+        if (self.mgr.pantry_index if pantry else self.mgr.text_index) is None:
+            self.stderr.write("Not using a local %s index\n" % ("pantry" if pantry else "text"))
+            return
+        try:
+            if pantry:
+                count = self.mgr.refresh_pantry_index(rebuild = True)
+            else:
+                count = self.mgr.refresh_text_index(rebuild = True)
+            self.stdout.write("Indexed %d recipe(s)\n" % count)
+        except Exception as exc:
+            self.stderr.write("Unable to rebuild the %s index!\n" % ("pantry" if pantry else "text"))
+            self.stderr.write(traceback.format_exc())
+
+    def do_facets(self, args):
+        """
+        List or drop the cached value counts used by field.
+
+        facets          list the cached fields
+        facets drop     drop every cached field
+        facets drop <field>
+
+        Cached counts are brought up to date with recipes collected since they were last read,
+        and rebuilt if recipes have been updated; drop them to count them again regardless.
+        """
+
+        args = args.split()
+        try:
+            if not args:
+                for table in self.mgr.list_facets():
+                    self.stdout.write("%-25s %6d value(s), counted to %s UTC\n" % (table["field"], table["values"],
+                                      table["watermark"].strftime("%Y-%m-%d %H:%M:%S")))
+            elif args[0] == "drop" and len(args) <= 2:
+                count = self.mgr.invalidate_facets(args[1] if len(args) == 2 else None)
+                self.stdout.write("Dropped %d cached field(s)\n" % count)
+            else:
+                self.stderr.write("Usage: facets [drop [field]]\n")
+        except Exception as exc:
+            self.stderr.write("Operation failed!\n")
+            self.stderr.write(traceback.format_exc())
+
     def do_drop(self, index):
         """
         Drop an index by name.
@@ -1,4 +1,5 @@
 from .base import RecipeUtilPager
+from ..profiling import profiled
 
 class FieldList(RecipeUtilPager, object):
 
@@ -10,6 +11,7 @@ class FieldList(RecipeUtilPager, object):
         self.prompt = "viewing %s (page %d of %d): " % (field, 1, self.last_page)
         self.display_page(0)
 
+    @profiled("render")
     def display_page(self, page):
 
         try:
@@ -9,6 +9,7 @@ from .base import RecipeUtilBase
 from .fields import FieldList
 from .recipes import RecipeList
 from .admin import RecipeAdmin
+from ..profiling import profiled
 
 class RecipeUtil(RecipeUtilBase):
 
@@ -56,7 +57,43 @@ class RecipeUtil(RecipeUtilBase):
                 recipeCuisine = self.search_params["recipeCuisine"],
                 op = "$and" if self.search_params["operator"] == "all" else "$or"
         )
-        if recipes["total"] == 0:
+        if not recipes.page(0, self.lines):
+            self.stdout.write("No results!\n")
+            return
+
+        rl = RecipeList(self.lines, self.line_length, recipes, self.mgr)
+        rl.cmdloop()
+
+    def do_pantry(self, args):
+        """
+        Find recipes you can make with what you have, with the currently set constraints applied.
+
+        pantry [missing=<n>] item, item, ...
+
+        Recipes are listed by the share of their ingredients covered by the items (water, salt
+        and pepper are assumed), or with missing=<n>, only those missing at most <n> ingredients.
+        """
+
+        m = re.match("(?:missing\s*=\s*(\d+)\s+)?(.*)", args.strip())
+        max_missing, items = m.groups()
+        if not items.strip():
+            self.stderr.write("Usage: pantry [missing=<n>] item, item, ...\n")
+            return
+
+        if self.mgr.pantry_index is None:
+            self.stderr.write("No pantry index\n")
+            return
+        if self.mgr.pantry_index_info() is None:
+            self.stdout.write("Building pantry index...\n")
+
+        recipes = self.mgr.pantry(
+                items,
+                max_missing = None if max_missing is None else int(max_missing),
+                recipeCategory = self.search_params["recipeCategory"], 
+                recipeCuisine = self.search_params["recipeCuisine"],
+                op = "$and" if self.search_params["operator"] == "all" else "$or"
+        )
+        if not recipes.page(0, self.lines):
             self.stdout.write("No results!\n")
             return
 
@@ -78,17 +115,32 @@ class RecipeUtil(RecipeUtilBase):
 
         self.stdout.write("%d\n" % self.mgr.count())
 
+    @profiled("render")
     def do_stats(self, args):
         """
         Display information about fields used in this collection.
+
+        stats [recompute]
+
+        Counts are kept up to date by the crawler once they have been computed; use recompute
+        to count them again from the recipes (e.g. if they are marked out of date).
         """
 
+        recompute = args.strip() == "recompute"
+        if args.strip() and not recompute:
+            self.stderr.write("Usage: stats [recompute]\n")
+            return
+
+        stats = self.mgr.collection_stats(recompute)
         self.stdout.write("\n")
-        self.stdout.write("Total recipes: %d\n" % self.mgr.count())
+        self.stdout.write("Total recipes: %d\n" % stats["total"])
         self.stdout.write("\n")
-        for field, count in sorted(self.mgr.field_info().items(), key = lambda v: v[0]):
+        for field, count in sorted(stats["fields"].items(), key = lambda v: v[0]):
             self.stdout.write("%-25s%d\n" % (field, count))
         self.stdout.write("\n")
+        self.stdout.write("Updated %s UTC%s\n" % (stats["update_time"].strftime("%Y-%m-%d %H:%M:%S"),
+                          " (out of date, use 'stats recompute')" if stats.get("stale") else ""))
+        self.stdout.write("\n")
 
     def do_sample(self, size):
         """
@@ -102,6 +154,10 @@ class RecipeUtil(RecipeUtilBase):
             return
 
         recipes = self.mgr.sample(size)
+        if not recipes.page(0, self.lines):
+            self.stdout.write("No results!\n")
+            return
+
         rl = RecipeList(self.lines, self.line_length, recipes, self.mgr)
         rl.cmdloop()
 
@@ -1,17 +1,21 @@
+from math import ceil
+
 from .base import RecipeUtilPager
 
 from ..collection.manager import RECIPE_PROJECTION, RECIPE_INFO_PROJECTION
+from ..profiling import profiled
 
 class RecipeList(RecipeUtilPager, object):
 
     def __init__(self, lines, line_length, recipes, mgr):
 
-        super(RecipeList, self).__init__(lines, line_length, recipes["total"])
+        super(RecipeList, self).__init__(lines, line_length, recipes.total)
         self.recipes = recipes
         self.mgr = mgr
-        self.prompt = "recipes (page %d of %d): " % (1, self.last_page)
+        self.prompt = "recipes (page %d of %s): " % (1, self.page_count())
         self.display_page(0)
 
+    @profiled("render")
     def do_recipe(self, num):
         """
         Display recipe <n>.
@@ -23,20 +27,19 @@ class RecipeList(RecipeUtilPager, object):
             self.stderr.write("Invalid recipe number!\n")
             return
 
-        if recipe < 0 or recipe >= len(self.recipes["objects"]):
+        selected = self.recipes.get(recipe)
+        if selected is None:
             self.stderr.write("Invalid recipe number!\n")
             return
 
         try:
-            name = self.recipes["objects"][recipe]["name"]
-            rcp = self.mgr.search(name = name, projection = RECIPE_PROJECTION)
-            if len(rcp) == 0:
+            rcp = self.mgr.get_recipe(selected["_id"])
+            if rcp is None:
                 raise Exception("No recipes found!")
         except Exception as exc:
             self.stderr.write("Recipe could not be retrieved!\n")
             return
 
-        rcp = rcp["objects"][0]
         self.stdout.write("\n%s\n\n" % rcp["name"])
         for field, text in zip([ "recipeYield", "totalTime", "prepTime", "cookTime" ],
                                [ "Yield", "Total time", "Prep time", "Cooking time" ]):
@@ -71,20 +74,38 @@ class RecipeList(RecipeUtilPager, object):
         lines.append(current)
         return "\n".join([ " ".join(line) for line in lines ])
 
+    def page_count(self):
+        """The number of pages, followed by + if the total is only a lower bound."""
+
+        self.last_page = int(ceil(self.recipes.total / float(self.lines)))
+        return "%d%s" % (self.last_page, "" if self.recipes.exact else "+")
+
+    @profiled("render")
     def display_page(self, page):
+        """Display a page of recipes, retrieving only the recipes on that page."""
 
         try:
-            super(RecipeList, self).display_page(page)
+            if self.recipes.exact:
+                super(RecipeList, self).display_page(page)
+            elif page < 0:
+                raise Exception("Cannot go beyond first page")
+            recipes = self.recipes.page(page, self.lines)
+            if not recipes:
+                raise Exception("Cannot go beyond last page")
         except Exception as exc:
             self.stderr.write("%s\n" % str(exc))
             return
 
-        first, last = page * self.lines, min([ (page + 1) * self.lines, len(self.recipes["objects"]) ])
-        current = first
+        self.current = page
+        current = page * self.lines
         self.stdout.write("\n")
-        for rcp in self.recipes["objects"][first:last]:
+        for rcp in recipes:
             current += 1
-            self.stdout.write("  %4d. %s\n" % (current, rcp["name"]) )
+            if "missing" in rcp:
+                self.stdout.write("  %4d. %s (%d of %d, %d missing)\n" %
+                                  (current, rcp["name"], rcp["covered"], rcp["ingredients"], rcp["missing"]))
+            else:
+                self.stdout.write("  %4d. %s\n" % (current, rcp["name"]) )
         self.stdout.write("\n")
-        self.prompt = "recipes (page %d of %d): " % (page + 1, self.last_page)
+        self.prompt = "recipes (page %d of %s): " % (page + 1, self.page_count())
 
@@ -0,0 +1,125 @@
+import os, gzip, zlib
+import logging
+from datetime import datetime
+from threading import Lock
+
+class PageArchive(object):
+    """
+    Append-only archive of raw pages, so that recipes can be extracted again without
+    downloading anything.
+
+    Pages are stored as WARC-style resource records in numbered segment files.  Each record
+    is a separate gzip member, so a record can be read from its offset without decompressing
+    the rest of the segment.  The url, segment, offset and length of each record are
+    appended to a tab separated index; if a url is archived more than once, the latest
+    record is used.
+    """
+
+    def __init__(self, path, segment_size = 100 * 1024 ** 2):
+
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.segment_size = segment_size
+        self.lock = Lock()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.index_path = os.path.join(path, "index.tsv")
+        self.entries = { }
+        self.segment = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as index:
+                for line in index:
+                    url, segment, offset, length = line.rstrip("\n").split("\t")
+                    self.entries[url] = (int(segment), int(offset), int(length))
+                    self.segment = max([ self.segment, int(segment) ])
+
+        self.index = None
+        self.output = None
+
+    def __contains__(self, url): return url in self.entries
+
+    def __len__(self): return len(self.entries)
+
+    def segment_path(self, segment):
+
+        return os.path.join(self.path, "segment-%05d.warc.gz" % segment)
+
+    def write(self, url, content):
+        """Append a page to the current segment, starting a new one if it is full."""
+
+        header = "\r\n".join([
+            "WARC/1.0",
+            "WARC-Type: resource",
+            "WARC-Target-URI: %s" % url,
+            "WARC-Date: %s" % datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "Content-Type: text/html",
+            "Content-Length: %d" % len(content),
+        ]) + "\r\n\r\n"
+        record = gzip.compress(header.encode("utf-8") + content + b"\r\n\r\n")
+
+        with self.lock:
+            if self.output is None or self.output.tell() >= self.segment_size:
+                self.open_segment()
+            offset = self.output.tell()
+            self.output.write(record)
+            self.output.flush()
+            self.index.write("%s\t%d\t%d\t%d\n" % (url, self.segment, offset, len(record)))
+            self.index.flush()
+            self.entries[url] = (self.segment, offset, len(record))
+
+    def open_segment(self):
+
+        if self.output is not None:
+            self.output.close()
+            self.segment += 1
+        elif os.path.exists(self.segment_path(self.segment)) and \
+          os.path.getsize(self.segment_path(self.segment)) >= self.segment_size:
+            self.segment += 1
+        self.output = open(self.segment_path(self.segment), "ab")
+        if self.index is None:
+            self.index = open(self.index_path, "a")
+        self.logger.debug("Writing to %s" % self.segment_path(self.segment))
+
+    def read_record(self, data):
+        """Split a decompressed record into the url and content."""
+
+        header, sep, content = data.partition(b"\r\n\r\n")
+        fields = dict([ line.split(": ", 1) for line in header.decode("utf-8").split("\r\n")[1:] ])
+        length = int(fields["Content-Length"])
+        return fields["WARC-Target-URI"], content[:length]
+
+    def get(self, url):
+        """Return the latest archived content for a url, or None."""
+
+        if url not in self.entries:
+            return None
+        segment, offset, length = self.entries[url]
+        with open(self.segment_path(segment), "rb") as seg:
+            seg.seek(offset)
+            return self.read_record(zlib.decompress(seg.read(length), 31))[1]
+
+    def pages(self):
+        """
+        Yield (url, content) for the latest record of every url in the archive, reading each
+        segment sequentially.
+        """
+
+        latest = { }
+        for url, (segment, offset, length) in self.entries.items():
+            latest.setdefault(segment, [ ]).append((offset, length, url))
+
+        for segment in sorted(latest):
+            with open(self.segment_path(segment), "rb") as seg:
+                for offset, length, url in sorted(latest[segment]):
+                    seg.seek(offset)
+                    yield self.read_record(zlib.decompress(seg.read(length), 31))
+
+    def close(self):
+
+        with self.lock:
+            for f in [ self.output, self.index ]:
+                if f is not None:
+                    f.close()
+            self.output, self.index = None, None
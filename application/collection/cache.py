@@ -0,0 +1,106 @@
+import sqlite3, zlib, time
+import logging
+from threading import Lock
+
+class ResponseCache(object):
+    """
+    On-disk cache of responses, keyed by url, used to make conditional requests.  Only
+    responses with an ETag or Last-Modified header are stored, since there is no way to
+    revalidate anything else.  Bodies are compressed, and the least recently used entries are
+    evicted once the compressed bodies take up more than max_size bytes.
+    """
+
+    def __init__(self, path, max_size = 1024 ** 3):
+
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.max_size = max_size
+        self.lock = Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        self.db.execute("pragma journal_mode = wal")
+        self.db.execute("""create table if not exists responses (
+            url text primary key, etag text, last_modified text,
+            body blob, size integer, stored real, accessed real
+        )""")
+        self.db.execute("create index if not exists responses_accessed on responses (accessed)")
+        self.size = self.db.execute("select coalesce(sum(size), 0) from responses").fetchone()[0]
+        self.stats = { "hits": 0, "misses": 0, "stored": 0, "evicted": 0, "bytes_saved": 0 }
+
+    def headers(self, url):
+        """Conditional request headers for a url, if there is a cached response for it."""
+
+        with self.lock:
+            row = self.db.execute("select etag, last_modified from responses where url = ?", (url, )).fetchone()
+        headers = { }
+        if row is not None:
+            etag, last_modified = row
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def get(self, url):
+        """Return the cached body for a url after a 304 response, or None if it has been evicted."""
+
+        with self.lock:
+            row = self.db.execute("select body from responses where url = ?", (url, )).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.db.execute("update responses set accessed = ? where url = ?", (time.time(), url))
+            self.db.commit()
+            body = zlib.decompress(row[0])
+            self.stats["hits"] += 1
+            self.stats["bytes_saved"] += len(body)
+            return body
+
+    def store(self, url, resp):
+        """Store a response if it can be revalidated later."""
+
+        etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+        with self.lock:
+            self.stats["misses"] += 1
+            if etag is None and last_modified is None:
+                return
+            body = zlib.compress(resp.content)
+            row = self.db.execute("select size from responses where url = ?", (url, )).fetchone()
+            now = time.time()
+            self.db.execute("insert or replace into responses values (?, ?, ?, ?, ?, ?, ?)",
+                            (url, etag, last_modified, body, len(body), now, now))
+            self.size += len(body) - (row[0] if row else 0)
+            self.stats["stored"] += 1
+            if self.size > self.max_size:
+                self.evict()
+            self.db.commit()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is under 90% of its maximum size."""
+
+        target = self.max_size * 0.9
+        rows = self.db.execute("select url, size from responses order by accessed")
+        remove = [ ]
+        for url, size in rows:
+            if self.size <= target:
+                break
+            remove.append((url, ))
+            self.size -= size
+        self.db.executemany("delete from responses where url = ?", remove)
+        self.stats["evicted"] += len(remove)
+        self.logger.debug("Evicted %d response(s) from cache" % len(remove))
+
+    def summary(self):
+
+        requests = self.stats["hits"] + self.stats["misses"]
+        return "Cache: %d hit(s), %d miss(es) (%.0f%% hit rate), %d stored, %d evicted, %.1f MB saved, %.1f MB used" % (
+            self.stats["hits"], self.stats["misses"],
+            100.0 * self.stats["hits"] / requests if requests else 0,
+            self.stats["stored"], self.stats["evicted"],
+            self.stats["bytes_saved"] / 1024.0 ** 2, self.size / 1024.0 ** 2)
+
+    def close(self):
+
+        with self.lock:
+            self.db.commit()
+            self.db.close()
@@ -1,10 +1,21 @@
-import requests, json, re
-from requests import HTTPError, Timeout
-from urllib.parse import urljoin
+from requests import HTTPError, RequestException, Timeout
 import logging, time
+import pymongo
 from datetime import datetime
+from queue import Queue, Empty
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from lxml import html
 
+from .scheduler import HostScheduler, RetryLater
+from .session import make_session
+from .frontier import Frontier, LinkStream
+from .extractor import Extractor
+from .pipeline import RecordWriter, init_parser, parse_page, timed_parse
+from .telemetry import Telemetry
+from .writer import BulkWriter
+from .indexes import has_index, create_url_index
+from ..profiling import region
+
 class Collector(object):
     """
     Library for collecting annotated recipes: http://schema.org/Recipe
@@ -12,149 +23,518 @@ class Collector(object):
 
     def __init__(self, collection, links, site_profile,
                  store_fields, required_fields,
-                 link_depth = 0, pause = 10, timeout = 60, max_retries = 2):
+                 link_depth = 0, pause = 10, timeout = 60, max_retries = 2,
+                 concurrency = 1, min_pause = None, lookahead = 1000, session = None,
+                 bloom_capacity = None, batch_size = 500, frontier = None, cache = None,
+                 archive = None, parse_workers = 0, queue_size = 100, writer = None,
+                 telemetry = None, field_stats = None):
 
         """
         Store or update the specified fields from recipes in a list of links, each request, 
         ignoring recipes if any required fields are missing, and optionally crawls a site to
         the specified depth based on the parameters in the site profile.
+
+        If concurrency is greater than one, up to that many pages are retrieved at once by a
+        pool of worker threads.  The pause is the initial wait between requests to each host;
+        hosts that respond successfully are gradually sped up to min_pause, and hosts that
+        return 429 or 503 are slowed down (see HostScheduler).
+
+        Requests are made with the supplied session, or one created for this collector.  If a
+        ResponseCache is supplied, pages that have been retrieved before are only downloaded
+        again if they have changed.  If a PageArchive is supplied, the raw pages are kept so
+        that recipes can be extracted again later with reextract.
+
+        Links are tracked by a Frontier; for very large crawls, bloom_capacity (the expected
+        number of urls) replaces the set of seen urls with a fixed size bloom filter.  A
+        frontier (e.g. a JournaledFrontier, to make the crawl resumable) can also be supplied.
+        Links are checked against the collection in batches of batch_size.
+
+        Links may be a list or a generator; a generator is consumed in the background while
+        pages are being retrieved, buffering up to lookahead links.
+
+        If parse_workers is greater than zero, retrieved pages are parsed in a pool of that
+        many processes and records are stored by a separate writer thread; queue_size limits
+        the number of pages waiting at each of those stages.
+
+        Records are stored in bulk by the supplied BulkWriter, or one created for this
+        collector; call close when the collector is no longer needed.  If a FieldStats is
+        supplied, its stats document is kept up to date as records are stored.  A page with
+        recipes is only marked done in the frontier once the batch holding them has been
+        written, so a resumed crawl retrieves it again if they were still buffered.
+
+        Timings and counts for every stage are kept in the supplied Telemetry (or one created
+        for this collector), which logs a status line periodically.
         """
 
         self.logger = logging.getLogger(__name__)
         self.collection = collection
+        if telemetry is None:
+            telemetry = Telemetry()
+        self.telemetry = telemetry
+        if writer is None:
+            writer = BulkWriter(collection, telemetry = telemetry, field_stats = field_stats)
+        elif field_stats is not None:
+            writer.field_stats = field_stats
+        self.writer = writer
+        self.field_stats = writer.field_stats
+        self.written = Queue()
+        self.unwritten = { }
 
         # General options
         self.store_fields = store_fields
         self.required_fields = required_fields
         self.links = links
         self.link_depth = link_depth
-        self.link_queue = [ ]
+        if frontier is None:
+            frontier = Frontier(bloom_capacity = bloom_capacity)
+        self.frontier = frontier
+        if isinstance(links, (list, tuple, set)):
+            for url in links:
+                self.frontier.add(url, link_depth)
+            self.frontier.seeded(link_depth)
+        else:
+            self.frontier.add_source(link_depth, LinkStream(links, lookahead))
+        self.batch_size = batch_size
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size
 
         # Network options
         self.pause = pause
         self.max_retries = max_retries
         self.timeout = timeout
         self.retry_interval = 60
+        self.concurrency = max(1, concurrency)
+        self.lookahead = lookahead
+        self.scheduler = HostScheduler(pause, min_pause)
+        if session is None:
+            session = make_session(timeout, pool_maxsize = self.concurrency)
+        self.session = session
+        self.cache = cache
+        self.archive = archive
 
         # Site specific parameters
-
-        self.base_url = site_profile.get("base_url", None)
-        if self.base_url is None:
-            raise Exception("You must specify a base url!")
-        self.link_prefix = site_profile.get("link_prefix", "")
-
-        extract_method = site_profile.get("extract_method", None)
-        if extract_method == "microdata":
-            self.extract = self.extract_from_html
-            self.scope = "//*[@itemtype='http://schema.org/Recipe']"
-            self.attribute = "itemprop"
-        elif extract_method == "RDFa":
-            self.extract = self.extract_from_html
-            self.scope = "//*[@typeof='Recipe']"
-            self.attribute = "property"
-        elif extract_method == "json-ld":
-            self.extract = self.extract_from_json_ld
-        else:
-            raise Exception("Invalid extraction method!  Valid methods: json-ld, microdata, RDFa")
+        self.extractor = Extractor(site_profile, store_fields, required_fields)
+        self.extract = self.extractor.extract
 
     def process_links(self):
         """Process the provided list of links, collecting unseen recipes, and other links to follow,
-        where applicable; manages the link queue to stop collection at the specified depth."""
+        where applicable; uses the frontier to stop collection at the specified depth."""
 
-        self.logger.info("Current depth is %d, list contains %d items" % 
-                         (self.link_depth, len(self.links)))
+        self.ensure_url_index()
+        start, self.pages = time.time(), 0
+        self.writer.on_write = self.records_written
 
-        for url in self.links:
+        if self.parse_workers > 0:
+            parser = ProcessPoolExecutor(max_workers = self.parse_workers,
+                                         initializer = init_parser, initargs = (self.extractor, ))
+            record_writer = RecordWriter(self.writer, self.queue_size)
 
-            duplicate = True if self.collection.find_one({ "url": url }) else False
-            if duplicate and self.link_depth == 0:
-                self.logger.info("Skipping url: %s" % url)
-                continue
+        try:
+            while True:
+
+                self.logger.info("Current depth is %d, list contains %d items" % 
+                                 (self.link_depth, self.frontier.size(self.link_depth)))
 
+                duplicates = set()
+                pages = self.fetch_pages(self.unseen_links(duplicates))
+                if self.parse_workers > 0:
+                    self.process_staged(pages, duplicates, parser, record_writer)
+                else:
+                    self.process_pages(pages, duplicates)
+
+                if self.link_depth == 0:
+                    break
+                self.link_depth -= 1
+        finally:
+            if self.parse_workers > 0:
+                parser.shutdown()
+                record_writer.close()
+            self.writer.flush()
+            self.writer.on_write = None
+            self.mark_written()
+            self.frontier.close()
+
+        self.log_summary(start, self.pages)
+        for depth, counts in self.frontier.summary().items():
+            self.logger.info("Depth %d: %s" % (depth, ", ".join([ "%s %d" % item for item in counts.items() ])))
+
+    def process_pages(self, pages, duplicates):
+        """Extract recipes and links from pages as they are retrieved."""
+
+        for url, page in pages:
             try:
-                data = self.get_url(url)
-                if not duplicate:
-                    n = self.get_recipe(data, url)
-                    self.logger.info("Found %d recipe(s)" % n)
+                content = page.result()
+                self.pages += 1
+                self.telemetry.count("pages")
+                records, links, timings, rejected = timed_parse(self.extractor, content, url,
+                                                                url not in duplicates, self.link_depth > 0)
+                self.record_parse(timings, records, rejected)
                 if self.link_depth > 0:
-                    n = self.get_links(data)
+                    n = self.add_links(links)
                     self.logger.info("Added %d link(s) to queue" % n)
+                if url not in duplicates and records:
+                    self.unwritten[url] = [ len(records), self.link_depth ]
+                    n = self.store_records(records)
+                    self.logger.info("Found %d recipe(s)" % n)
+                else:
+                    self.frontier.done(url, self.link_depth)
             except Exception as exc:
                 self.logger.error("Processing %s failed" % url, exc_info = True)
-            time.sleep(self.pause)
+                self.unwritten.pop(url, None)
+                self.frontier.failed(url, self.link_depth)
+                self.telemetry.count("failures")
+            self.mark_written()
+            self.report_status()
 
-        if self.link_depth > 0:
-            self.links = self.link_queue
-            self.link_queue = [ ]
-            self.link_depth -= 1
-            self.process_links()
-
-    def get_url(self, url):
+    def process_staged(self, pages, duplicates, parser, record_writer):
+        """
+        Pipeline for retrieved page content: pages are parsed in the parser process pool, links
+        are added to the frontier here, and records are passed to the writer.  Up to queue size
+        pages are parsed at once before waiting for results.
         """
-        Retrieve a page and parse it.  Takes a url and returns the parsed html."""
 
-        tries = 0
-        while tries <= self.max_retries:
-            tries += 1
-            self.logger.info("Retrieving %s (try %d)" % (url, tries))
+        parsing = { }
+        for url, page in pages:
+
             try:
-                resp = requests.get(url, timeout = self.timeout)
-                resp.raise_for_status()
-            except HTTPError as exc:
-                if resp.status_code == 404:
-                    self.logger.error("Page not found: %s" % url)
-                    break
-                self.logger.warn("Request failed with status %d: %s" % (resp.status_code, url))
-                time.sleep(self.retry_interval * tries)
-                continue
-            except Timeout as exc:
-                self.logger.error("Timed out: %s" % url)
-                time.sleep(self.retry_interval * tries)
+                content = page.result()
+                self.pages += 1
+                self.telemetry.count("pages")
+            except Exception as exc:
+                self.logger.error("Processing %s failed" % url, exc_info = True)
+                self.frontier.failed(url, self.link_depth)
+                self.telemetry.count("failures")
                 continue
+
+            parsing[parser.submit(parse_page, content, url,
+                                  url not in duplicates, self.link_depth > 0)] = url
+            if len(parsing) >= self.queue_size:
+                done, _ = wait(parsing, return_when = FIRST_COMPLETED)
+                self.finish_parsing(done, parsing, record_writer)
+
+            self.telemetry.set_queue("parsing", len(parsing))
+            self.telemetry.set_queue("storing", record_writer.queue.qsize())
+            self.mark_written()
+            self.report_status()
+
+        while parsing:
+            done, _ = wait(parsing, return_when = FIRST_COMPLETED)
+            self.finish_parsing(done, parsing, record_writer)
+        self.telemetry.set_queue("parsing", 0)
+
+    def finish_parsing(self, done, parsing, record_writer):
+
+        for result in done:
+            url = parsing.pop(result)
+            try:
+                records, links, timings, rejected = result.result()
+                self.record_parse(timings, records, rejected)
+                if self.link_depth > 0:
+                    n = self.add_links(links)
+                    self.logger.info("Added %d link(s) to queue" % n)
+                if records:
+                    self.unwritten[url] = [ len(records), self.link_depth ]
+                    record_writer.put(url, records)
+                else:
+                    self.frontier.done(url, self.link_depth)
             except Exception as exc:
-                self.logger.error("Unexpected error: %s" % url, exc_info = True)
-            break
+                self.logger.error("Processing %s failed" % url, exc_info = True)
+                self.unwritten.pop(url, None)
+                self.frontier.failed(url, self.link_depth)
+                self.telemetry.count("failures")
 
-        if tries > self.max_retries:
-            raise Exception("Request failed, max retries exceeded: %s" %url)
+    def records_written(self, written, failed):
+        """Called by the writer after each batch; the frontier is updated by mark_written."""
+
+        self.written.put((written, failed))
+
+    def mark_written(self):
+        """
+        Mark pages done once all their records have been written, or failed if any of them
+        couldn't be.  Runs in the crawl thread, as the frontier isn't shared between threads.
+        """
+
+        while True:
+            try:
+                written, failed = self.written.get(block = False)
+            except Empty:
+                break
+            for url in failed:
+                if url in self.unwritten:
+                    count, depth = self.unwritten.pop(url)
+                    self.frontier.failed(url, depth)
+                    self.telemetry.count("failures")
+            for url in written:
+                if url in self.unwritten:
+                    self.unwritten[url][0] -= 1
+                    if self.unwritten[url][0] == 0:
+                        count, depth = self.unwritten.pop(url)
+                        self.frontier.done(url, depth)
+
+    def record_parse(self, timings, records, rejected):
+
+        for stage, elapsed in timings.items():
+            self.telemetry.timed(stage, elapsed)
+        self.telemetry.count("records_accepted", len(records))
+        self.telemetry.count("records_rejected", rejected)
+
+    def report_status(self):
+
+        self.telemetry.set_queue("frontier", len(self.frontier))
+        self.telemetry.set_queue("write_buffer", len(self.writer.operations))
+        self.telemetry.report()
+
+    def log_summary(self, start, pages):
+
+        elapsed = time.time() - start
+        self.logger.info("Retrieved %d page(s) in %.1fs (%.2f pages/s)" %
+                         (pages, elapsed, pages / elapsed if elapsed > 0 else 0.0))
+        self.logger.info(self.writer.summary())
+        if self.cache is not None:
+            self.logger.info(self.cache.summary())
+        self.report_status()
+        self.telemetry.report(force = True)
+
+    def unseen_links(self, duplicates):
+        """
+        Yield the links at the current depth that need to be retrieved.  Links that have
+        already been collected are skipped, unless they need to be crawled for other links,
+        in which case they are added to duplicates.
+        """
+
+        while True:
+            batch = self.frontier.take(self.link_depth, self.batch_size)
+            if not batch:
+                break
+            stored = self.stored_records(batch)
+            for url in batch:
+                if url in stored:
+                    if self.link_depth == 0:
+                        self.logger.info("Skipping url: %s" % url)
+                        self.frontier.done(url, self.link_depth)
+                        continue
+                    duplicates.add(url)
+                yield url
+
+    def batches(self, links):
+        """Group links into lists of up to batch size."""
+
+        batch = [ ]
+        for url in links:
+            batch.append(url)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = [ ]
+        if batch:
+            yield batch
+
+    def stored_records(self, urls, projection = { "url": 1, "_id": 0 }):
+        """Look up a batch of urls with a single query.  Returns stored records by url."""
+
+        return dict([ (record["url"], record) for record in
+                      self.collection.find({ "url": { "$in": urls } }, projection) ])
+
+    def ensure_url_index(self):
+        """Create an index on url, which every lookup depends on, if there isn't one already."""
+
+        if has_index(self.collection.index_information(), [ ("url", pymongo.ASCENDING) ]):
+            return
+        self.logger.info("Creating index on url")
+        create_url_index(self.collection, self.logger)
+
+    def fetch_pages(self, links, fetch = None):
+        """
+        Retrieve a list of links, yielding each url and a future holding the page content (or
+        the result of fetch, if supplied).  Results are yielded in completion order.
+
+        Links are read ahead into the scheduler, which releases them as their hosts allow.
+        Requests that should be retried are deferred by the scheduler instead of blocking the
+        loop, so other hosts (and other links) continue to be processed in the meantime.
+        """
+
+        links = iter(links)
+        exhausted = False
+        pending = { }
+        if fetch is None:
+            fetch = self.get_content
+
+        if self.concurrency > 1:
+            pool = ThreadPoolExecutor(max_workers = self.concurrency)
+            submit = pool.submit
+        else:
+            pool = None
+            submit = self.run_inline
 
         try:
-            data = html.fromstring(resp.content)
+            while True:
+
+                while not exhausted and len(self.scheduler) < self.lookahead:
+                    try:
+                        self.scheduler.add(next(links))
+                    except StopIteration:
+                        exhausted = True
+
+                while len(pending) < self.concurrency:
+                    item = self.scheduler.next()
+                    if item is None:
+                        break
+                    url, tries = item
+                    pending[submit(fetch, url, tries)] = (url, tries)
+                self.telemetry.set_queue("fetching", len(pending))
+
+                if not pending:
+                    delay = self.scheduler.wait_time()
+                    if delay is None and exhausted:
+                        break
+                    time.sleep(delay or 0)
+                    continue
+
+                timeout = None if len(pending) >= self.concurrency else self.scheduler.wait_time()
+                done, _ = wait(pending, timeout = timeout, return_when = FIRST_COMPLETED)
+                for page in done:
+                    url, tries = pending.pop(page)
+                    exc = page.exception()
+                    if isinstance(exc, RetryLater):
+                        self.logger.info(str(exc))
+                        self.telemetry.count("retries")
+                        self.scheduler.add(url, tries + 1, exc.delay)
+                        continue
+                    yield url, page
+        finally:
+            if pool is not None:
+                pool.shutdown(wait = True, cancel_futures = True)
+
+    def run_inline(self, fn, *args):
+        """Run a function in the calling thread, returning a completed future."""
+
+        result = Future()
+        try:
+            result.set_result(fn(*args))
+        except Exception as exc:
+            result.set_exception(exc)
+        return result
+
+    def get_url(self, url, tries = 1):
+        """
+        Retrieve a page and parse it.  Takes a url and returns the parsed html.
+
+        Only one request is made; if it fails with a timeout or an error other than 404,
+        RetryLater is raised with the delay to use, until max retries is exceeded.
+        """
+
+        try:
+            data = html.fromstring(self.get_content(url, tries))
         except Exception as exc:
             raise
 
         return data
 
-    def get_links(self, data):
+    def get_content(self, url, tries = 1):
+        """
+        Retrieve the body of a page.  If there is a cache, the request is made conditional
+        on the cached copy having changed, and the cached copy is returned if it hasn't.
+        """
+
+        headers = self.cache.headers(url) if self.cache is not None else { }
+        self.logger.info("Retrieving %s (try %d)" % (url, tries))
+        resp = self.request(url, tries, headers)
+
+        if resp.status_code == 304:
+            content = self.cache.get(url)
+            if content is not None:
+                self.logger.debug("Not modified: %s" % url)
+                if self.archive is not None and url not in self.archive:
+                    self.archive.write(url, content)
+                return content
+            resp = self.request(url, tries)
+
+        if self.cache is not None:
+            self.cache.store(url, resp)
+        if self.archive is not None:
+            self.archive.write(url, resp.content)
+        return resp.content
+
+    def request(self, url, tries, headers = { }):
+        """
+        Make a single request, reporting the outcome to the scheduler.  Timeouts and other
+        failed requests (e.g. connection errors) slow the host down and are retried later.
+        """
+
+        start = time.time()
+        try:
+            with region("fetch"):
+                resp = self.session.get(url, headers = headers, timeout = self.timeout)
+        except Timeout as exc:
+            self.logger.error("Timed out: %s" % url)
+            self.telemetry.fetched(url, time.time() - start, "timeout")
+            self.retry(url, tries, self.scheduler.feedback(url))
+        except RequestException as exc:
+            self.logger.error("Request failed: %s (%s)" % (url, exc))
+            self.telemetry.fetched(url, time.time() - start, "error")
+            self.retry(url, tries, self.scheduler.feedback(url))
+        self.telemetry.fetched(url, time.time() - start, resp.status_code, len(resp.content))
+
+        delay = self.scheduler.feedback(url, resp.status_code, resp.headers.get("Retry-After"))
+        try:
+            resp.raise_for_status()
+        except HTTPError as exc:
+            if resp.status_code == 404:
+                raise Exception("Page not found: %s" % url)
+            self.logger.warn("Request failed with status %d: %s" % (resp.status_code, url))
+            self.retry(url, tries, delay)
+
+        return resp
+
+    def retry(self, url, tries, delay = 0):
+        """Defer a failed request, or give up if it has been tried too many times."""
+
+        if tries > self.max_retries:
+            raise Exception("Request failed, max retries exceeded: %s" % url)
+        raise RetryLater(url, max([ delay, self.retry_interval * tries ]))
+
+    def add_links(self, links):
         """
-        Extract links to other recipes from a page.  Links are added to the link queue 
-        and the number of links found is returned.
+        Add links to other recipes found on a page to the frontier at the next depth.  Returns
+        the number of new links.
         """
 
         count = 0
-        for link in data.xpath("//*[@href]"):
-            cleaned = re.sub("\?.*", "", link.attrib["href"])
-            cleaned = urljoin(self.base_url, cleaned)
-            if re.match(self.link_prefix, cleaned, flags = re.I) and \
-              cleaned not in self.link_queue + self.links:
-                self.link_queue.append(cleaned)
-                self.logger.debug("Adding link %s" % cleaned)
+        for url in links:
+            if self.frontier.add(url, self.link_depth - 1):
+                self.logger.debug("Adding link %s" % url)
                 count += 1
         return count
 
     def update_recipes(self, update_existing = True):
         """Add fields to existing records and/or update existing fields."""
 
-        for url in self.links:
-
-            existing = self.collection.find_one({ "url": url })
-            if existing is None:
-                self.logger.info("Record does not exist: %s" % url)
-                continue
-
+        self.ensure_url_index()
+        start, pages = time.time(), 0
+        existing = { }
+        def unique_links():
+            # Each url is only updated once, as its stored record is removed when it is
+            seen = set()
+            for url in self.links:
+                if url not in seen:
+                    seen.add(url)
+                    yield url
+        def stored_links():
+            for batch in self.batches(unique_links()):
+                existing.update(self.stored_records(batch, None))
+                for url in batch:
+                    if url not in existing:
+                        self.logger.info("Record does not exist: %s" % url)
+                        continue
+                    yield url
+
+        for url, page in self.fetch_pages(stored_links()):
+
+            current = existing.pop(url, { })
             try:
-                data = self.get_url(url)
-                records = self.extract(data, url)
+                content = page.result()
+                pages += 1
+                self.telemetry.count("pages")
+                records, links = self.extractor.parse(content, url)
             except:
                 self.logger.error("Processing failed for %s" % url, exc_info = True)
                 continue
@@ -164,159 +544,61 @@ class Collector(object):
                     if update_existing:
                         updates = record
                     else:
-                        updates = dict([ (k, v) for k, v in record.items() if k not in existing ])
+                        updates = dict([ (k, v) for k, v in record.items() if k not in current ])
                     updates["update_time"] = datetime.utcnow()
-                    self.collection.update_one({ "url": url }, { "$set": updates })
+                    delta = self.field_stats.delta(updates, current) if self.field_stats is not None else None
+                    self.writer.update({ "url": url }, { "$set": updates }, delta = delta)
+                    # Later records from the page update the same document
+                    current = dict(current, **updates)
                 except Exception as exc:
                     self.logger.error("Could not update record: %s" % record["url"], exc_info = True)
                     continue
                 self.logger.info("Updated %s" % url)
 
-            time.sleep(self.pause)
-
-    def get_recipe(self, data, url):
-        """Extract a recipe from a page and store it according the method specified in the profile."""
+        self.writer.flush()
+        self.log_summary(start, pages)
 
-        records = self.extract(data, url)
-        if len(records) > 0:
-            try:
-                self.collection.insert_many(records)
-            except Exception as exc:
-                self.logger.error("Could not insert records!", exc_info = True)
-        return len(records)
-
-    def extract_from_json_ld(self, data, url):
-        """Extract recipes from json-ld.  Fields are copied directly from json into a mongo document."""
-
-        scripts = data.xpath("//script[@type='application/ld+json']")
-        records = [ ]
+    def reextract(self, archive):
+        """
+        Extract recipes from every page in an archive and store them, without making any
+        requests.  Existing records are updated and new ones inserted, as updates are sent
+        in bulk by the writer.
+        """
 
-        for scr in scripts:
+        self.ensure_url_index()
+        start, pages, count = time.time(), 0, 0
+        for url, content in archive.pages():
 
+            pages += 1
+            self.telemetry.count("pages")
             try:
-                data = json.loads(scr.text)
-            except:
-                continue
-
-            if not isinstance(data, dict):
+                records, links = self.extractor.parse(content, url)
+            except Exception as exc:
+                self.logger.error("Processing failed for %s" % url, exc_info = True)
                 continue
 
-            record = dict([ (k, v) for k, v in data.items() if k in self.store_fields ])
-            if "recipeIngredient" not in record and "ingredients" in data:
-                record["recipeIngredient"] = data["ingredients"]
-
-            record["url"] = url
-            record["collect_time"] = datetime.utcnow()
-
-            if self.validate(record):
-                records.append(record)
-
-        return records
-
-    def extract_from_html(self, data, url):
-        """Extract recipes from html tags.  Fields are extracted based on rules defined in the method."""
-
-        records = [ ]
-        self.logger.debug("Found %d recipes in %s" % (len(data.xpath(self.scope)), url))
-        for rcp in data.xpath(self.scope):
-
-            record = { }
-            for prop in [ "name", "recipeYield", "author" ]:
-                record[prop] = self.extract_text(prop, rcp)
-            for prop in [ "image" ]:
-                record[prop] = self.extract_attribute(prop, [ "content", "src" ], data)
-            for prop in [ "totalTime", "prepTime", "cookTime", "datePublished" ]:
-                record[prop] = self.extract_attribute(prop, [ "content" ], rcp)
-            # I have no idea if cookingMethod should be text or a list because I've never seen it so
-            # using the most general option for it
-            for prop in [ "recipeIngredient", "recipeInstructions", "cookingMethod",
-                          "recipeCategory", "recipeCuisine" ]:
-                record[prop] = self.extract_list(prop, rcp)
-
-            # Older versions of the schema use "ingredients" rather than "recipeIngredient"
-            if not record["recipeIngredient"]:
-                record["recipeIngredient"] = self.extract_list("ingredients", rcp)
-
-            record = dict([ (k, v) for k, v in record.items() if k in self.store_fields ])
-            record["url"] = url
-            record["collect_time"] = datetime.utcnow()
-
-            if self.validate(record):
-                records.append(record)
-
-        return records
-
-    def validate(self, record):
-        """Check for missing fields."""
-
-        self.logger.debug("Validating %s" % record["url"])
-
-        # Remove empty fields
-        for field in list(record.keys()):
-            if record[field] in [ None, "", [ ], { } ]:
-                del record[field]
-
-        # Check for missing fields
-        missing = [ field for field in self.required_fields if field not in record.keys() ]
-        if len(missing) > 0:
-            self.logger.warn("recipe in %s: missing %s" % (record["url"], ", ".join(missing)))
-            return False
-
-        return True
-
-    def extract_attribute(self, property, attributes, data):
-        """Extract timing information: might be a tag attribute rather than tag text."""
-
-        values = self.get_property(property, data)
-        if values:
-            for attr in attributes:
-                try:
-                    return values[0].attrib[attr]
-                except:
-                    continue
-            return self.concat_text(values[0])
-
-    def extract_text(self, property, data):
-        """Extract a single-valued field by concatenating text in subelements."""
-
-        values = self.get_property(property, data)
-        if len(values) != 1:
-            self.logger.debug("Expected one match for %s but found %d!" % (property, len(values)))
-        if values:
-            return self.concat_text(values[0])
-
-    def extract_list(self, property, data):
-        """
-        Extract a list of values by concatenating text in subelements of all matching 
-        elements, unless there is only one element returned; in that case use that
-        element's children.
-
-        Sometimes each item in a list will be tagged with schema fields, but sometimes 
-        only the container will be, in which case, we want it's child elements.
-        """
-
-        values = self.get_property(property, data)
-        if len(values) == 1:
-            return [ self.concat_text(child) for child in values[0].getchildren() ]
-        else:
-            return [ self.concat_text(val) for val in values ]
-
-    def get_property(self, property, data):
-        """
-        Get the property from the schema scope if possible, otherwise anywhere.
-        Could backfire if there are multiple recipe scopes, or inherited properties that
-        could occur in other objects but in my experience, this has never happened.
-        """
+            for record in records:
+                collect_time = record.pop("collect_time")
+                record["update_time"] = datetime.utcnow()
+                self.writer.update({ "url": url },
+                    { "$set": record, "$setOnInsert": { "collect_time": collect_time } }, upsert = True)
+                count += 1
 
-        values = data.xpath("%s//*[@%s='%s']" % (self.scope, self.attribute, property))
-        if len(values) == 0:
-            values = data.xpath("//*[@%s='%s']" % (self.attribute, property))
-        return values
+        self.writer.flush()
+        if self.field_stats is not None and count:
+            # Upserts may or may not add recipes, so the counts have to be recomputed
+            self.writer.update_field_stats(None)
+        self.logger.info("Extracted %d recipe(s) from %d archived page(s)" % (count, pages))
+        self.log_summary(start, pages)
 
-    def concat_text(self, elem):
-        """Concatenate text from all children, stripping extra whitespace."""
+    def store_records(self, records):
+        """Pass records to the writer.  Returns the number of records."""
 
-        s = u" ".join([ frag.strip() for frag in elem.itertext() if re.search("\S", frag) ]) 
-        return re.sub(" (\W )", "\\1", s)
+        for record in records:
+            self.writer.insert(record)
+        return len(records)
 
+    def close(self):
+        """Store any buffered records and stop the writer."""
 
+        self.writer.close()
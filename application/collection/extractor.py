@@ -0,0 +1,330 @@
+import json, re, time
+import logging
+from contextlib import contextmanager
+from urllib.parse import urljoin
+from datetime import datetime
+from lxml import etree, html
+
+from ..profiling import region
+
+NON_SPACE = re.compile("\S")
+SPACE_BEFORE_PUNCTUATION = re.compile(" (\W )")
+EMPTY_PROPERTY = ([ ], [ ])
+JSON_LD_SCRIPT = re.compile(
+    b"<script[^>]*type\\s*=\\s*[\"']?application/ld\\+json[\"']?[^>]*>(.*?)</script\\s*>", re.I | re.S)
+
+class Extractor(object):
+    """
+    Extracts recipes and links from parsed pages according to a site profile.  Kept separate
+    from the collector (and free of network and database connections) so that it can be
+    sent to parser processes.
+    """
+
+    def __init__(self, site_profile, store_fields, required_fields):
+
+        self.logger = logging.getLogger(__name__)
+        self.store_fields = store_fields
+        self.required_fields = required_fields
+        self.rejected = 0
+        self.timings = { }
+
+        self.base_url = site_profile.get("base_url", None)
+        if self.base_url is None:
+            raise Exception("You must specify a base url!")
+        self.link_prefix = site_profile.get("link_prefix", "")
+
+        extract_method = site_profile.get("extract_method", None)
+        self.json_ld = extract_method == "json-ld"
+        if extract_method == "microdata":
+            self.extract = self.extract_from_html
+            self.scope = "//*[@itemtype='http://schema.org/Recipe']"
+            self.attribute = "itemprop"
+        elif extract_method == "RDFa":
+            self.extract = self.extract_from_html
+            self.scope = "//*[@typeof='Recipe']"
+            self.attribute = "property"
+        elif extract_method == "json-ld":
+            self.extract = self.extract_from_json_ld
+        else:
+            raise Exception("Invalid extraction method!  Valid methods: json-ld, microdata, RDFa")
+
+        if extract_method != "json-ld":
+            self.compile_plan()
+
+    def compile_plan(self):
+        """
+        Set up the extraction plan for html: which properties to extract and how, and the
+        queries used to find the recipe scopes and the elements with schema properties.
+        """
+
+        self.plan = [ ]
+        for prop in [ "name", "recipeYield", "author" ]:
+            self.plan.append((prop, "text", None))
+        for prop in [ "image" ]:
+            self.plan.append((prop, "attribute", [ "content", "src" ]))
+        for prop in [ "totalTime", "prepTime", "cookTime", "datePublished" ]:
+            self.plan.append((prop, "attribute", [ "content" ]))
+        # I have no idea if cookingMethod should be text or a list because I've never seen it so
+        # using the most general option for it
+        for prop in [ "recipeIngredient", "recipeInstructions", "cookingMethod",
+                      "recipeCategory", "recipeCuisine" ]:
+            self.plan.append((prop, "list", None))
+
+        self.scope_xpath = etree.XPath(self.scope)
+        self.property_xpath = etree.XPath("//*[@%s]" % self.attribute)
+        self.scoped_property_xpath = etree.XPath("%s//*[@%s]" % (self.scope, self.attribute))
+
+    def __getstate__(self):
+
+        # Compiled queries can't be pickled; they are rebuilt when unpickled
+        state = dict(self.__dict__)
+        for name in [ "scope_xpath", "property_xpath", "scoped_property_xpath" ]:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+        if "plan" in state:
+            self.compile_plan()
+
+    def find_links(self, data):
+        """Return links from a page that match the link prefix, without query strings."""
+
+        links = [ ]
+        for link in data.xpath("//*[@href]"):
+            cleaned = link.attrib["href"].split("?", 1)[0]
+            cleaned = urljoin(self.base_url, cleaned)
+            if re.match(self.link_prefix, cleaned, flags = re.I):
+                links.append(cleaned)
+        return links
+
+    def parse(self, content, url, extract = True, follow_links = False):
+        """
+        Get recipes (if extract is set) and links to follow (if follow_links is set) from the
+        content of a page.  For json-ld, the recipes are found without parsing the html, so
+        the page is only parsed if links are needed.  The time spent parsing html and
+        extracting records is left in timings.
+        """
+
+        data, records, links = None, [ ], [ ]
+        self.timings = { }
+        if extract and self.json_ld:
+            with self.timed("extract"):
+                records = self.extract_from_content(content, url)
+        if extract and (not self.json_ld or records is None):
+            with self.timed("parse"):
+                data = html.fromstring(content)
+            with self.timed("extract"):
+                records = self.extract(data, url)
+        if follow_links:
+            with self.timed("parse"):
+                if data is None:
+                    data = html.fromstring(content)
+                links = self.find_links(data)
+        return records, links
+
+    @contextmanager
+    def timed(self, stage):
+        """Add the time taken by a with block to timings (and mark it as a profiling region)."""
+
+        start = time.time()
+        with region(stage):
+            yield
+        self.timings[stage] = self.timings.get(stage, 0.0) + time.time() - start
+
+    def extract_from_content(self, content, url):
+        """
+        Extract recipes from json-ld by finding the script blocks in the raw page.  Returns None
+        if the blocks can't be decoded as utf-8, in which case the page should be parsed.
+        """
+
+        records = [ ]
+        for block in JSON_LD_SCRIPT.findall(content):
+            try:
+                text = block.decode("utf-8")
+            except UnicodeDecodeError:
+                return None
+            records.extend(self.records_from_json(text, url))
+        return records
+
+    def extract_from_json_ld(self, data, url):
+        """Extract recipes from json-ld.  Fields are copied directly from json into a mongo document."""
+
+        records = [ ]
+        for scr in data.xpath("//script[@type='application/ld+json']"):
+            records.extend(self.records_from_json(scr.text, url))
+        return records
+
+    def records_from_json(self, text, url):
+        """
+        Decode a json-ld block and create records from it.  Recipes may also be found in a
+        list of objects or an @graph array, in which case only objects with a Recipe @type
+        are used.
+        """
+
+        try:
+            data = json.loads(text)
+        except:
+            return [ ]
+
+        if isinstance(data, dict) and "@graph" in data:
+            data = data["@graph"]
+        if isinstance(data, dict):
+            objects = [ data ]
+        elif isinstance(data, list):
+            objects = [ obj for obj in data if isinstance(obj, dict) and self.is_recipe(obj) ]
+        else:
+            return [ ]
+
+        records = [ ]
+        for obj in objects:
+
+            record = dict([ (k, v) for k, v in obj.items() if k in self.store_fields ])
+            if "recipeIngredient" not in record and "ingredients" in obj:
+                record["recipeIngredient"] = obj["ingredients"]
+
+            record["url"] = url
+            record["collect_time"] = datetime.utcnow()
+
+            if self.validate(record):
+                records.append(record)
+
+        return records
+
+    def is_recipe(self, obj):
+
+        types = obj.get("@type", [ ])
+        return "Recipe" in (types if isinstance(types, list) else [ types ])
+
+    def extract_from_html(self, data, url):
+        """
+        Extract recipes from html tags.  Fields are extracted based on rules defined in the
+        extraction plan.
+
+        Properties are looked up in the recipe scope first, but since the scope is matched
+        anywhere in the document, the values are the same for every recipe on the page; they
+        are extracted once and copied to each record.
+        """
+
+        records = [ ]
+        scopes = self.scope_xpath(data)
+        self.logger.debug("Found %d recipes in %s" % (len(scopes), url))
+        if not scopes:
+            return records
+
+        index = self.index_properties(data)
+        fields = { }
+        for prop, method, attributes in self.plan:
+            if method == "text":
+                fields[prop] = self.extract_text(prop, index)
+            elif method == "attribute":
+                fields[prop] = self.extract_attribute(prop, attributes, index)
+            else:
+                fields[prop] = self.extract_list(prop, index)
+
+        # Older versions of the schema use "ingredients" rather than "recipeIngredient"
+        if not fields["recipeIngredient"]:
+            fields["recipeIngredient"] = self.extract_list("ingredients", index)
+
+        for rcp in scopes:
+
+            record = dict([ (k, v) for k, v in fields.items() if k in self.store_fields ])
+            record["url"] = url
+            record["collect_time"] = datetime.utcnow()
+
+            if self.validate(record):
+                records.append(record)
+
+        return records
+
+    def index_properties(self, data):
+        """
+        Find every element with the schema attribute and index them by property name.  For
+        each property, the elements inside a recipe scope and the elements anywhere in the
+        document are kept (in document order), so that later lookups don't need to search
+        the tree again.
+        """
+
+        scoped = set(self.scoped_property_xpath(data))
+        index = { }
+        for elem in self.property_xpath(data):
+            inside, anywhere = index.setdefault(elem.get(self.attribute), ([ ], [ ]))
+            if elem in scoped:
+                inside.append(elem)
+            anywhere.append(elem)
+        return index
+
+    def validate(self, record):
+        """Check for missing fields."""
+
+        self.logger.debug("Validating %s" % record["url"])
+
+        # Remove empty fields
+        for field in list(record.keys()):
+            if record[field] in [ None, "", [ ], { } ]:
+                del record[field]
+
+        # Check for missing fields
+        missing = [ field for field in self.required_fields if field not in record.keys() ]
+        if len(missing) > 0:
+            self.logger.warn("recipe in %s: missing %s" % (record["url"], ", ".join(missing)))
+            self.rejected += 1
+            return False
+
+        return True
+
+    def extract_attribute(self, property, attributes, index):
+        """Extract timing information: might be a tag attribute rather than tag text."""
+
+        values = self.get_property(property, index)
+        if values:
+            for attr in attributes:
+                try:
+                    return values[0].attrib[attr]
+                except:
+                    continue
+            return self.concat_text(values[0])
+
+    def extract_text(self, property, index):
+        """Extract a single-valued field by concatenating text in subelements."""
+
+        values = self.get_property(property, index)
+        if len(values) != 1:
+            self.logger.debug("Expected one match for %s but found %d!" % (property, len(values)))
+        if values:
+            return self.concat_text(values[0])
+
+    def extract_list(self, property, index):
+        """
+        Extract a list of values by concatenating text in subelements of all matching 
+        elements, unless there is only one element returned; in that case use that
+        element's children.
+
+        Sometimes each item in a list will be tagged with schema fields, but sometimes 
+        only the container will be, in which case, we want it's child elements.
+        """
+
+        values = self.get_property(property, index)
+        if len(values) == 1:
+            return [ self.concat_text(child) for child in values[0].getchildren() ]
+        else:
+            return [ self.concat_text(val) for val in values ]
+
+    def get_property(self, property, index):
+        """
+        Get the property from the schema scope if possible, otherwise anywhere.
+        Could backfire if there are multiple recipe scopes, or inherited properties that
+        could occur in other objects but in my experience, this has never happened.
+        """
+
+        inside, anywhere = index.get(property, EMPTY_PROPERTY)
+        return inside if inside else anywhere
+
+    def concat_text(self, elem):
+        """Concatenate text from all children, stripping extra whitespace."""
+
+        s = u" ".join([ frag.strip() for frag in elem.itertext() if NON_SPACE.search(frag) ]) 
+        return SPACE_BEFORE_PUNCTUATION.sub("\\1", s)
+
+
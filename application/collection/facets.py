@@ -0,0 +1,116 @@
+import json
+import logging
+from datetime import datetime, timedelta
+
+import pymongo
+
+# Records are timestamped when they are extracted, and may reach the collection a little
+# later (the writer buffers them for a few seconds), so only records older than this are
+# counted; newer ones are left for the next refresh
+SETTLE_TIME = timedelta(seconds = 60)
+
+def facet_value(value):
+    """
+    A value as a dict key: lists and dicts (e.g. nested lists left by $unwind, or objects) are
+    unhashable, so they are counted by their json.
+    """
+
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, sort_keys = True, default = str)
+    return value
+
+class FacetCache(object):
+    """
+    Value counts for enumerated fields (e.g. recipeCategory), kept in a side collection
+    (<collection>_facets) with one document per field, so that listing the values doesn't
+    require a pass over the whole collection.
+
+    Each table has a watermark: the time up to which records have been counted.  When a table
+    is read, recipes collected since the watermark are counted and added to it.  Counts
+    can't be adjusted for records updated since the watermark (the old values aren't known),
+    so if there are any the table is rebuilt.  Tables are only dropped by invalidate.
+    """
+
+    def __init__(self, collection, settle_time = SETTLE_TIME):
+
+        self.logger = logging.getLogger(__name__)
+        self.collection = collection
+        self.facets = collection.database["%s_facets" % collection.name]
+        self.settle_time = settle_time
+
+    def count_values(self, field, match = None):
+        """Count the values of a field, in records matching match if supplied."""
+
+        prefixed = "$%s" % field
+        pipeline = [ { "$match": match } ] if match else [ ]
+        pipeline += [
+            { "$unwind": prefixed },
+            { "$group": { "_id": prefixed, "count": { "$sum": 1 } } },
+        ]
+        counts = { }
+        for result in self.collection.aggregate(pipeline):
+            value = facet_value(result["_id"])
+            counts[value] = counts.get(value, 0) + result["count"]
+        return counts
+
+    def get(self, field):
+        """Get a dict of value counts for a field, building or refreshing its table as needed."""
+
+        table = self.facets.find_one({ "_id": field })
+        if table is None:
+            return self.build(field)
+        return self.refresh(field, table)
+
+    def build(self, field):
+
+        watermark = datetime.utcnow() - self.settle_time
+        counts = self.count_values(field, { "$or": [
+            { "collect_time": { "$lte": watermark } },
+            { "collect_time": { "$exists": False } },
+        ] })
+        self.save(field, counts, watermark, rebuilt = True)
+        self.logger.debug("Built facet table for %s (%d values)" % (field, len(counts)))
+        return counts
+
+    def refresh(self, field, table):
+
+        counts = dict([ (value, count) for value, count in table["values"] ])
+        previous = table["watermark"]
+        watermark = datetime.utcnow() - self.settle_time
+        if watermark <= previous:
+            return counts
+
+        updated = self.collection.find_one({
+            "update_time": { "$gt": previous, "$lte": watermark },
+            "collect_time": { "$not": { "$gt": previous } },
+        }, { "_id": 1 })
+        if updated is not None:
+            self.logger.debug("Records updated since %s; rebuilding facet table for %s" % (previous, field))
+            return self.build(field)
+
+        added = self.count_values(field, { "collect_time": { "$gt": previous, "$lte": watermark } })
+        for value, count in added.items():
+            counts[value] = counts.get(value, 0) + count
+        self.save(field, counts, watermark)
+        return counts
+
+    def save(self, field, counts, watermark, rebuilt = False):
+
+        # Values may contain characters that aren't allowed in keys, so they're stored as pairs
+        update = { "values": [ [ value, count ] for value, count in counts.items() ], "watermark": watermark }
+        if rebuilt:
+            update["build_time"] = datetime.utcnow()
+        self.facets.update_one({ "_id": field }, { "$set": update }, upsert = True)
+
+    def tables(self):
+        """Summaries of the cached tables: field, number of values, watermark and build time."""
+
+        return [ { "field": table["_id"], "values": len(table["values"]), "watermark": table["watermark"],
+                   "build_time": table.get("build_time") }
+                 for table in self.facets.find().sort("_id", pymongo.ASCENDING) ]
+
+    def invalidate(self, field = None):
+        """Drop the table for a field, or every table.  Returns the number dropped."""
+
+        query = { } if field is None else { "_id": field }
+        return self.facets.delete_many(query).deleted_count
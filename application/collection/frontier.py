@@ -0,0 +1,292 @@
+import hashlib, math
+import json, sqlite3, time
+import logging
+from collections import deque
+from queue import Queue, Empty
+from threading import Thread
+
+class BloomFilter(object):
+    """
+    Fixed size set membership test for very large crawls.  Uses a constant amount of memory
+    regardless of the number of urls added, at the cost of occasional false positives (a url
+    reported as seen that was not), which are bounded by error_rate at the given capacity.
+    """
+
+    def __init__(self, capacity, error_rate = 0.001):
+
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max([ 1, int(round(self.size / float(capacity) * math.log(2))) ])
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size = 16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+        return [ (h1 + i * h2) % self.size for i in range(self.hashes) ]
+
+    def add(self, item):
+
+        for pos in self.positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+
+        return all([ self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self.positions(item) ])
+
+    def __len__(self): return self.count
+
+class LinkStream(object):
+    """
+    Runs a link generator in a background thread so that links are crawled while the rest
+    are still being generated.  At most maxsize links are buffered; the generator is blocked
+    until the crawler catches up.  If the generator raises an exception, the stream ends early
+    and failed is set.
+    """
+
+    finished = object()
+
+    def __init__(self, links, maxsize = 1000):
+
+        self.logger = logging.getLogger(__name__)
+        self.queue = Queue(maxsize)
+        self.exhausted = False
+        self.failed = False
+        self.thread = Thread(target = self.produce, args = (links, ), daemon = True)
+        self.thread.start()
+
+    def produce(self, links):
+
+        try:
+            for url in links:
+                self.queue.put(url)
+        except Exception as exc:
+            self.failed = True
+            self.logger.error("Link generation failed", exc_info = True)
+        finally:
+            self.queue.put(self.finished)
+
+    def get(self, block = True):
+        """Return the next link, or None if there isn't one ready (or there are no more)."""
+
+        try:
+            url = self.queue.get(block)
+        except Empty:
+            return None
+        if url is self.finished:
+            self.exhausted = True
+            return None
+        return url
+
+class Frontier(object):
+    """
+    Crawl frontier: an insertion ordered queue of urls for each depth, plus a record of every
+    url ever queued so that a url is only crawled once no matter how many pages link to it.
+    Adding and checking a url take constant time.
+
+    Depths count down, as in the collector: links found on a page at depth n are queued at
+    depth n - 1, and links at depth 0 are not followed.
+
+    The urls at a depth can also be read from a LinkStream as they are generated.
+    """
+
+    def __init__(self, links = [ ], depth = 0, bloom_capacity = None):
+
+        self.logger = logging.getLogger(__name__)
+        self.seen = set() if bloom_capacity is None else BloomFilter(bloom_capacity)
+        self.queues = { }
+        self.counts = { }
+        self.sources = { }
+        for url in links:
+            self.add(url, depth)
+
+    def get_counts(self, depth):
+
+        if depth not in self.counts:
+            self.counts[depth] = { "queued": 0, "in_progress": 0, "done": 0, "failed": 0 }
+            self.queues[depth] = deque()
+        return self.counts[depth]
+
+    def add(self, url, depth):
+        """Queue a url at the specified depth.  Returns False if it has been seen before."""
+
+        if url in self.seen:
+            return False
+        self.seen.add(url)
+        self.get_counts(depth)["queued"] += 1
+        self.queues[depth].append(url)
+        return True
+
+    def __contains__(self, url): return url in self.seen
+
+    def __len__(self): return sum([ len(queue) for queue in self.queues.values() ])
+
+    def size(self, depth):
+        """Number of urls waiting at the specified depth."""
+
+        return len(self.queues.get(depth, [ ]))
+
+    def add_source(self, depth, source):
+        """
+        Add urls to a depth as they are produced by a LinkStream, rather than all at once.
+        The source is read from when the urls already queued at that depth run out; once it
+        is exhausted, the depth is marked seeded.
+        """
+
+        self.get_counts(depth)
+        self.sources[depth] = source
+
+    def take(self, depth, size = 1):
+        """
+        Remove and return up to size urls queued at a depth.  If there is a source for the
+        depth, any urls it has ready are queued first; if nothing is queued, wait for it to
+        produce something.  Returns an empty list once there is nothing left at the depth.
+        """
+
+        counts, queue = self.get_counts(depth), self.queues[depth]
+
+        source = self.sources.get(depth)
+        while source is not None and len(queue) < size and not source.exhausted:
+            url = source.get(block = not queue)
+            if url is None:
+                break
+            self.add(url, depth)
+        if source is not None and source.exhausted:
+            del self.sources[depth]
+            if not source.failed:
+                self.seeded(depth)
+
+        urls = [ queue.popleft() for i in range(min([ size, len(queue) ])) ]
+        counts["queued"] -= len(urls)
+        counts["in_progress"] += len(urls)
+        return urls
+
+    def seeded(self, depth):
+        """Record that every seed url for a depth has been queued."""
+
+        pass
+
+    def done(self, url, depth):
+        """Record that a url has been processed."""
+
+        counts = self.get_counts(depth)
+        counts["in_progress"] -= 1
+        counts["done"] += 1
+
+    def failed(self, url, depth):
+        """Record that a url could not be processed."""
+
+        counts = self.get_counts(depth)
+        counts["in_progress"] -= 1
+        counts["failed"] += 1
+
+    def summary(self):
+        """Counts of urls in each state, by depth."""
+
+        return dict([ (depth, dict(counts)) for depth, counts in sorted(self.counts.items(), reverse = True) ])
+
+    def close(self): pass
+
+class JournaledFrontier(Frontier):
+    """
+    Frontier that records the state of every url in a sqlite journal so that an interrupted
+    crawl can be resumed.  If the journal already exists, the urls in it are loaded; any that
+    were queued or in progress when the crawl stopped are queued again, and completed urls are
+    not crawled again.
+
+    Seed urls are recorded as they are queued, so a crawl interrupted while its seeds were still
+    being generated has only some of them; the seeded meta value is only set once they have all
+    been queued (see Frontier.seeded), and until then the seeds have to be supplied again when
+    resuming (urls already in the journal are skipped).
+
+    Writes are committed every commit_interval seconds and when the journal is closed.
+    """
+
+    def __init__(self, path, links = [ ], depth = 0, bloom_capacity = None, commit_interval = 5):
+
+        super(JournaledFrontier, self).__init__([ ], depth, bloom_capacity)
+        self.path = path
+        self.commit_interval = commit_interval
+        self.last_commit = time.time()
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("pragma journal_mode = wal")
+        self.db.execute("create table if not exists urls (url text primary key, depth integer, state text)")
+        self.db.execute("create table if not exists meta (key text primary key, value text)")
+
+        for url, url_depth, state in self.db.execute("select url, depth, state from urls order by rowid"):
+            self.seen.add(url)
+            counts = self.get_counts(url_depth)
+            if state in [ "queued", "in_progress" ]:
+                counts["queued"] += 1
+                self.queues[url_depth].append(url)
+            else:
+                counts[state] += 1
+        if len(self.seen):
+            self.logger.info("Loaded %d url(s) from %s, %d queued" % (len(self.seen), path, len(self)))
+
+        for url in links:
+            self.add(url, depth)
+        self.commit()
+
+    def current_depth(self):
+        """The depth to resume from: the deepest level that still has urls queued."""
+
+        depths = [ depth for depth, queue in self.queues.items() if queue ]
+        return max(depths) if depths else None
+
+    def seeded(self, depth):
+
+        self.set_meta("seeded", True)
+
+    def set_meta(self, key, value):
+
+        self.db.execute("insert or replace into meta (key, value) values (?, ?)", (key, json.dumps(value)))
+        self.commit()
+
+    def get_meta(self, key, default = None):
+
+        row = self.db.execute("select value from meta where key = ?", (key, )).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_state(self, url, state):
+
+        self.db.execute("update urls set state = ? where url = ?", (state, url))
+        if time.time() - self.last_commit > self.commit_interval:
+            self.commit()
+
+    def add(self, url, depth):
+
+        added = super(JournaledFrontier, self).add(url, depth)
+        if added:
+            self.db.execute("insert or ignore into urls (url, depth, state) values (?, ?, 'queued')",
+                            (url, depth))
+        return added
+
+    def take(self, depth, size = 1):
+
+        urls = super(JournaledFrontier, self).take(depth, size)
+        for url in urls:
+            self.set_state(url, "in_progress")
+        return urls
+
+    def done(self, url, depth):
+
+        super(JournaledFrontier, self).done(url, depth)
+        self.set_state(url, "done")
+
+    def failed(self, url, depth):
+
+        super(JournaledFrontier, self).failed(url, depth)
+        self.set_state(url, "failed")
+
+    def commit(self):
+
+        self.db.commit()
+        self.last_commit = time.time()
+
+    def close(self):
+
+        self.commit()
+        self.db.close()
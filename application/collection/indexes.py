@@ -0,0 +1,169 @@
+import json
+import logging
+
+import pymongo
+from pymongo.errors import OperationFailure, DuplicateKeyError
+
+from .lru import LRUCache
+
+# Indexes the collector and search depend on, created by Manager.ensure_indexes.  Category
+# and cuisine are usually lists, so their indexes are multikey.  The collect and update times
+# find recently stored recipes (see Manager.latest_write and FacetCache).
+REQUIRED_INDEXES = [
+    { "name": "url", "keys": [ ("url", pymongo.ASCENDING) ], "unique": True },
+    { "name": "recipeCategory", "keys": [ ("recipeCategory", pymongo.ASCENDING) ] },
+    { "name": "recipeCuisine", "keys": [ ("recipeCuisine", pymongo.ASCENDING) ] },
+    { "name": "collect_time", "keys": [ ("collect_time", pymongo.DESCENDING) ] },
+    { "name": "update_time", "keys": [ ("update_time", pymongo.DESCENDING) ] },
+]
+
+# Fields that usually hold lists.  A compound index can include at most one of them.
+ARRAY_FIELDS = [ "recipeCategory", "recipeCuisine", "recipeIngredient", "recipeInstructions", "cookingMethod" ]
+
+def has_index(index_information, keys):
+    """Whether there's an index starting with keys (which can be used in its place)."""
+
+    return any([ list(info["key"])[:len(keys)] == list(keys) for info in index_information.values() ])
+
+def create_url_index(collection, logger):
+    """
+    Create a unique index on url.  A collection with duplicate urls (e.g. from before the
+    index existed) can't have one, so a plain index is created instead and the duplicates
+    logged; once they are removed, drop the url index to have a unique one created.  The
+    index is built in the foreground, as a background build doesn't report duplicates when
+    it is created, which would leave the collection without a url index.
+    """
+
+    keys = [ ("url", pymongo.ASCENDING) ]
+    try:
+        return collection.create_index(keys, name = "url", unique = True)
+    except DuplicateKeyError as exc:
+        logger.warning("Duplicate urls, creating url index without unique constraint: %s" % exc)
+    return collection.create_index(keys, name = "url")
+
+def query_shape(query):
+    """A query with its values replaced, so that queries differing only in values match."""
+
+    if isinstance(query, dict):
+        return dict([ (key, query_shape(value) if key.startswith("$") or isinstance(value, dict) else "?")
+                      for key, value in query.items() ])
+    if isinstance(query, list) and all([ isinstance(item, dict) for item in query ]):
+        return [ query_shape(item) for item in query ]
+    return "?"
+
+def plan_stages(plan):
+    """The stages of a query plan (e.g. from explain), outermost first."""
+
+    stages = [ plan.get("stage") ]
+    for child in [ plan.get("inputStage") ] + plan.get("inputStages", [ ]):
+        if child is not None:
+            stages += plan_stages(child)
+    return stages
+
+def equality_fields(query):
+    """Fields a query constrains in every match (top level and $and), in order."""
+
+    fields = [ ]
+    for key, value in query.items():
+        if key == "$and":
+            for clause in value:
+                fields += [ field for field in equality_fields(clause) if field not in fields ]
+        elif not key.startswith("$") and key not in fields:
+            fields.append(key)
+    return fields
+
+def suggest_index(query, sort):
+    """
+    Suggest an index for a query and sort: the fields it matches on, followed by the fields it
+    sorts on.  Returns a list of (field, direction) keys, or None if no index would help (or
+    the query needs a text index).  $or queries need an index for each clause, so only the
+    first clause is considered.
+    """
+
+    if "$text" in json.dumps(query, default = str):
+        return None
+    if "$or" in query and len(query) == 1:
+        query = query["$or"][0]
+
+    keys, arrays = [ ], 0
+    for field in equality_fields(query):
+        if field in ARRAY_FIELDS:
+            arrays += 1
+            if arrays > 1:
+                continue
+        keys.append((field, pymongo.ASCENDING))
+    for field, direction in sort or [ ]:
+        if isinstance(direction, int) and field not in [ key for key, d in keys ]:
+            keys.append((field, direction))
+    return keys or None
+
+class QueryLog(object):
+    """The most recent query shapes, with the last query seen for each and a count."""
+
+    def __init__(self, max_size = 50):
+
+        self.shapes = LRUCache(max_size)
+
+    def record(self, query, sort = None):
+
+        key = json.dumps([ query_shape(query), sort ], sort_keys = True, default = str)
+        entry = self.shapes.get(key) or { "shape": query_shape(query), "count": 0 }
+        entry.update({ "query": query, "sort": sort, "count": entry["count"] + 1 })
+        self.shapes.put(key, entry)
+
+    def entries(self):
+        """Recorded shapes, most recent first."""
+
+        return list(reversed(list(self.shapes.items.values())))
+
+class IndexAdvisor(object):
+    """
+    Explains recently recorded queries and suggests indexes for any that scan the whole
+    collection or sort in memory.
+    """
+
+    def __init__(self, collection, query_log):
+
+        self.logger = logging.getLogger(__name__)
+        self.collection = collection
+        self.query_log = query_log
+
+    def explain(self, query, sort = None):
+
+        cursor = self.collection.find(query, { "_id": 1 })
+        # Text score sorts need the score projected, and don't affect index use
+        sort = [ (field, direction) for field, direction in sort or [ ] if isinstance(direction, int) ]
+        if sort:
+            cursor = cursor.sort(sort)
+        return cursor.explain()
+
+    def advise(self):
+        """
+        Returns a report for each recorded query shape: the shape, count, plan stages, docs
+        examined and returned, any problems found and the suggested index (or None).
+        """
+
+        existing = [ info["key"] for info in self.collection.index_information().values() ]
+        reports = [ ]
+        for entry in self.query_log.entries():
+            report = { "shape": entry["shape"], "sort": entry["sort"], "count": entry["count"],
+                       "stages": [ ], "examined": None, "returned": None, "problems": [ ], "index": None }
+            reports.append(report)
+            try:
+                explained = self.explain(entry["query"], entry["sort"])
+            except OperationFailure as exc:
+                report["problems"].append(str(exc))
+                continue
+
+            report["stages"] = plan_stages(explained["queryPlanner"]["winningPlan"])
+            stats = explained.get("executionStats", { })
+            report["examined"], report["returned"] = stats.get("totalDocsExamined"), stats.get("nReturned")
+            if "COLLSCAN" in report["stages"]:
+                report["problems"].append("collection scan")
+            if "SORT" in report["stages"]:
+                report["problems"].append("in-memory sort")
+            if report["problems"]:
+                keys = suggest_index(entry["query"], entry["sort"])
+                if keys is not None and not [ key for key in existing if list(key)[:len(keys)] == keys ]:
+                    report["index"] = keys
+        return reports
@@ -0,0 +1,98 @@
+import time
+from collections import OrderedDict
+
+class LRUCache(object):
+    """A dict holding at most max_size items, dropping the least recently used first."""
+
+    def __init__(self, max_size = 256):
+
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default = None):
+
+        if key not in self.items:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last = False)
+
+    def clear(self):
+
+        self.items.clear()
+
+    def __contains__(self, key):
+
+        return key in self.items
+
+    def __len__(self):
+
+        return len(self.items)
+
+class TTLCache(LRUCache):
+    """
+    An LRUCache whose items also expire ttl seconds after they were added.  If max_bytes is
+    given, the least recently used items are dropped while the total size of the items (as
+    measured by sizeof, which is checked again as items are used, in case they grow) is
+    larger.
+    """
+
+    def __init__(self, max_size = 256, ttl = 300, max_bytes = None, sizeof = None):
+
+        super(TTLCache, self).__init__(max_size)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.added = { }
+        self.expired = 0
+        self.evicted = 0
+
+    def get(self, key, default = None):
+
+        if key in self.items and time.time() - self.added[key] > self.ttl:
+            self.remove(key)
+            self.expired += 1
+        value = super(TTLCache, self).get(key, default)
+        self.trim()
+        return value
+
+    def put(self, key, value):
+
+        self.added[key] = time.time()
+        self.items[key] = value
+        self.items.move_to_end(key)
+        self.trim()
+
+    def trim(self):
+
+        while len(self.items) > self.max_size or (len(self.items) > 1 and self.max_bytes is not None and
+                                                  self.size() > self.max_bytes):
+            self.remove(next(iter(self.items)))
+            self.evicted += 1
+
+    def size(self):
+        """The total size of the items, if there's a sizeof."""
+
+        if self.sizeof is None:
+            return 0
+        return sum([ self.sizeof(value) for value in self.items.values() ])
+
+    def remove(self, key):
+
+        del self.items[key]
+        del self.added[key]
+
+    def clear(self):
+
+        super(TTLCache, self).clear()
+        self.added.clear()
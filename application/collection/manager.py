@@ -1,8 +1,19 @@
 import pymongo
 import logging
-import re
+import re, json
+import bson
+from datetime import datetime
 
-DEFAULT_PROJECTION = { "name": 1, "url": 1, "_id": 0 }
+from ..profiling import profiled, region
+from .lru import LRUCache, TTLCache
+from .stats import FieldStats
+from .facets import FacetCache, SETTLE_TIME
+from .textindex import LocalIndex, TEXT_FIELDS, TEXT_WEIGHTS
+from .pantry import PantryIndex, PANTRY_LIMIT, pantry_keys
+from .indexes import REQUIRED_INDEXES, QueryLog, IndexAdvisor, has_index, create_url_index
+
+# Results include the _id (and url) so that each recipe can be retrieved directly
+DEFAULT_PROJECTION = { "name": 1, "url": 1 }
 
 RECIPE_PROJECTION = { 
     "name": 1, 
@@ -27,9 +38,128 @@ RECIPE_INFO_PROJECTION = {
 DEFAULT_SORT = [ ("name", pymongo.ASCENDING) ]
 TEXT_SCORE_SORT = [ ("score", { "$meta": "textScore" }) ]
 
+# Results are retrieved from mongo in batches of this size; search totals are only counted
+# exactly up to COUNT_LIMIT
+BATCH_SIZE = 100
+COUNT_LIMIT = 10000
+
+class Results(object):
+    """
+    Search results, retrieved from mongo as they are needed rather than all at once.
+
+    Results are streamed from a single cursor (opened by open_cursor, with a batch size) and
+    kept as they are retrieved, so paging through them only retrieves what hasn't been seen
+    yet.  A page well beyond the results retrieved so far is fetched on its own by
+    fetch_range (skip, limit), if the query allows it.  Each result is passed to serialize
+    as it is retrieved.
+
+    The total is counted separately, when it is first needed, by count, which returns the
+    total and whether it is exact (it may be an estimate, or a lower bound); once the cursor
+    is exhausted the total is known exactly.  The size (in bytes, as BSON) of the results
+    retrieved so far is kept in size.
+    """
+
+    def __init__(self, open_cursor, count, serialize = None, fetch_range = None, batch_size = BATCH_SIZE):
+
+        self.open_cursor = open_cursor
+        self.count = count
+        self.serialize = serialize
+        self.fetch_range = fetch_range
+        self.batch_size = batch_size
+        self.cursor = None
+        self.objects = [ ]
+        self.exhausted = False
+        self.counted = None
+        self.size = 0
+
+    @property
+    def total(self):
+
+        if self.exhausted:
+            return len(self.objects)
+        if self.counted is None:
+            self.counted = self.count()
+        return max([ self.counted[0], len(self.objects) ])
+
+    @property
+    def exact(self):
+        """Whether the total is exact (counting the results, if that hasn't been done yet)."""
+
+        if self.exhausted:
+            return True
+        if self.counted is None:
+            self.counted = self.count()
+        return self.counted[1]
+
+    def page(self, number, size):
+        """Get the results on a page (numbered from zero) of the given size."""
+
+        return self.get_range(number * size, (number + 1) * size)
+
+    def get(self, index):
+        """Get a single result, or None if there aren't that many."""
+
+        found = self.get_range(index, index + 1) if index >= 0 else [ ]
+        return found[0] if found else None
+
+    def get_range(self, first, last):
+
+        if self.exhausted or self.fetch_range is None or first <= len(self.objects) + self.batch_size:
+            self.fill(last)
+            return self.objects[first:last]
+
+        with region("query"):
+            return [ self.prepare(obj) for obj in self.fetch_range(first, last - first) ]
+
+    @profiled("query")
+    def fill(self, size):
+        """Retrieve results from the cursor until there are size of them or it is exhausted."""
+
+        if self.cursor is None and not self.exhausted:
+            self.cursor = self.open_cursor(self.batch_size)
+        while len(self.objects) < size and not self.exhausted:
+            try:
+                obj = next(self.cursor)
+                self.size += len(bson.BSON.encode(obj))
+                self.objects.append(self.prepare(obj))
+            except StopIteration:
+                self.exhausted = True
+                self.cursor = None
+
+    def prepare(self, obj):
+
+        if self.serialize is not None:
+            self.serialize(obj)
+        return obj
+
+    def __iter__(self):
+
+        index = 0
+        while True:
+            if index >= len(self.objects):
+                self.fill(index + self.batch_size)
+                if index >= len(self.objects):
+                    return
+            yield self.objects[index]
+            index += 1
+
 class Manager(object):
 
-    def __init__(self, mongo_config, collection, store_fields):
+    def __init__(self, mongo_config, collection, store_fields, cache_size = 256,
+                 query_cache_size = 64, query_cache_ttl = 300, query_cache_bytes = 64 * 1024 ** 2,
+                 text_index_path = None, pantry_index_path = None):
+        """
+        Up to cache_size recipes retrieved by get_recipe are cached.  Up to query_cache_size
+        searches are cached (see search) for query_cache_ttl seconds, dropping the least
+        recently used while their results take up more than query_cache_bytes; a
+        query_cache_size of 0 turns the cache off.
+
+        If text_index_path is given, text searches use a LocalIndex kept there instead of
+        mongo's text index; call refresh_text_index to build it or bring it up to date.
+
+        If pantry_index_path is given, pantry searches use a PantryIndex kept there, which is
+        built on the first pantry search (or by refresh_pantry_index).
+        """
 
         try:
             client = pymongo.MongoClient(host = mongo_config["host"], port = mongo_config["port"])
@@ -38,59 +168,97 @@ class Manager(object):
         except Exception as exc:
             raise
         self.store_fields = store_fields
+        self.field_stats = FieldStats(self.collection, store_fields)
+        self.facet_cache = FacetCache(self.collection)
+        self.query_log = QueryLog()
+        self.query_cache = None
+        if query_cache_size > 0:
+            self.query_cache = TTLCache(query_cache_size, query_cache_ttl, query_cache_bytes,
+                                        sizeof = lambda results: results.size)
+        self.latest = None
+        self.invalidations = 0
+        self.text_index = None
+        if text_index_path is not None:
+            self.text_index = LocalIndex(text_index_path, self.collection)
+            self.text_index.open()
+        self.pantry_index = None
+        if pantry_index_path is not None:
+            self.pantry_index = PantryIndex(pantry_index_path, self.collection)
+            self.pantry_index.open()
+        self.recipe_cache = LRUCache(cache_size)
         self.logger = logging.getLogger(__name__)
- 
+
+    @profiled("query")
     def count(self): return self.collection.count()
 
+    @profiled("query")
     def get_enumerated_values(self, field, include_count = False):
-        """Get a list of values and optional counts."""
-
-        prefixed = "$%s" % field
-        unwind = { "$unwind": prefixed }
-        query = {
-            "$group": { 
-                "_id": { "value": prefixed }
-            }
-        }
-        if include_count:
-            query["$group"]["count"] = { "$sum": 1 }
-        sort = { "$sort": { "_id.value": pymongo.ASCENDING } }
+        """
+        Get a list of values and optional counts.  Counts come from the facet cache, which
+        only counts records collected or updated since it was last read (see FacetCache).
+        """
 
+        counts = self.facet_cache.get(field)
         results = { "objects": [ ], "total": 0 }
-        for result in [ res for res in self.collection.aggregate([ unwind, query, sort ]) ]:
-            res = { "value": result["_id"]["value"] }
+        for value, count in sorted(counts.items(), key = lambda v: str(v[0])):
+            res = { "value": value }
             if include_count:
-                res["count"] = result["count"]
+                res["count"] = count
             results["objects"].append(res)
             results["total"] += 1
         return results
 
+    def list_facets(self):
+        """List the cached facet tables."""
+
+        return self.facet_cache.tables()
+
+    def invalidate_facets(self, field = None):
+        """Drop the cached facet table for a field, or for every field, so they are counted again."""
+
+        return self.facet_cache.invalidate(field)
+
+    @profiled("query")
     def field_info(self, fields = [ ]):
-        """Get recipe counts for each of the supplied fields."""
+        """Get recipe counts for each of the supplied fields, in a single aggregation."""
 
-        if len(fields) == 0:
-            fields = self.store_fields
+        return self.field_stats.compute(fields or self.store_fields)["fields"]
 
-        results = { }
-        for field in fields:
-            results[field] = self.collection.find({ field: { "$exists": True } }).count()
-        return results
+    @profiled("query")
+    def collection_stats(self, recompute = False):
+        """
+        Get the total number of recipes and the count for each stored field from the stats
+        document, which is kept up to date by the collector.  The stats are computed (and the
+        document created) if they haven't been yet, or if recompute is True.
+        """
+
+        stats = None if recompute else self.field_stats.read()
+        if stats is None:
+            stats = self.field_stats.recompute()
+        return stats
+
+    def read_collection_stats(self):
+        """Get the stats document without computing it; None if it hasn't been computed."""
+
+        return self.field_stats.read()
 
     def sample(self, size, projection = DEFAULT_PROJECTION, sort = DEFAULT_SORT):
         """
-        Extract a random set of recipes.
+        Extract a random set of recipes.  Returns Results, which are streamed from mongo as
+        they are viewed.
         """
 
         args = [ { "$sample": { "size": size } }, 
                  { "$project": projection }, 
                  { "$sort": dict(sort) }, ]
 
-        results = { "objects": [ ], "total": 0 }
-        for rcp in self.collection.aggregate(args):
-            self.serialize_recipe(rcp)
-            results["objects"].append(rcp)
-            results["total"] += 1
-        return results
+        def aggregate(batch_size):
+            return self.collection.aggregate(args, batchSize = batch_size)
+
+        def count():
+            return min([ size, self.count() ]), True
+
+        return Results(aggregate, count, self.serialize_recipe)
 
     def search(self, text = "", **kwargs):
         """
@@ -110,23 +278,28 @@ class Manager(object):
         The default sort is by name, asecending, unless a text search was done, in which case
         the text score, descending, is used.  You can provide your own sort criteria; it will
         also be passed to find as-is.
+
+        Returns Results, which are streamed from mongo as they are viewed.  The total is counted
+        exactly up to count_limit (COUNT_LIMIT by default, None for no limit).
+
+        If there is a local text index, text is searched there and the results are in order of
+        score (a sort is ignored); see text_search_results.
+
+        If the query cache is on, the same search (query, projection, sort and options) returns
+        the same Results, with the results viewed so far, until it expires or a recipe is
+        collected or updated (see latest_write).
         """
 
+        local = text and self.text_index is not None
         conditions = [ ]
-        if text:
+        if text and not local:
             conditions.append({ "$text": { "$search": text } })
         if "name" in kwargs:
             conditions.append({ "name": kwargs["name"] })
         if "url" in kwargs:
             conditions.append({ "url": kwargs["url"] })
 
-        constraints = [ ]
-        op = kwargs.get("op", "$and")
-        for category in kwargs.get("recipeCategory", [ ]):
-            constraints.append({ "recipeCategory": category })
-        for cuisine in kwargs.get("recipeCuisine", [ ]):
-            constraints.append({ "recipeCuisine": cuisine })
-        constraints = self.make_clause(op, constraints)
+        constraints = self.constraints(**kwargs)
 
         if len(conditions) == 0 and len(constraints) == 0:
             query = { }
@@ -137,22 +310,257 @@ class Manager(object):
         else:
             query = { "$and": conditions + [ constraints ] }
 
-        projection = kwargs.get("projection", DEFAULT_PROJECTION)
-        if text:
+        projection = dict(kwargs.get("projection", DEFAULT_PROJECTION))
+        if local:
+            sort = None
+        elif text:
             sort = kwargs.get("sort", TEXT_SCORE_SORT)
             projection["score"] = { "$meta": "textScore" }
         else:
             sort = kwargs.get("sort", DEFAULT_SORT)
 
         self.logger.debug("\nquery = %s\nprojection = %s\nsort = %s" % (query, projection, sort))
+        self.query_log.record(query, sort)
+
+        count_limit, batch_size = kwargs.get("count_limit", COUNT_LIMIT), kwargs.get("batch_size", BATCH_SIZE)
+        self.check_writes()
+        key = None
+        if self.query_cache is not None:
+            key = json.dumps([ text if local else None, query, projection, sort, count_limit, batch_size ],
+                             sort_keys = True, default = str)
+            results = self.query_cache.get(key)
+            if results is not None:
+                return results
+
+        if local:
+            results = self.text_search_results(text, query, projection, count_limit, batch_size)
+            if key is not None:
+                self.query_cache.put(key, results)
+            return results
+
+        def find(batch_size):
+            return self.collection.find(query, projection, sort = sort).batch_size(batch_size)
+
+        def find_range(skip, limit):
+            return self.collection.find(query, projection, sort = sort, skip = skip, limit = limit)
+
+        def count():
+            return self.count_matches(query, count_limit)
+
+        results = Results(find, count, self.serialize_recipe, find_range, batch_size)
+        if key is not None:
+            self.query_cache.put(key, results)
+        return results
 
-        results = { "objects": [ ], "total": 0 }
-        for rcp in self.collection.find(query, projection, sort = sort):
-            self.serialize_recipe(rcp)
-            results["objects"].append(rcp)
-            results["total"] += 1
+    def constraints(self, **kwargs):
+        """The clause for the category and cuisine constraints in kwargs (see search)."""
+
+        constraints = [ ]
+        for category in kwargs.get("recipeCategory", [ ]):
+            constraints.append({ "recipeCategory": category })
+        for cuisine in kwargs.get("recipeCuisine", [ ]):
+            constraints.append({ "recipeCuisine": cuisine })
+        return self.make_clause(kwargs.get("op", "$and"), constraints)
+
+    def pantry(self, items, max_missing = None, **kwargs):
+        """
+        Find the recipes that can be made from a pantry: items is a comma separated list of
+        ingredients (e.g. "eggs, leeks, parmesan"), which are assumed to include STAPLES unless
+        staples is False.  Recipes are ranked by the share of their ingredients the pantry
+        covers or, if max_missing is given, limited to those missing at most that many
+        ingredients, the fewest missing first.  Each result has the number of ingredients
+        covered and missing, and the number it has.
+
+        Category and cuisine constraints, projection, count_limit and batch_size are as in
+        search; at most limit (PANTRY_LIMIT by default) recipes are found.  Requires a pantry
+        index, which is built if it hasn't been.  Results are cached as in search.
+        """
+
+        if self.pantry_index is None:
+            raise ValueError("No pantry index")
+        keys = pantry_keys(items, kwargs.get("staples", True))
+        query = self.constraints(**kwargs)
+        projection = dict(kwargs.get("projection", DEFAULT_PROJECTION))
+        count_limit, batch_size = kwargs.get("count_limit", COUNT_LIMIT), kwargs.get("batch_size", BATCH_SIZE)
+        limit = kwargs.get("limit", PANTRY_LIMIT)
+
+        self.check_writes()
+        key = None
+        if self.query_cache is not None:
+            key = json.dumps([ "pantry", keys, max_missing, limit, query, projection, count_limit, batch_size ],
+                             sort_keys = True, default = str)
+            results = self.query_cache.get(key)
+            if results is not None:
+                return results
+
+        with region("query"):
+            if self.pantry_index.watermark is None:
+                self.pantry_index.refresh()
+            found = self.pantry_index.search(keys, max_missing, limit)
+        ranked = [ (doc_id, { "covered": covered, "missing": total - covered, "ingredients": total })
+                   for doc_id, covered, total in found ]
+        results = self.ranked_results(ranked, query, projection, count_limit, batch_size)
+        if key is not None:
+            self.query_cache.put(key, results)
         return results
 
+    @profiled("query")
+    def latest_write(self):
+        """The latest collect or update time in the collection (None if there are none)."""
+
+        times = [ ]
+        for field in [ "collect_time", "update_time" ]:
+            latest = self.collection.find_one({ }, { field: 1 }, sort = [ (field, pymongo.DESCENDING) ])
+            if latest is not None and field in latest:
+                times.append(latest[field])
+        return max(times) if times else None
+
+    def text_search_results(self, text, query, projection, count_limit, batch_size):
+        """
+        Search the local text index, and retrieve the results matching query from mongo, in
+        order of score (which is added to each result); see ranked_results.
+        """
+
+        with region("query"):
+            ranked = [ (doc_id, { "score": score }) for doc_id, score in self.text_index.search(text) ]
+        return self.ranked_results(ranked, query, projection, count_limit, batch_size)
+
+    def ranked_results(self, ranked, query, projection, count_limit, batch_size):
+        """
+        Retrieve the recipes in ranked, a list of (id, fields) pairs, that match query from
+        mongo, in batches, in order, adding the fields to each.  Recipes no longer in the
+        collection are skipped.
+        """
+
+        added = dict(ranked)
+        hide_id = projection.get("_id", 1) == 0
+        projection = dict([ (field, value) for field, value in projection.items() if field != "_id" ])
+
+        def fetch(ids):
+            match = { "_id": { "$in": ids } }
+            by_id = dict([ (obj["_id"], obj) for obj in
+                           self.collection.find({ "$and": [ match, query ] } if query else match, projection) ])
+            for doc_id in ids:
+                obj = by_id.get(doc_id)
+                if obj is not None:
+                    obj.update(added[doc_id])
+                    if hide_id:
+                        del obj["_id"]
+                    yield obj
+
+        def find(batch_size):
+            for start in range(0, len(ranked), batch_size):
+                for obj in fetch([ doc_id for doc_id, fields in ranked[start:start + batch_size] ]):
+                    yield obj
+
+        def find_range(skip, limit):
+            return list(fetch([ doc_id for doc_id, fields in ranked[skip:skip + limit] ]))
+
+        def count():
+            if not query:
+                return len(ranked), True
+            ids = [ doc_id for doc_id, fields in ranked[:count_limit] ]
+            total, exact = self.count_matches({ "$and": [ { "_id": { "$in": ids } }, query ] })
+            return total, len(ids) == len(ranked)
+
+        # Without a query, any range of results can be fetched directly
+        return Results(find, count, self.serialize_recipe, None if query else find_range, batch_size)
+
+    def check_writes(self):
+        """
+        If recipes have been collected or updated since the last search, empty the query and
+        recipe caches and bring the local text and pantry indexes up to date.
+        """
+
+        latest = self.latest_write()
+        if latest != self.latest:
+            self.recipe_cache.clear()
+            if self.query_cache is not None:
+                if len(self.query_cache):
+                    self.logger.debug("Recipes stored at %s, clearing query cache" % latest)
+                    self.invalidations += 1
+                self.query_cache.clear()
+            self.latest = latest
+        # The indexes trail the latest writes by SETTLE_TIME (see SegmentedIndex), so they are
+        # refreshed once the latest write has settled or, while writes keep coming, once they
+        # are SETTLE_TIME behind, rather than on every search until the write is indexed
+        settled = datetime.utcnow() - SETTLE_TIME
+        for index in [ self.text_index, self.pantry_index ]:
+            if index is None or latest is None or index.watermark is None or latest <= index.watermark:
+                continue
+            if latest <= settled or index.watermark + SETTLE_TIME <= settled:
+                index.refresh()
+
+    def refresh_text_index(self, rebuild = False):
+        """Build the local text index, or bring it up to date.  Returns the number of recipes indexed."""
+
+        return self.text_index.build() if rebuild else self.text_index.refresh()
+
+    def text_index_info(self):
+        """Local text index statistics, or None if there isn't one."""
+
+        return None if self.text_index is None else self.text_index.info()
+
+    def refresh_pantry_index(self, rebuild = False):
+        """Build the pantry index, or bring it up to date.  Returns the number of recipes indexed."""
+
+        return self.pantry_index.build() if rebuild else self.pantry_index.refresh()
+
+    def pantry_index_info(self):
+        """Pantry index statistics, or None if there isn't one or it hasn't been built."""
+
+        return None if self.pantry_index is None else self.pantry_index.info()
+
+    def query_cache_info(self):
+        """Query cache statistics, or None if it's turned off."""
+
+        if self.query_cache is None:
+            return None
+        cache = self.query_cache
+        return { "entries": len(cache), "bytes": cache.size(), "hits": cache.hits, "misses": cache.misses,
+                 "expired": cache.expired, "evicted": cache.evicted, "invalidations": self.invalidations }
+
+    @profiled("query")
+    def count_matches(self, query, limit = None):
+        """
+        Count the recipes matching a query, stopping at limit if given.  Returns the count and
+        whether it is exact.
+        """
+
+        if not query:
+            return self.count(), True
+        cursor = self.collection.find(query, { "_id": 1 })
+        if limit is not None:
+            cursor = cursor.limit(limit + 1)
+        total = cursor.count(with_limit_and_skip = True)
+        if limit is not None and total > limit:
+            return limit, False
+        return total, True
+
+    def get_recipe(self, recipe_id, projection = RECIPE_PROJECTION):
+        """
+        Get a single recipe by _id (as returned in search results), or None if it doesn't
+        exist.  The most recently retrieved recipes are cached, so viewing a recipe again
+        doesn't query mongo, until recipes are collected or updated (see check_writes).
+        """
+
+        key = (recipe_id, repr(sorted(projection.items())))
+        recipe = self.recipe_cache.get(key)
+        if recipe is None:
+            recipe = self.find_recipe(recipe_id, projection)
+            if recipe is None:
+                return None
+            self.recipe_cache.put(key, recipe)
+        return dict(recipe)
+
+    @profiled("query")
+    def find_recipe(self, recipe_id, projection):
+
+        recipe = self.collection.find_one({ "_id": recipe_id }, projection)
+        if recipe is not None:
+            self.serialize_recipe(recipe)
+        return recipe
+
     def make_clause(self, op, conditions):
 
         if len(conditions) == 0:
@@ -180,14 +588,13 @@ class Manager(object):
         else:
             return self.collection.create_index(args)
 
-    def create_default_text_index(self):
+    def create_default_text_index(self, background = False):
         """Set up an index on the name, ingredients, and instructions."""
 
-        fields = [ "name", "recipeIngredient", "recipeInstructions" ]
-        weights = { "name": 3, "recipeIngredient": 2, "recipeInstructions": 1 }
-        self.create_text_index(fields, "recipe_text", "en", weights)
+        self.create_text_index(list(TEXT_FIELDS), "recipe_text", "en", dict(TEXT_WEIGHTS), background)
 
-    def create_text_index(self, fields, name = "text_index", default_language = "none", weights = { }):
+    def create_text_index(self, fields, name = "text_index", default_language = "none", weights = { },
+                          background = False):
         """Create a text index on the collection."""
 
         weights.update(dict([ (f, 1) for f in fields if f not in weights ]))
@@ -196,9 +603,46 @@ class Manager(object):
             [ (field, pymongo.TEXT) for field in fields ],
             name = name, 
             default_language = default_language,
-            weights = weights
+            weights = weights,
+            background = background
         )
 
+    def ensure_indexes(self, text = True):
+        """
+        Create the indexes that lookups and searches depend on, if they don't exist: a unique
+        url index (see create_url_index), indexes on category, cuisine and the collect and update
+        times, and (if text) the default text index, unless there's another text index (only one
+        is allowed).  Indexes other than url are built in the background.  Returns the names of
+        the indexes created.
+        """
+
+        existing = self.collection.index_information()
+        created = [ ]
+        for spec in REQUIRED_INDEXES:
+            if has_index(existing, spec["keys"]):
+                continue
+            self.logger.info("Creating index %s" % spec["name"])
+            if spec["keys"][0][0] == "url":
+                create_url_index(self.collection, self.logger)
+            else:
+                self.collection.create_index(spec["keys"], name = spec["name"], background = True)
+            created.append(spec["name"])
+
+        if text and not [ info for info in existing.values() if "textIndexVersion" in info ]:
+            self.logger.info("Creating default text index")
+            self.create_default_text_index(background = True)
+            created.append("recipe_text")
+
+        url = [ info for info in existing.values() if list(info["key"])[:1] == [ ("url", pymongo.ASCENDING) ] ]
+        if url and not [ info for info in url if info.get("unique") ]:
+            self.logger.warning("The url index isn't unique; drop it to have a unique one created")
+        return created
+
+    def advise_indexes(self):
+        """Explain recent searches and suggest indexes for them (see IndexAdvisor)."""
+
+        return IndexAdvisor(self.collection, self.query_log).advise()
+
     def list_indexes(self):
         """Return a list of indexes on the collection."""
 
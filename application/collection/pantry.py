@@ -0,0 +1,298 @@
+import os, re, json
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .segments import MappedSegment, SegmentedIndex, write_ids
+from .textindex import field_strings
+
+# Pantry searches return at most this many recipes
+PANTRY_LIMIT = 1000
+# Indexes built with a different version (e.g. different normalization) are rebuilt
+INDEX_VERSION = 4
+# Assumed to be in every pantry.  Staples only cover ingredients that are exactly the same
+# (e.g. black pepper, but not bell pepper)
+STAPLES = [ "water", "salt", "kosher salt", "sea salt", "pepper", "black pepper" ]
+
+PARENTHESES = re.compile(r"\([^)]*\)")
+# Parts of an ingredient that are all needed, and alternatives, one of which is needed
+AND = re.compile(r"\band\b|&")
+OR = re.compile(r"\bor\b|/")
+
+# Words in ingredient lines that aren't ingredients: units, sizes and preparation
+IGNORED = set("""
+    a about an the of plus more optional needed divided
+    cup cups c tablespoon tablespoons tbsp tbs tbl teaspoon teaspoons tsp t ounce ounces oz pound
+    pounds lb lbs gram grams g kilogram kilograms kg ml milliliter milliliters liter liters l quart
+    quarts pint pints gallon gallons inch inches cm pinch pinches dash dashes handful bunch bunches
+    can cans package packages pkg jar jars bottle bottles stick sticks slice slices piece pieces
+    sprig sprigs head heads clove cloves stalk stalks large small medium extra whole fresh freshly
+    chopped sliced diced minced grated shredded crushed peeled seeded trimmed halved quartered cut
+    finely thinly roughly coarsely ground cubed beaten softened melted cooked uncooked room temperature
+    drained rinsed packed firmly lightly thick thin each
+""".split())
+# Words that end the ingredient itself (e.g. salt to taste, parsley for garnish)
+ENDS = set([ "for", "to", "into", "in", "from", "at", "as", "if", "such", "with", "without" ])
+
+def singular(word):
+    """A rough singular form, only used to make plurals match."""
+
+    if len(word) <= 3 or word.endswith("ss"):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("oes"):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+def words(text):
+    """The alphabetic words in text (numbers, including fractions such as ½, are dropped)."""
+
+    return "".join([ char if char.isalpha() else " " for char in text ]).split()
+
+def phrase(text):
+    """The head noun phrase of an ingredient (e.g. "red bell pepper" for "2 red bell peppers")."""
+
+    found = [ ]
+    for word in words(text):
+        if word in ENDS:
+            break
+        if word not in IGNORED:
+            found.append(singular(word))
+    return " ".join(found)
+
+def normalize(text):
+    """
+    The requirements of an ingredient line: for each part joined by and, a list of alternative
+    head noun phrases (e.g. [ [ "butter", "oil" ] ] for "butter or oil", [ [ "salt" ],
+    [ "black pepper" ] ] for "salt and black pepper").  Quantities, units, preparation and
+    anything after a comma are dropped.
+    """
+
+    text = PARENTHESES.sub(" ", text.lower()).split(",")[0]
+    requirements = [ ]
+    for part in AND.split(text):
+        alternatives = [ ]
+        for alternative in OR.split(part):
+            found = phrase(alternative)
+            if found and found not in alternatives:
+                alternatives.append(found)
+        if alternatives:
+            requirements.append(alternatives)
+    return requirements
+
+def phrase_keys(found):
+    """
+    The keys a phrase is indexed under: each of its suffixes, which a pantry item matches if it
+    has the same head noun (e.g. "pepper" and "bell pepper" both match "red bell pepper"), and
+    the phrase itself prefixed by =, which staples match.
+    """
+
+    split = found.split()
+    return [ " ".join(split[n:]) for n in range(len(split)) ] + [ "=" + found ]
+
+def pantry_keys(text, staples = True):
+    """The keys to look up for a comma separated list of pantry items, plus STAPLES if staples."""
+
+    keys = [ found for item in text.split(",") for alternatives in normalize(item) for found in alternatives ]
+    if staples:
+        keys += [ "=" + phrase(staple) for staple in STAPLES ]
+    return sorted(set(keys))
+
+class PantrySegment(MappedSegment):
+    """
+    A segment of the pantry index.  Each ingredient line has one or more requirements (see
+    normalize), and is covered if they all are; a requirement is covered by any of its
+    alternatives.  The segment has the number of lines of each recipe (counts), the recipe of
+    each line (lines) and its number of requirements (needs), the line of each requirement
+    (requirements), and for each key (see phrase_keys), the requirements indexed under it
+    (postings, with each key's range in keys).  See MappedSegment for ids and deleted recipes.
+    """
+
+    def __init__(self, path, deleted = ( )):
+
+        super(PantrySegment, self).__init__(path, deleted)
+        self.counts = self.map("counts.bin", "I")
+        self.lines = self.map("lines.bin", "I")
+        self.needs = self.map("needs.bin", "I")
+        self.requirements = self.map("requirements.bin", "I")
+        self.postings = self.map("postings.bin", "I")
+        with open(os.path.join(path, "keys.json")) as source:
+            self.keys = json.load(source)
+
+    @staticmethod
+    def write(path, ids, counts, lines, needs, requirements, postings):
+        """Write a segment; postings is a dict of each key's (sorted) requirements."""
+
+        keys, offset, flat = { }, 0, array("I")
+        for key in sorted(postings):
+            flat.extend(postings[key])
+            keys[key] = [ offset, len(flat) ]
+            offset = len(flat)
+        for name, data in [ ("counts.bin", counts), ("lines.bin", lines), ("needs.bin", needs),
+                            ("requirements.bin", requirements), ("postings.bin", flat) ]:
+            with open(os.path.join(path, name), "wb") as output:
+                data.tofile(output)
+        write_ids(path, ids)
+        with open(os.path.join(path, "keys.json"), "w") as output:
+            json.dump(keys, output)
+
+    def key_requirements(self, key):
+
+        found = self.keys.get(key)
+        return self.postings[found[0]:found[1]] if found else None
+
+    def covered_lines(self, keys):
+        """
+        The lines whose requirements are all covered by keys: a set of line numbers or, with
+        numpy, an array of a flag for each line.
+        """
+
+        postings = [ self.key_requirements(key) for key in keys ]
+        postings = [ found for found in postings if found is not None ]
+        if numpy is None:
+            hits = { }
+            for requirement in set().union(*postings):
+                line = self.requirements[requirement]
+                hits[line] = hits.get(line, 0) + 1
+            return set([ line for line, count in hits.items() if count == self.needs[line] ])
+
+        flags = numpy.zeros(len(self.requirements), dtype = bool)
+        for found in postings:
+            flags[numpy.frombuffer(found, dtype = numpy.uint32)] = True
+        requirement_lines = numpy.frombuffer(self.requirements, dtype = numpy.uint32)
+        hits = numpy.bincount(requirement_lines[flags], minlength = len(self.lines))
+        return hits == numpy.frombuffer(self.needs, dtype = numpy.uint32)
+
+    def score(self, keys, max_missing = None):
+        """
+        For each recipe with at least one covered line (and at most max_missing lines not
+        covered), the number of covered lines and the number of lines.  Returns three lists (or
+        arrays) of recipe numbers, covered line counts and line counts.
+        """
+
+        lines = self.covered_lines(keys)
+        if numpy is None:
+            covered = { }
+            for line in lines:
+                recipe = self.lines[line]
+                covered[recipe] = covered.get(recipe, 0) + 1
+            recipes = [ recipe for recipe, count in covered.items() if recipe not in self.deleted and
+                        (max_missing is None or self.counts[recipe] - count <= max_missing) ]
+            return recipes, [ covered[recipe] for recipe in recipes ], [ self.counts[recipe] for recipe in recipes ]
+
+        recipe_lines = numpy.frombuffer(self.lines, dtype = numpy.uint32)
+        totals = numpy.frombuffer(self.counts, dtype = numpy.uint32)
+        covered = numpy.bincount(recipe_lines[lines], minlength = self.doc_count)
+        mask = covered > 0
+        if self.deleted:
+            mask[list(self.deleted)] = False
+        if max_missing is not None:
+            mask &= totals.astype(numpy.int64) - covered <= max_missing
+        recipes = numpy.nonzero(mask)[0]
+        return recipes, covered[recipes], totals[recipes]
+
+class PantryIndex(SegmentedIndex):
+    """
+    An index of the ingredients of the recipes in a collection, for finding the recipes that
+    can be made from a pantry (see search).  Each ingredient line is normalized to the head noun
+    phrases it requires (see normalize); a pantry item covers a phrase with the same head noun,
+    and a staple only an identical phrase (see phrase_keys).  Scoring is vectorized with numpy,
+    if it is installed.  The index is kept in segments (see PantrySegment), built and refreshed
+    as described in SegmentedIndex.
+    """
+
+    kind = "Pantry index"
+    version = INDEX_VERSION
+    fields = [ "recipeIngredient" ]
+    segment_class = PantrySegment
+    segment_prefix = "pantry"
+
+    def write_segment(self, batch, path, stats):
+
+        ids, counts, lines, needs, requirements, postings = [ ], array("I"), array("I"), array("I"), array("I"), { }
+        for recipe in batch:
+            count = 0
+            for text in field_strings(recipe.get("recipeIngredient")):
+                required = normalize(text)
+                if not required:
+                    continue
+                for alternatives in required:
+                    for key in set([ key for found in alternatives for key in phrase_keys(found) ]):
+                        postings.setdefault(key, array("I")).append(len(requirements))
+                    requirements.append(len(lines))
+                lines.append(len(ids))
+                needs.append(len(required))
+                count += 1
+            ids.append(recipe["_id"])
+            counts.append(count)
+        PantrySegment.write(path, ids, counts, lines, needs, requirements, postings)
+
+    def merge(self, segments, path):
+
+        ids, counts, lines, needs, requirements, postings = [ ], array("I"), array("I"), array("I"), array("I"), { }
+        for segment in segments:
+            # New numbers for the recipes, lines and requirements kept
+            recipes, line_numbers, requirement_numbers = { }, { }, { }
+            for recipe in range(segment.doc_count):
+                if recipe not in segment.deleted:
+                    recipes[recipe] = len(ids)
+                    ids.append(segment.doc_id(recipe))
+                    counts.append(segment.counts[recipe])
+            for line, recipe in enumerate(segment.lines):
+                if recipe in recipes:
+                    line_numbers[line] = len(lines)
+                    lines.append(recipes[recipe])
+                    needs.append(segment.needs[line])
+            for requirement, line in enumerate(segment.requirements):
+                if line in line_numbers:
+                    requirement_numbers[requirement] = len(requirements)
+                    requirements.append(line_numbers[line])
+            for key, (first, last) in segment.keys.items():
+                kept = [ requirement_numbers[requirement] for requirement in segment.postings[first:last]
+                         if requirement in requirement_numbers ]
+                if kept:
+                    postings.setdefault(key, array("I")).extend(kept)
+        PantrySegment.write(path, ids, counts, lines, needs, requirements, postings)
+
+    def search(self, keys, max_missing = None, limit = PANTRY_LIMIT):
+        """
+        Find the recipes that can be made from a pantry (a list of keys, see pantry_keys).
+        Returns up to limit (id, covered, ingredients) tuples: the recipes with the largest share of their ingredients covered first or, if max_missing is given, only
+        those missing at most that many ingredients, the fewest missing first.
+        """
+
+        scored = [ segment.score(keys, max_missing) for segment in self.segments ]
+        if numpy is None:
+            found = [ (segment, recipe, count, total) for segment, (recipes, covered, totals) in zip(self.segments, scored)
+                      for recipe, count, total in zip(recipes, covered, totals) ]
+            if max_missing is None:
+                key = lambda result: (-result[2] / float(result[3]), -result[2])
+            else:
+                key = lambda result: (result[3] - result[2], -result[2] / float(result[3]))
+            found.sort(key = key)
+            return [ (segment.doc_id(recipe), count, total) for segment, recipe, count, total in found[:limit] ]
+
+        if not scored:
+            return [ ]
+        segments = numpy.concatenate([ numpy.full(len(recipes), number) for number, (recipes, covered, totals) in enumerate(scored) ])
+        recipes, covered, totals = [ numpy.concatenate(arrays).astype(numpy.int64) for arrays in zip(*scored) ]
+        share = covered / totals.astype(numpy.float64)
+        # lexsort sorts by the last key first
+        if max_missing is None:
+            order = numpy.lexsort((-covered, -share))[:limit]
+        else:
+            order = numpy.lexsort((-share, totals - covered))[:limit]
+        return [ (self.segments[segments[n]].doc_id(int(recipes[n])), int(covered[n]), int(totals[n])) for n in order ]
+
+    def info(self):
+
+        info = super(PantryIndex, self).info()
+        if info is not None:
+            info["phrases"] = len(set([ key for segment in self.segments for key in segment.keys if not key.startswith("=") ]))
+        return info
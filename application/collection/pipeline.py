@@ -0,0 +1,64 @@
+import logging
+from queue import Queue
+from threading import Thread
+
+# Set in each parser process by init_parser
+extractor = None
+
+def init_parser(site_extractor):
+    """Initialize a parser process with the extractor to use for every page."""
+
+    global extractor
+    extractor = site_extractor
+
+def parse_page(content, url, extract, follow_links):
+    """Parse a page in a parser process.  Returns the result of timed_parse."""
+
+    return timed_parse(extractor, content, url, extract, follow_links)
+
+def timed_parse(site_extractor, content, url, extract, follow_links):
+    """
+    Parse a page with an extractor.  Returns the recipes found (if extract is set), links to
+    follow (if follow_links is set), the time taken by each stage (parse and extract, see
+    Extractor.parse) and the number of recipes rejected.
+    """
+
+    rejected = site_extractor.rejected
+    records, links = site_extractor.parse(content, url, extract, follow_links)
+    return records, links, dict(site_extractor.timings), site_extractor.rejected - rejected
+
+class RecordWriter(Thread):
+    """
+    Writer stage: passes records to a BulkWriter from a single thread, so that storing them
+    doesn't hold up fetching or parsing.  At most maxsize pages worth of records wait in the
+    queue; put blocks when it is full.
+    """
+
+    def __init__(self, writer, maxsize = 100):
+
+        super(RecordWriter, self).__init__(daemon = True)
+        self.logger = logging.getLogger(__name__)
+        self.writer = writer
+        self.queue = Queue(maxsize)
+        self.start()
+
+    def put(self, url, records):
+
+        self.queue.put((url, records))
+
+    def run(self):
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            url, records = item
+            for record in records:
+                self.writer.insert(record)
+            self.logger.info("Found %d recipe(s) in %s" % (len(records), url))
+
+    def close(self):
+        """Wait for queued records to be passed to the writer and stop the thread."""
+
+        self.queue.put(None)
+        self.join()
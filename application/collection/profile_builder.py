@@ -1,17 +1,21 @@
-import requests, time
+import time
 import json, re
 from urllib.parse import urlparse, urljoin
 from lxml import html
 
+from .session import make_session
+
 class ProfileBuilder(object):
 
-    def __init__(self, url):
+    def __init__(self, url, session = None):
         """Guesses parameters for a site based on a sample url."""
 
         self.url = url
+        if session is None:
+            session = make_session()
 
         try:
-            resp = requests.get(url)
+            resp = session.get(url)
             resp.raise_for_status()
             data = html.fromstring(resp.content)
         except Exception as exc:
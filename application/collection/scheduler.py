@@ -0,0 +1,146 @@
+import time, heapq
+import logging
+from collections import deque, OrderedDict
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from threading import Lock
+from urllib.parse import urlparse
+
+class RetryLater(Exception):
+    """Raised when a request should be attempted again after a delay rather than retried inline."""
+
+    def __init__(self, url, delay):
+
+        super(RetryLater, self).__init__("Retry %s in %.0fs" % (url, delay))
+        self.url = url
+        self.delay = delay
+
+class HostScheduler(object):
+    """
+    Politeness scheduler: queues urls per host and hands out the next url from any host that
+    is allowed to make a request.  Each host has a token bucket whose rate is adjusted with
+    additive increase / multiplicative decrease based on the responses received from it.
+    Hosts are served round-robin: a host that is handed a url moves to the back of the line.
+    """
+
+    def __init__(self, wait = 10, min_wait = None, decrease = 0.5, max_wait = 600):
+
+        self.logger = logging.getLogger(__name__)
+
+        # Rates are requests per second; hosts start at the rate implied by the wait time and
+        # never go faster than min_wait allows or slower than max_wait
+        self.initial_rate = 1.0 / wait if wait > 0 else float("inf")
+        if min_wait is None:
+            min_wait = wait
+        self.max_rate = 1.0 / min_wait if min_wait > 0 else float("inf")
+        self.min_rate = min([ 1.0 / max_wait, self.initial_rate ])
+        self.increase = self.max_rate / 10 if self.max_rate != float("inf") else 0
+        self.decrease = decrease
+
+        self.hosts = OrderedDict()
+        self.deferred = [ ]
+        self.sequence = 0
+        self.lock = Lock()
+
+    def __len__(self):
+
+        return sum([ len(host["queue"]) for host in self.hosts.values() ]) + len(self.deferred)
+
+    def get_host(self, url):
+
+        name = urlparse(url).netloc.lower()
+        if name not in self.hosts:
+            self.hosts[name] = {
+                "queue": deque(),
+                "rate": self.initial_rate,
+                "tokens": 1.0,
+                "updated": time.time(),
+                "blocked_until": 0,
+            }
+        return self.hosts[name]
+
+    def add(self, url, tries = 1, delay = 0):
+        """Queue a url, optionally deferring it for the specified number of seconds."""
+
+        with self.lock:
+            host = self.get_host(url)
+            if delay > 0:
+                self.sequence += 1
+                heapq.heappush(self.deferred, (time.time() + delay, self.sequence, url, tries))
+            else:
+                host["queue"].append((url, tries))
+
+    def next(self):
+        """Return the next (url, tries) that can be requested now, or None."""
+
+        with self.lock:
+            now = time.time()
+            while self.deferred and self.deferred[0][0] <= now:
+                due, seq, url, tries = heapq.heappop(self.deferred)
+                self.get_host(url)["queue"].appendleft((url, tries))
+
+            for name, host in self.hosts.items():
+                if not host["queue"] or host["blocked_until"] > now:
+                    continue
+                self.refill(host, now)
+                if host["tokens"] >= 1:
+                    host["tokens"] -= 1
+                    self.hosts.move_to_end(name)
+                    return host["queue"].popleft()
+
+    def wait_time(self):
+        """Seconds until a queued url might become available, or None if nothing is queued."""
+
+        with self.lock:
+            now = time.time()
+            times = [ due - now for due, seq, url, tries in self.deferred[:1] ]
+            for host in self.hosts.values():
+                if not host["queue"]:
+                    continue
+                self.refill(host, now)
+                times.append(max([ host["blocked_until"] - now, (1 - host["tokens"]) / host["rate"] ]))
+            return max([ min(times), 0.01 ]) if times else None
+
+    def refill(self, host, now):
+
+        if host["rate"] == float("inf"):
+            host["tokens"] = 1.0
+        else:
+            host["tokens"] = min([ 1.0, host["tokens"] + (now - host["updated"]) * host["rate"] ])
+        host["updated"] = now
+
+    def feedback(self, url, status = None, retry_after = None):
+        """
+        Adjust the rate for the host of a url.  Successful responses increase the rate by a
+        fixed amount; 429, 503 and failed requests (no status, e.g. timeouts) cut it, and a Retry-After header
+        blocks the host until the time requested.
+        """
+
+        with self.lock:
+            host = self.get_host(url)
+            if status is not None and status < 400:
+                host["rate"] = min([ self.max_rate, host["rate"] + self.increase ])
+            elif status in [ None, 429, 503 ]:
+                host["rate"] = max([ self.min_rate, host["rate"] * self.decrease ])
+                host["tokens"] = 0.0
+                self.logger.info("Reduced rate for %s to %.3f request(s)/s" %
+                                 (urlparse(url).netloc, host["rate"]))
+            delay = self.parse_retry_after(retry_after)
+            if delay > 0:
+                host["blocked_until"] = max([ host["blocked_until"], time.time() + delay ])
+            return delay
+
+    def parse_retry_after(self, value):
+        """Convert a Retry-After header (seconds or an http date) to seconds."""
+
+        if not value:
+            return 0
+        try:
+            return max([ 0, int(value) ])
+        except ValueError:
+            pass
+        try:
+            return max([ 0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds() ])
+        except Exception as exc:
+            self.logger.debug("Could not parse Retry-After: %s" % value)
+            return 0
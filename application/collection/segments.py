@@ -0,0 +1,332 @@
+import os, json, shutil
+import copy, logging
+from array import array
+from mmap import mmap, ACCESS_READ
+from datetime import datetime
+
+from bson import ObjectId
+
+from .facets import SETTLE_TIME
+
+# Documents indexed at once (in memory) while building, before they are written as a segment
+SEGMENT_DOCS = 50000
+# Segments are merged when there are more than this many
+MAX_SEGMENTS = 8
+
+def write_ids(path, ids):
+    """
+    Write the ids (ObjectIds) of a segment's documents to ids.bin, and the document numbers
+    in order of id to order.bin, so that documents can be found by id (see find_id).
+    """
+
+    binary = [ doc_id.binary for doc_id in ids ]
+    with open(os.path.join(path, "ids.bin"), "wb") as output:
+        output.write(b"".join(binary))
+    with open(os.path.join(path, "order.bin"), "wb") as output:
+        array("I", sorted(range(len(binary)), key = binary.__getitem__)).tofile(output)
+
+def find_id(ids, order, doc_id):
+    """The number of a document by id (a binary search of order), or None."""
+
+    binary = doc_id.binary
+    low, high = 0, len(order)
+    while low < high:
+        middle = (low + high) // 2
+        doc = order[middle]
+        if ids[12 * doc:12 * doc + 12].tobytes() < binary:
+            low = middle + 1
+        else:
+            high = middle
+    if low < len(order) and ids[12 * order[low]:12 * order[low] + 12].tobytes() == binary:
+        return order[low]
+    return None
+
+def map_array(path, typecode):
+    """A read-only array (a memoryview of the file, mapped into memory) of typecode items."""
+
+    if os.path.getsize(path) == 0:
+        return memoryview(array(typecode))
+    with open(path, "rb") as source:
+        mapped = mmap(source.fileno(), 0, access = ACCESS_READ)
+    return memoryview(mapped).cast(typecode)
+
+class MappedSegment(object):
+    """
+    A segment of a SegmentedIndex: a directory of files mapped into memory (see map), including
+    the ids of its documents and their order by id (see write_ids).  Documents are numbered from
+    zero within the segment; deleted holds the numbers of documents replaced by later segments.
+    """
+
+    def __init__(self, path, deleted = ( )):
+
+        self.path = path
+        self.name = os.path.basename(path)
+        self.views = [ ]
+        self.deleted = set(deleted)
+        self.ids = self.map("ids.bin", "B")
+        self.order = self.map("order.bin", "I")
+        self.doc_count = len(self.order)
+
+    def map(self, name, typecode):
+        """Map a file in the segment as an array of typecode items."""
+
+        view = map_array(os.path.join(self.path, name), typecode)
+        self.views.append(view)
+        return view
+
+    def doc_id(self, doc):
+
+        return ObjectId(self.ids[12 * doc:12 * doc + 12].tobytes())
+
+    def find_id(self, doc_id):
+        """The number of a document by id, or None."""
+
+        return find_id(self.ids, self.order, doc_id)
+
+    def close(self):
+
+        views, self.views = self.views, [ ]
+        for view in views:
+            mapped = view.obj
+            view.release()
+            if isinstance(mapped, mmap):
+                mapped.close()
+
+class SegmentedIndex(object):
+    """
+    Base for the local indexes of the recipes in a collection, kept in a directory of segments
+    (see MappedSegment) listed in meta.json.  The index is built from the collection by build,
+    and brought up to date by refresh, which adds segments with the recipes collected or updated
+    since the last refresh (the watermark, trailing the current time by SETTLE_TIME as in
+    FacetCache).  Updated recipes are marked deleted in the segment holding their old version.
+    When there are more than max_segments, the smaller ones are merged.  Recipes deleted from
+    the collection stay in the index until it is rebuilt.
+
+    Subclasses set kind (for messages), version (indexes built with a different version are
+    rebuilt), fields (those read from the collection), segment_class and segment_prefix, and
+    write segments with write_segment and merge.  Totals kept in meta.json, such as the number
+    of documents, start from new_stats and are updated by write_segment and remove.
+    """
+
+    kind = "Index"
+    version = None
+    fields = [ ]
+    segment_class = MappedSegment
+    segment_prefix = "seg"
+
+    def __init__(self, path, collection, segment_docs = SEGMENT_DOCS, max_segments = MAX_SEGMENTS):
+
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.collection = collection
+        self.segment_docs = segment_docs
+        self.max_segments = max_segments
+        self.segments = [ ]
+        self.meta = None
+
+    @property
+    def watermark(self):
+
+        return None if self.meta is None else self.meta["watermark"]
+
+    def open(self):
+        """Open the index, if it has been built.  Returns whether it has."""
+
+        self.close()
+        try:
+            with open(os.path.join(self.path, "meta.json")) as source:
+                self.meta = json.load(source)
+        except IOError:
+            self.meta = None
+            return False
+        if self.meta.get("version") != self.version:
+            self.logger.info("%s %s is out of date and will be rebuilt" % (self.kind, self.path))
+            self.meta = None
+            return False
+
+        self.meta["watermark"] = datetime.strptime(self.meta["watermark"], "%Y-%m-%dT%H:%M:%S.%f")
+        self.segments = [ self.segment_class(os.path.join(self.path, segment["name"]), segment["deleted"])
+                          for segment in self.meta["segments"] ]
+        return True
+
+    def close(self):
+
+        for segment in self.segments:
+            segment.close()
+        self.segments = [ ]
+
+    def new_stats(self):
+        """The totals kept in meta.json for an empty index."""
+
+        return { "docs": 0 }
+
+    def save(self, segments, watermark, stats, next_segment):
+
+        meta = dict(stats)
+        meta.update({
+            "version": self.version,
+            "segments": [ { "name": segment.name, "deleted": sorted(segment.deleted) } for segment in segments ],
+            "watermark": watermark.strftime("%Y-%m-%dT%H:%M:%S.%f"),
+            "next_segment": next_segment,
+            "update_time": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f"),
+        })
+        with open(os.path.join(self.path, "meta.json.tmp"), "w") as output:
+            json.dump(meta, output)
+        os.replace(os.path.join(self.path, "meta.json.tmp"), os.path.join(self.path, "meta.json"))
+
+    def find(self, query):
+
+        projection = dict([ (field, 1) for field in self.fields ])
+        return self.collection.find(query, projection, batch_size = 1000)
+
+    def build(self):
+        """Index the whole collection, replacing the index if there is one.  Returns the number indexed."""
+
+        self.close()
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+        self.meta = None
+
+        watermark = datetime.utcnow() - SETTLE_TIME
+        query = { "$or": [ { "collect_time": { "$lte": watermark } }, { "collect_time": { "$exists": False } } ] }
+        # Nothing is indexed yet, so there are no earlier versions to replace
+        count = self.add_documents(self.find(query), watermark, replace = False)
+        self.logger.info("Indexed %d recipe(s) in %s" % (count, self.path))
+        return count
+
+    def refresh(self):
+        """
+        Add the recipes collected or updated since the index was last built or refreshed (or
+        build it, if it hasn't been).  Returns the number indexed.
+        """
+
+        if self.meta is None and not self.open():
+            return self.build()
+
+        previous = self.meta["watermark"]
+        watermark = datetime.utcnow() - SETTLE_TIME
+        if watermark <= previous:
+            return 0
+        query = { "$or": [
+            { "collect_time": { "$gt": previous, "$lte": watermark } },
+            { "update_time": { "$gt": previous, "$lte": watermark } },
+        ] }
+        count = self.add_documents(self.find(query), watermark)
+        if count:
+            self.logger.info("Indexed %d new or updated recipe(s) in %s" % (count, self.path))
+        return count
+
+    def add_documents(self, documents, watermark, replace = True):
+        """
+        Index documents as new segments, replacing any earlier versions (found by id in the
+        existing segments, if replace).  Returns the number indexed.
+        """
+
+        segments = list(self.segments)
+        stats = self.new_stats()
+        if self.meta is not None:
+            stats = copy.deepcopy(dict([ (key, self.meta[key]) for key in stats ]))
+        next_segment = self.meta["next_segment"] if self.meta else 0
+        count = 0
+
+        batch, seen = [ ], set()
+        for document in documents:
+            if document["_id"] in seen or not isinstance(document["_id"], ObjectId):
+                continue
+            seen.add(document["_id"])
+            batch.append(document)
+            if len(batch) >= self.segment_docs:
+                self.add_segment(batch, segments, stats, next_segment, replace)
+                next_segment += 1
+                count += len(batch)
+                batch = [ ]
+        if batch:
+            self.add_segment(batch, segments, stats, next_segment, replace)
+            next_segment += 1
+            count += len(batch)
+        if not count and self.meta is not None:
+            # Nothing has changed on disk, so the segments don't need to be reopened
+            self.meta["watermark"] = watermark
+            return 0
+
+        merged = [ ]
+        while len(segments) > self.max_segments:
+            segments, next_segment = self.merge_smallest(segments, next_segment, merged)
+
+        self.save(segments, watermark, stats, next_segment)
+        self.close()
+        for segment in segments + merged:
+            segment.close()
+        for segment in merged:
+            shutil.rmtree(segment.path)
+        self.open()
+        return count
+
+    def new_segment(self, number):
+        """Create the directory for a segment, and return its path."""
+
+        path = os.path.join(self.path, "%s-%06d" % (self.segment_prefix, number))
+        # A segment left by an interrupted build or refresh isn't in the index
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        return path
+
+    def add_segment(self, batch, segments, stats, number, replace = True):
+        """Index a batch of documents as a new segment, marking earlier versions deleted if replace."""
+
+        for document in batch if replace else [ ]:
+            for segment in segments:
+                doc = segment.find_id(document["_id"])
+                if doc is not None and doc not in segment.deleted:
+                    segment.deleted.add(doc)
+                    self.remove(segment, doc, stats)
+
+        path = self.new_segment(number)
+        self.write_segment(batch, path, stats)
+        stats["docs"] += len(batch)
+        segments.append(self.segment_class(path))
+        self.logger.debug("Wrote segment %s with %d recipe(s)" % (path, len(batch)))
+
+    def remove(self, segment, doc, stats):
+        """Take a document that has been marked deleted out of the totals."""
+
+        stats["docs"] -= 1
+
+    def write_segment(self, batch, path, stats):
+        """Write a batch of documents as a segment in path, adding them to the totals."""
+
+        raise NotImplementedError
+
+    def merge(self, segments, path):
+        """Write the live documents of segments as a single segment in path."""
+
+        raise NotImplementedError
+
+    def merge_smallest(self, segments, next_segment, merged):
+        """Merge the smaller half of the segments (by live documents) into one, adding them to merged."""
+
+        by_size = sorted(segments, key = lambda segment: segment.doc_count - len(segment.deleted))
+        merging = by_size[:max([ 2, len(segments) // 2 ])]
+        path = self.new_segment(next_segment)
+        self.merge(merging, path)
+        merged += merging
+        self.logger.debug("Merged %d segment(s) into %s" % (len(merging), path))
+        return [ segment for segment in segments if segment not in merging ] + [ self.segment_class(path) ], next_segment + 1
+
+    def info(self):
+        """Statistics about the index, or None if it hasn't been built."""
+
+        if self.meta is None:
+            return None
+        size = sum([ os.path.getsize(os.path.join(segment.path, name))
+                     for segment in self.segments for name in os.listdir(segment.path) ])
+        return {
+            "path": self.path,
+            "docs": self.meta["docs"],
+            "segments": len(self.segments),
+            "deleted": sum([ len(segment.deleted) for segment in self.segments ]),
+            "bytes": size,
+            "watermark": self.meta["watermark"],
+        }
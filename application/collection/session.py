@@ -0,0 +1,42 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+# urllib3 only decodes brotli responses if one of these packages is available
+try:
+    import brotli
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    try:
+        import brotlicffi
+        ACCEPT_ENCODING = "gzip, deflate, br"
+    except ImportError:
+        ACCEPT_ENCODING = "gzip, deflate"
+
+class Session(requests.Session):
+    """A requests session that applies a default timeout to every request."""
+
+    def __init__(self, timeout = 60):
+
+        super(Session, self).__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+
+        kwargs.setdefault("timeout", self.timeout)
+        return super(Session, self).request(method, url, **kwargs)
+
+def make_session(timeout = 60, pool_connections = 10, pool_maxsize = 10, max_retries = 0):
+    """
+    Create a session to be shared by everything that makes requests, so that connections
+    are kept alive and reused.  pool_connections is the number of hosts to keep pools for
+    and pool_maxsize is the number of connections kept open to each host; it should be at
+    least the number of concurrent requests.
+    """
+
+    session = Session(timeout)
+    adapter = HTTPAdapter(pool_connections = pool_connections, pool_maxsize = pool_maxsize,
+                          max_retries = max_retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+    return session
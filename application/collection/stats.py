@@ -0,0 +1,84 @@
+import logging
+from datetime import datetime
+
+STATS_ID = "fields"
+
+class FieldStats(object):
+    """
+    The number of recipes, and the number with each stored field, for a collection.  Counts
+    are computed in a single aggregation and kept in a document in a separate collection
+    (<collection>_stats), so they can be read without scanning the recipes.
+
+    Once the document exists, the collector keeps it up to date by applying the change each
+    stored record makes (see delta and apply).  Changes that can't be counted (e.g. upserts,
+    which may or may not add a recipe) mark the document stale until it is recomputed.
+    """
+
+    def __init__(self, collection, fields):
+
+        self.logger = logging.getLogger(__name__)
+        self.collection = collection
+        self.stats = collection.database["%s_stats" % collection.name]
+        self.fields = fields
+
+    def compute(self, fields = None):
+        """Count the recipes with each field in one pass over the collection."""
+
+        fields = fields or self.fields
+        group = { "_id": None, "total": { "$sum": 1 } }
+        for i, field in enumerate(fields):
+            present = { "$eq": [ { "$type": "$%s" % field }, "missing" ] }
+            group["f%d" % i] = { "$sum": { "$cond": [ present, 0, 1 ] } }
+
+        results = list(self.collection.aggregate([ { "$group": group } ]))
+        counts = results[0] if results else { }
+        return {
+            "total": counts.get("total", 0),
+            "fields": dict([ (field, counts.get("f%d" % i, 0)) for i, field in enumerate(fields) ]),
+        }
+
+    def read(self):
+        """Get the stats document, or None if it hasn't been computed."""
+
+        return self.stats.find_one({ "_id": STATS_ID })
+
+    def exists(self):
+
+        return self.stats.find_one({ "_id": STATS_ID }, { "_id": 1 }) is not None
+
+    def recompute(self):
+        """Compute the counts and replace the stats document.  Returns the new document."""
+
+        now = datetime.utcnow()
+        document = self.compute()
+        document.update({ "_id": STATS_ID, "update_time": now, "compute_time": now, "stale": False })
+        self.stats.replace_one({ "_id": STATS_ID }, document, upsert = True)
+        return document
+
+    def delta(self, record, existing = None):
+        """
+        The change to the counts from storing a record: a new recipe if there is no existing
+        record, otherwise only the fields the existing record doesn't have.
+        """
+
+        delta = dict([ ("fields.%s" % field, 1) for field in self.fields
+                       if field in record and (existing is None or field not in existing) ])
+        if existing is None:
+            delta["total"] = 1
+        return delta
+
+    def apply(self, deltas):
+        """Add up the changes from a batch of stored records and apply them to the document."""
+
+        total = { }
+        for delta in deltas:
+            for key, n in (delta or { }).items():
+                total[key] = total.get(key, 0) + n
+        if not total:
+            return
+        self.stats.update_one({ "_id": STATS_ID }, { "$inc": total, "$set": { "update_time": datetime.utcnow() } })
+
+    def invalidate(self):
+        """Mark the counts as out of date, until they are recomputed."""
+
+        self.stats.update_one({ "_id": STATS_ID }, { "$set": { "stale": True, "update_time": datetime.utcnow() } })
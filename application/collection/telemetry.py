@@ -0,0 +1,179 @@
+import os, time, json
+import logging
+from threading import Lock
+from urllib.parse import urlparse
+
+BUCKETS = [ 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf") ]
+
+class Histogram(object):
+    """Counts of observations in fixed buckets (upper bounds, in seconds), plus their sum and max."""
+
+    def __init__(self, buckets = BUCKETS):
+
+        self.buckets = buckets
+        self.counts = [ 0 ] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max([ self.max, value ])
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+
+        target, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target and count > 0:
+                return min([ bound, self.max ])
+        return 0.0
+
+    def summary(self):
+
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "mean": round(self.sum / self.count, 4) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "max": round(self.max, 4),
+        }
+
+class Telemetry(object):
+    """
+    Counters and timings for a crawl, shared by the collector's stages: fetch latency by host,
+    bytes downloaded, status codes, retries, timings for parsing html, extracting records and
+    storing them, records accepted and rejected, and the size of each queue.  Available as a periodic status line, a json
+    summary and prometheus text format.
+    """
+
+    def __init__(self, interval = 60, prometheus_file = None):
+
+        self.logger = logging.getLogger(__name__)
+        self.lock = Lock()
+        self.start = time.time()
+        self.interval = interval
+        self.prometheus_file = prometheus_file
+        self.last_report = self.start
+        self.counters = {
+            "pages": 0, "bytes": 0, "retries": 0, "failures": 0,
+            "records_accepted": 0, "records_rejected": 0, "records_stored": 0,
+        }
+        self.statuses = { }
+        self.fetch = { }
+        self.timings = { "parse": Histogram(), "extract": Histogram(), "store": Histogram() }
+        self.queues = { }
+
+    def count(self, name, n = 1):
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def fetched(self, url, elapsed, status, size = 0):
+        """Record a request: status is the http status, or a description if there wasn't one."""
+
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.fetch:
+                self.fetch[host] = Histogram()
+            self.fetch[host].observe(elapsed)
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            self.counters["bytes"] += size
+
+    def timed(self, stage, elapsed):
+
+        with self.lock:
+            self.timings[stage].observe(elapsed)
+
+    def set_queue(self, name, size):
+
+        self.queues[name] = size
+
+    def report(self, force = False):
+        """Log the status line (and update the prometheus file) if the interval has passed."""
+
+        if not force and time.time() - self.last_report < self.interval:
+            return
+        self.last_report = time.time()
+        self.logger.info(self.status_line())
+        if self.prometheus_file is not None:
+            self.write_prometheus(self.prometheus_file)
+
+    def summary(self):
+
+        with self.lock:
+            elapsed = time.time() - self.start
+            return {
+                "elapsed": round(elapsed, 1),
+                "pages_per_second": round(self.counters["pages"] / elapsed, 3) if elapsed > 0 else 0.0,
+                "counters": dict(self.counters),
+                "status_codes": dict(self.statuses),
+                "fetch_latency": dict([ (host, hist.summary()) for host, hist in self.fetch.items() ]),
+                "timings": dict([ (stage, hist.summary()) for stage, hist in self.timings.items() ]),
+                "queues": dict(self.queues),
+            }
+
+    def status_line(self):
+
+        summary = self.summary()
+        counters = summary["counters"]
+        return "%d page(s) (%.2f/s), %.1f MB, %d retries, records %d accepted/%d rejected, " \
+               "parse %.3fs avg, extract %.3fs avg, store %.3fs avg, status %s, queues %s" % (
+            counters["pages"], summary["pages_per_second"], counters["bytes"] / 1024.0 ** 2,
+            counters["retries"], counters["records_accepted"], counters["records_rejected"],
+            summary["timings"]["parse"]["mean"], summary["timings"]["extract"]["mean"],
+            summary["timings"]["store"]["mean"],
+            " ".join([ "%s:%d" % item for item in sorted(summary["status_codes"].items()) ]) or "-",
+            " ".join([ "%s:%d" % item for item in sorted(summary["queues"].items()) ]) or "-")
+
+    def write_json(self, path):
+
+        with open(path, "w") as output:
+            json.dump(self.summary(), output, indent = 2, sort_keys = True)
+
+    def write_prometheus(self, path):
+        """
+        Write the current values in prometheus text format (e.g. for the node exporter textfile
+        collector).  The file is replaced rather than rewritten, so it is never read half written.
+        """
+
+        lines = [ ]
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append("# TYPE crawler_%s_total counter" % name)
+                lines.append("crawler_%s_total %d" % (name, value))
+            lines.append("# TYPE crawler_responses_total counter")
+            for status, value in sorted(self.statuses.items()):
+                lines.append('crawler_responses_total{status="%s"} %d' % (status, value))
+            lines.append("# TYPE crawler_queue_size gauge")
+            for name, value in sorted(self.queues.items()):
+                lines.append('crawler_queue_size{queue="%s"} %d' % (name, value))
+            lines.append("# TYPE crawler_fetch_seconds histogram")
+            for host, hist in sorted(self.fetch.items()):
+                lines.extend(self.histogram_lines("crawler_fetch_seconds", 'host="%s"' % host, hist))
+            lines.append("# TYPE crawler_stage_seconds histogram")
+            for stage, hist in sorted(self.timings.items()):
+                lines.extend(self.histogram_lines("crawler_stage_seconds", 'stage="%s"' % stage, hist))
+
+        with open(path + ".tmp", "w") as output:
+            output.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+
+    def histogram_lines(self, name, labels, hist):
+
+        lines, total = [ ], 0
+        for bound, count in zip(hist.buckets, hist.counts):
+            total += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, le, total))
+        lines.append("%s_sum{%s} %f" % (name, labels, hist.sum))
+        lines.append("%s_count{%s} %d" % (name, labels, hist.count))
+        return lines
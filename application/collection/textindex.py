@@ -0,0 +1,429 @@
+import os, re
+import math, heapq
+from array import array
+
+from .segments import MappedSegment, SegmentedIndex, write_ids
+
+# The fields searched, and their weights, for both the local index and mongo's default text index
+TEXT_FIELDS = [ "name", "recipeIngredient", "recipeInstructions" ]
+TEXT_WEIGHTS = { "name": 3, "recipeIngredient": 2, "recipeInstructions": 1 }
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Positions are stored with the field number in the top bits, so that a phrase can't span fields
+FIELD_SHIFT = 30
+
+# A prefix (e.g. leek*) matches at most this many terms, the most common first
+MAX_EXPANSIONS = 50
+# Indexes built with a different version (e.g. different tokenizing) are rebuilt
+INDEX_VERSION = 2
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+QUERY = re.compile(r'(-?)"([^"]*)"|(\S+)')
+
+def field_strings(value):
+    """The strings in a field, which may be a string, a list or (e.g. a HowToStep) a dict."""
+
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, list):
+        for item in value:
+            for text in field_strings(item):
+                yield text
+    elif isinstance(value, dict):
+        for text in field_strings(value.get("text", value.get("name"))):
+            yield text
+
+def stem(word):
+    """
+    A light stem, so that plurals match (e.g. tomatoes and tomato are both tomato, berries
+    and berry are both berri).  Mongo's text index stems more (e.g. -ing and -ed).
+    """
+
+    if len(word) <= 3:
+        return word
+    if word.endswith("ies"):
+        word = word[:-3] + "ie"
+    elif word.endswith(("sses", "oes", "ches", "shes", "xes", "zes")):
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        word = word[:-1]
+    if len(word) > 3 and word.endswith("ie"):
+        return word[:-2] + "i"
+    if len(word) > 3 and word.endswith("y") and word[-2] not in "aeiou":
+        return word[:-1] + "i"
+    return word
+
+def tokenize(text):
+
+    return [ stem(token) for token in TOKEN.findall(text.lower()) ]
+
+def analyze(document):
+    """
+    Index a document: returns the number of tokens in each field, and a dict of each term's
+    frequency in each field and positions.  Items of a list are a position apart, so that
+    phrases don't match across them.
+    """
+
+    lengths = [ 0 ] * len(TEXT_FIELDS)
+    terms = { }
+    for number, field in enumerate(TEXT_FIELDS):
+        position = 0
+        for text in field_strings(document.get(field)):
+            tokens = tokenize(text)
+            base = (number << FIELD_SHIFT) | position
+            for offset, token in enumerate(tokens):
+                entry = terms.get(token)
+                if entry is None:
+                    entry = terms[token] = ([ 0 ] * len(TEXT_FIELDS), [ ])
+                entry[0][number] += 1
+                entry[1].append(base + offset)
+            position += len(tokens) + 1
+            lengths[number] += len(tokens)
+    return lengths, terms
+
+def parse_query(text):
+    """
+    Parse a query in mongo's $text syntax: words (any of which may match), "phrases" (all of
+    which must match) and -negated words or phrases (none of which may match).  A word ending
+    in * matches any word it is a prefix of.  Returns lists of words, phrases (lists of words)
+    and negated phrases.
+    """
+
+    words, phrases, negated = [ ], [ ], [ ]
+    for minus, phrase, word in QUERY.findall(text):
+        if phrase:
+            tokens = tokenize(phrase)
+            if tokens:
+                (negated if minus else phrases).append(tokens)
+        else:
+            prefix = word.endswith("*")
+            tokens = tokenize(word)
+            if prefix and tokens:
+                # Prefixes aren't stemmed
+                tokens[-1] = TOKEN.findall(word.lower())[-1] + "*"
+            if word.startswith("-"):
+                negated += [ [ token ] for token in tokens ]
+            else:
+                words += tokens
+    return words, phrases, negated
+
+class SegmentWriter(object):
+    """
+    Writes a segment: terms must be added in sorted order, each with its postings (document
+    number, frequency in each field and positions) in document order.
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.files = dict([ (name, open(os.path.join(path, name), "wb")) for name in
+                            [ "terms.bin", "docs.bin", "freqs.bin", "positions.bin" ] ])
+        self.lexicon = array("Q")
+        self.starts = array("Q")
+        self.term_bytes = 0
+        self.postings = 0
+        self.positions = 0
+
+    def add_term(self, term, postings):
+        """Add a term (utf-8 encoded), with its postings."""
+
+        docs, freqs, positions, starts = array("I"), array("H"), array("I"), array("Q")
+        for doc, frequencies, doc_positions in postings:
+            docs.append(doc)
+            try:
+                freqs.extend(frequencies)
+            except OverflowError:
+                freqs.extend([ min([ f, 0xffff ]) for f in frequencies ])
+            starts.append(self.positions + len(positions))
+            positions.extend(doc_positions)
+        if not docs:
+            return
+
+        self.lexicon.extend([ self.term_bytes, self.postings ])
+        self.files["terms.bin"].write(term)
+        self.term_bytes += len(term)
+        docs.tofile(self.files["docs.bin"])
+        freqs.tofile(self.files["freqs.bin"])
+        positions.tofile(self.files["positions.bin"])
+        self.starts.extend(starts)
+        self.postings += len(docs)
+        self.positions += len(positions)
+
+    def close(self, ids, lengths):
+        """Finish the segment, with the ids (ObjectIds) and field lengths of its documents."""
+
+        self.lexicon.extend([ self.term_bytes, self.postings ])
+        self.starts.append(self.positions)
+        for source in self.files.values():
+            source.close()
+        for name, data in [ ("lexicon.bin", self.lexicon), ("starts.bin", self.starts), ("lengths.bin", lengths) ]:
+            with open(os.path.join(self.path, name), "wb") as output:
+                data.tofile(output)
+        write_ids(self.path, ids)
+
+class Segment(MappedSegment):
+    """
+    A segment of the text index: the sorted terms and the start of each term's postings
+    (lexicon), the postings (docs, freqs and the start of each posting's positions), positions,
+    and the field lengths of each document (see MappedSegment for ids and deleted documents).
+    """
+
+    def __init__(self, path, deleted = ( )):
+
+        super(Segment, self).__init__(path, deleted)
+        self.lexicon = self.map("lexicon.bin", "Q")
+        self.docs = self.map("docs.bin", "I")
+        self.freqs = self.map("freqs.bin", "H")
+        self.starts = self.map("starts.bin", "Q")
+        self.positions = self.map("positions.bin", "I")
+        self.lengths = self.map("lengths.bin", "I")
+        self.terms = self.map("terms.bin", "B")
+        self.term_count = len(self.lexicon) // 2 - 1
+
+    def term(self, number):
+
+        return self.terms[self.lexicon[2 * number]:self.lexicon[2 * number + 2]].tobytes()
+
+    def search_terms(self, term):
+        """The number of the first term not before term."""
+
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.term(middle) < term:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, term):
+        """The number of a term, or None."""
+
+        number = self.search_terms(term)
+        return number if number < self.term_count and self.term(number) == term else None
+
+    def prefixed(self, prefix):
+        """The terms starting with prefix."""
+
+        number = self.search_terms(prefix)
+        while number < self.term_count:
+            term = self.term(number)
+            if not term.startswith(prefix):
+                break
+            yield term
+            number += 1
+
+    def posting_range(self, number):
+
+        return self.lexicon[2 * number + 1], self.lexicon[2 * number + 3]
+
+    def postings(self, term):
+        """The (first, last) posting numbers for a term, or None."""
+
+        number = self.find(term)
+        return None if number is None else self.posting_range(number)
+
+    def doc_positions(self, posting):
+
+        return self.positions[self.starts[posting]:self.starts[posting + 1]]
+
+    def find_posting(self, first, last, doc):
+        """The posting for a document within a term's postings, or None."""
+
+        low, high = first, last
+        while low < high:
+            middle = (low + high) // 2
+            if self.docs[middle] < doc:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < last and self.docs[low] == doc else None
+
+class LocalIndex(SegmentedIndex):
+    """
+    A full text index of the name, ingredients and instructions of the recipes in a collection,
+    kept in segments (see Segment) and ranked with BM25, with field weights (TEXT_WEIGHTS) as in
+    mongo's default text index.  Queries use mongo's $text syntax, with prefixes (see
+    parse_query).  The index is built and refreshed as described in SegmentedIndex; recipes
+    deleted from the collection are skipped when results are retrieved.
+    """
+
+    kind = "Text index"
+    version = INDEX_VERSION
+    fields = TEXT_FIELDS
+    segment_class = Segment
+    segment_prefix = "seg"
+
+    def new_stats(self):
+
+        return { "docs": 0, "lengths": [ 0 ] * len(TEXT_FIELDS) }
+
+    def remove(self, segment, doc, stats):
+
+        super(LocalIndex, self).remove(segment, doc, stats)
+        for field in range(len(TEXT_FIELDS)):
+            stats["lengths"][field] -= segment.lengths[len(TEXT_FIELDS) * doc + field]
+
+    def write_segment(self, batch, path, stats):
+
+        postings, doc_lengths = { }, array("I")
+        for number, document in enumerate(batch):
+            field_lengths, terms = analyze(document)
+            doc_lengths.extend(field_lengths)
+            for field, length in enumerate(field_lengths):
+                stats["lengths"][field] += length
+            for term, entry in terms.items():
+                postings.setdefault(term, [ ]).append((number,) + entry)
+
+        # Strings sort in the same order as their utf-8 encodings
+        writer = SegmentWriter(path)
+        for term in sorted(postings):
+            writer.add_term(term.encode("utf-8"), postings[term])
+        writer.close([ document["_id"] for document in batch ], doc_lengths)
+
+    def merge(self, segments, path):
+        """Write the live documents of segments as a single segment."""
+
+        # Renumber the live documents, in segment order
+        numbers, ids, lengths = [ ], [ ], array("I")
+        for segment in segments:
+            mapping = { }
+            for doc in range(segment.doc_count):
+                if doc not in segment.deleted:
+                    mapping[doc] = len(ids)
+                    ids.append(segment.doc_id(doc))
+                    lengths.extend(segment.lengths[len(TEXT_FIELDS) * doc:len(TEXT_FIELDS) * (doc + 1)])
+            numbers.append(mapping)
+
+        def terms(index, segment):
+            for number in range(segment.term_count):
+                yield segment.term(number), index, number
+
+        def postings(sources):
+            for index, number in sources:
+                segment, mapping = segments[index], numbers[index]
+                first, last = segment.posting_range(number)
+                for posting in range(first, last):
+                    doc = mapping.get(segment.docs[posting])
+                    if doc is not None:
+                        freqs = segment.freqs[len(TEXT_FIELDS) * posting:len(TEXT_FIELDS) * (posting + 1)]
+                        yield doc, freqs.tolist(), segment.doc_positions(posting).tolist()
+
+        writer = SegmentWriter(path)
+        current, sources = None, [ ]
+        for term, index, number in heapq.merge(*[ terms(index, segment) for index, segment in enumerate(segments) ]):
+            if term != current and sources:
+                writer.add_term(current, postings(sources))
+                sources = [ ]
+            current = term
+            sources.append((index, number))
+        if sources:
+            writer.add_term(current, postings(sources))
+        writer.close(ids, lengths)
+
+    def expand(self, word):
+        """The terms a query word matches: itself, or the most common terms it is a prefix of."""
+
+        if not word.endswith("*"):
+            return [ word.encode("utf-8") ]
+        prefix = word[:-1].encode("utf-8")
+        counts = { }
+        for segment in self.segments:
+            for term in segment.prefixed(prefix):
+                first, last = segment.postings(term)
+                counts[term] = counts.get(term, 0) + last - first
+        return heapq.nlargest(MAX_EXPANSIONS, counts, key = counts.get)
+
+    def phrase_docs(self, segment, phrase):
+        """The documents in a segment containing a phrase."""
+
+        ranges = [ segment.postings(term.encode("utf-8")) for term in phrase ]
+        if None in ranges:
+            return set()
+        # Start from the term with the fewest postings
+        shortest = min(ranges, key = lambda r: r[1] - r[0])
+        found = set()
+        for posting in range(*shortest):
+            doc = segment.docs[posting]
+            if doc in segment.deleted:
+                continue
+            starts = None
+            for offset, (first, last) in enumerate(ranges):
+                match = segment.find_posting(first, last, doc)
+                if match is None:
+                    starts = set()
+                    break
+                positions = set([ position - offset for position in segment.doc_positions(match) ])
+                starts = positions if starts is None else starts & positions
+                if not starts:
+                    break
+            if starts:
+                found.add(doc)
+        return found
+
+    def search(self, text):
+        """
+        Search the index.  Returns a list of (id, score), best first, of the recipes matching
+        any word and every phrase, and no negated word or phrase.
+        """
+
+        if not self.segments:
+            return [ ]
+        words, phrases, negated = parse_query(text)
+        terms = set([ term for word in words for term in self.expand(word) ] +
+                    [ word.encode("utf-8") for phrase in phrases for word in phrase ])
+
+        total = max([ self.meta["docs"], 1 ])
+        averages = [ max([ length / float(total), 1.0 ]) for length in self.meta["lengths"] ]
+        weights = [ TEXT_WEIGHTS[field] for field in TEXT_FIELDS ]
+        fields = len(TEXT_FIELDS)
+
+        frequencies = { }
+        for term in terms:
+            for segment in self.segments:
+                found = segment.postings(term)
+                if found is not None:
+                    frequencies[term] = frequencies.get(term, 0) + found[1] - found[0]
+
+        results = [ ]
+        for segment in self.segments:
+            scores = { }
+            for term, frequency in frequencies.items():
+                found = segment.postings(term)
+                if found is None:
+                    continue
+                idf = math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+                first, last = found
+                for posting, doc in enumerate(segment.docs[first:last], first):
+                    if doc in segment.deleted:
+                        continue
+                    # BM25F: field frequencies are weighted and normalized by field length first
+                    tf = 0.0
+                    for field in range(fields):
+                        freq = segment.freqs[fields * posting + field]
+                        if freq:
+                            norm = 1 - B + B * segment.lengths[fields * doc + field] / averages[field]
+                            tf += weights[field] * freq / norm
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (K1 + 1) / (tf + K1)
+
+            for phrase in phrases:
+                matching = self.phrase_docs(segment, phrase)
+                scores = dict([ (doc, score) for doc, score in scores.items() if doc in matching ])
+            for phrase in negated:
+                excluded = self.phrase_docs(segment, phrase)
+                scores = dict([ (doc, score) for doc, score in scores.items() if doc not in excluded ])
+
+            results += [ (score, segment, doc) for doc, score in scores.items() ]
+
+        results.sort(key = lambda result: result[0], reverse = True)
+        return [ (segment.doc_id(doc), score) for score, segment, doc in results ]
+
+    def info(self):
+
+        info = super(LocalIndex, self).info()
+        if info is not None:
+            info["terms"] = sum([ segment.term_count for segment in self.segments ])
+        return info
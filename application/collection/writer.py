@@ -0,0 +1,173 @@
+import time
+import logging
+from threading import Lock, Thread, Event
+
+import bson
+import pymongo
+from pymongo.errors import BulkWriteError
+
+from ..profiling import region
+
+DUPLICATE_KEY = 11000
+
+class BulkWriter(object):
+    """
+    Buffers inserts and updates and sends them to mongo with unordered bulk writes.  The
+    buffer is flushed when it holds max_count operations or max_bytes of documents, or when
+    the oldest operation has waited max_delay seconds (checked by a background thread).
+
+    A failed operation (e.g. a duplicate key) is logged and counted without affecting the
+    rest of the batch.  If telemetry is supplied, the time taken by each batch is recorded.
+    If field_stats (a FieldStats) is supplied, the changes made by the operations that
+    succeed are applied to the stats document after each batch.  If on_write is supplied, it
+    is called after each batch with the urls of the operations that were written and of those
+    that failed (from the thread that made the bulk write).
+
+    The buffer is only locked while operations are added or a batch is taken from it; the
+    bulk write is made after the lock is released, so other threads can keep adding
+    operations.  Batches are taken and written one at a time (under flush_lock), so they are
+    written in order, and a thread whose operation fills the buffer waits for its batch to be
+    written.
+    """
+
+    def __init__(self, collection, max_count = 500, max_bytes = 4 * 1024 ** 2, max_delay = 5,
+                 telemetry = None, field_stats = None, on_write = None):
+
+        self.logger = logging.getLogger(__name__)
+        self.collection = collection
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.telemetry = telemetry
+        self.field_stats = field_stats
+        self.on_write = on_write
+
+        self.operations = [ ]
+        self.urls = [ ]
+        self.deltas = [ ]
+        self.size = 0
+        self.oldest = None
+        self.lock = Lock()
+        self.flush_lock = Lock()
+        self.stats = { "inserted": 0, "updated": 0, "upserted": 0, "duplicates": 0, "errors": 0, "batches": 0 }
+
+        self.stopped = Event()
+        self.flusher = Thread(target = self.flush_when_due, daemon = True)
+        self.flusher.start()
+
+    def insert(self, record):
+
+        delta = self.field_stats.delta(record) if self.field_stats is not None else None
+        self.add(pymongo.InsertOne(record), record.get("url"), record, delta)
+
+    def update(self, query, update, upsert = False, delta = None):
+        """Update a record; delta is the change the update makes to the field stats, if known."""
+
+        self.add(pymongo.UpdateOne(query, update, upsert = upsert), query.get("url"), update, delta)
+
+    def add(self, operation, url, document, delta = None):
+
+        with self.lock:
+            self.operations.append(operation)
+            self.urls.append(url)
+            self.deltas.append(delta)
+            self.size += len(bson.BSON.encode(document))
+            if self.oldest is None:
+                self.oldest = time.time()
+            full = len(self.operations) >= self.max_count or self.size >= self.max_bytes
+        if full:
+            self.flush()
+
+    def flush(self):
+
+        with self.flush_lock:
+            with self.lock:
+                operations, urls, deltas = self.operations, self.urls, self.deltas
+                self.operations, self.urls, self.deltas, self.size, self.oldest = [ ], [ ], [ ], 0, None
+            if operations:
+                self.write(operations, urls, deltas)
+
+    def flush_when_due(self):
+
+        while not self.stopped.wait(1):
+            with self.lock:
+                due = self.oldest is not None and time.time() - self.oldest >= self.max_delay
+            if due:
+                self.flush()
+
+    def write(self, operations, urls, deltas):
+        """Write a batch taken from the buffer (called with flush_lock held)."""
+
+        self.stats["batches"] += 1
+
+        start = time.time()
+        failed = set()
+        try:
+            with region("store"):
+                result = self.collection.bulk_write(operations, ordered = False)
+            details = result.bulk_api_result
+        except BulkWriteError as exc:
+            details = exc.details
+            for error in details["writeErrors"]:
+                url = urls[error["index"]]
+                deltas[error["index"]] = None
+                if error["code"] == DUPLICATE_KEY:
+                    self.stats["duplicates"] += 1
+                    self.logger.warn("Duplicate record: %s" % url)
+                else:
+                    failed.add(error["index"])
+                    self.stats["errors"] += 1
+                    self.logger.error("Could not store record %s: %s" % (url, error["errmsg"]))
+        except Exception as exc:
+            self.stats["errors"] += len(operations)
+            self.logger.error("Could not store %d record(s)!" % len(operations), exc_info = True)
+            if self.field_stats is not None:
+                self.update_field_stats(None)
+            self.report_write([ ], urls)
+            return
+
+        self.stats["inserted"] += details.get("nInserted", 0)
+        self.stats["updated"] += details.get("nModified", 0)
+        self.stats["upserted"] += details.get("nUpserted", 0)
+        self.logger.debug("Wrote batch of %d operation(s)" % len(operations))
+        if self.field_stats is not None:
+            self.update_field_stats(deltas)
+        if self.telemetry is not None:
+            self.telemetry.timed("store", time.time() - start)
+            self.telemetry.count("records_stored",
+                details.get("nInserted", 0) + details.get("nModified", 0) + details.get("nUpserted", 0))
+        self.report_write([ url for i, url in enumerate(urls) if i not in failed ],
+                          [ urls[i] for i in sorted(failed) ])
+
+    def report_write(self, written, failed):
+
+        if self.on_write is None:
+            return
+        try:
+            self.on_write(written, failed)
+        except Exception:
+            self.logger.error("Could not report written records!", exc_info = True)
+
+    def update_field_stats(self, deltas):
+        """Apply the changes from a batch to the field stats, or mark them stale if the batch failed."""
+
+        try:
+            if deltas is None:
+                self.field_stats.invalidate()
+            else:
+                self.field_stats.apply(deltas)
+        except Exception:
+            self.logger.error("Could not update field stats!", exc_info = True)
+
+    def summary(self):
+
+        return "Stored: %d inserted, %d updated, %d upserted, %d duplicate(s), %d error(s) in %d batch(es)" % (
+            self.stats["inserted"], self.stats["updated"], self.stats["upserted"],
+            self.stats["duplicates"], self.stats["errors"], self.stats["batches"])
+
+    def close(self):
+        """Flush anything left in the buffer and stop the background thread."""
+
+        self.stopped.set()
+        self.flusher.join()
+        self.flush()
@@ -0,0 +1,198 @@
+import sys, os
+import logging
+import cProfile, pstats
+import threading
+from collections import Counter
+from functools import wraps
+
+MODES = [ "cprofile", "sampling" ]
+REGIONS = [ "fetch", "parse", "extract", "store", "query", "render" ]
+
+# cProfile profiles a single thread before python 3.12, and the whole interpreter (with only
+# one profiler allowed at a time) from 3.12 on
+PER_THREAD = sys.version_info < (3, 12)
+
+# The running Profiler, if any; set by Profiler.start
+profiler = None
+
+class Region(object):
+    """Context manager marking code as part of a named region while a profiler is running."""
+
+    def __init__(self, active, name):
+
+        self.active = active
+        self.name = name
+        self.entered = False
+
+    def __enter__(self):
+
+        self.entered = self.active.enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+
+        if self.entered:
+            self.active.leave(self.name)
+        return False
+
+class NoRegion(object):
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        return False
+
+NO_REGION = NoRegion()
+
+def region(name):
+    """Mark the code in a with block as part of a named region.  Does nothing unless profiling."""
+
+    return NO_REGION if profiler is None else Region(profiler, name)
+
+def profiled(name):
+    """Decorator marking every call of a function as part of a named region."""
+
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with region(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+class Profiler(object):
+    """
+    Profiles a run of one of the entry points.  In cprofile mode, writes cProfile stats (for
+    pstats, snakeviz etc.) covering every thread.  In sampling mode, the stack of each thread is
+    sampled every interval seconds and the counts are written as collapsed stacks, one line
+    per stack, for flamegraph.pl or speedscope; stacks are prefixed with the thread name and
+    the regions they are in.
+
+    If regions are given, only code within those regions (see region and profiled) is
+    profiled.  Code run in other processes, such as the collector's parse workers, is not.
+    """
+
+    def __init__(self, path, mode = "cprofile", regions = None, interval = 0.005):
+
+        if mode not in MODES:
+            raise Exception("Invalid profile mode!  Valid modes: %s" % ", ".join(MODES))
+        unknown = [ name for name in regions or [ ] if name not in REGIONS ]
+        if unknown:
+            raise Exception("Invalid profile region %s!  Valid regions: %s" % (", ".join(unknown), ", ".join(REGIONS)))
+
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.mode = mode
+        self.regions = set(regions) if regions else None
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.active = { }
+        self.depth = 0
+        self.profiles = { }
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.sampler = None
+
+    def start(self):
+
+        global profiler
+        profiler = self
+        if self.mode == "sampling":
+            self.sampler = threading.Thread(target = self.sample, daemon = True)
+            self.sampler.start()
+        elif self.regions is None:
+            if PER_THREAD:
+                threading.setprofile(self.start_thread)
+            self.thread_profile().enable()
+
+    def stop(self):
+
+        global profiler
+        profiler = None
+        if self.mode == "sampling":
+            self.stopped.set()
+            self.sampler.join()
+        elif self.regions is None:
+            threading.setprofile(None)
+            self.thread_profile().disable()
+
+    def start_thread(self, frame, event, arg):
+        """Installed in new threads by threading.setprofile; hands over to a profile for the thread."""
+
+        sys.setprofile(None)
+        self.thread_profile().enable()
+
+    def thread_profile(self):
+
+        ident = threading.get_ident() if PER_THREAD else 0
+        with self.lock:
+            if ident not in self.profiles:
+                self.profiles[ident] = cProfile.Profile()
+            return self.profiles[ident]
+
+    def enter(self, name):
+        """Enter a region in the current thread.  Returns False if the region isn't profiled separately."""
+
+        if self.regions is not None and name not in self.regions:
+            return False
+        if self.mode == "cprofile" and self.regions is None:
+            return False
+
+        with self.lock:
+            names = self.active.setdefault(threading.get_ident(), [ ])
+            names.append(name)
+            self.depth += 1
+            first = len(names) == 1 if PER_THREAD else self.depth == 1
+        if self.mode == "cprofile" and first:
+            self.thread_profile().enable()
+        return True
+
+    def leave(self, name):
+
+        with self.lock:
+            names = self.active[threading.get_ident()]
+            names.pop()
+            self.depth -= 1
+            last = len(names) == 0 if PER_THREAD else self.depth == 0
+        if self.mode == "cprofile" and last:
+            self.thread_profile().disable()
+
+    def sample(self):
+
+        me = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            threads = dict([ (thread.ident, thread.name) for thread in threading.enumerate() ])
+            with self.lock:
+                active = dict([ (ident, list(names)) for ident, names in self.active.items() if names ])
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (self.regions is not None and ident not in active):
+                    continue
+                stack = [ ]
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s@%s:%d" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                labels = [ threads.get(ident, "thread-%d" % ident) ] + [ "[%s]" % name for name in active.get(ident, [ ]) ]
+                self.samples[";".join(labels + stack[::-1])] += 1
+
+    def write(self):
+
+        if self.mode == "sampling":
+            with open(self.path, "w") as output:
+                for stack, count in sorted(self.samples.items()):
+                    output.write("%s %d\n" % (stack.replace(" ", "_"), count))
+            self.logger.info("Wrote %d sample(s) to %s" % (sum(self.samples.values()), self.path))
+            return
+
+        profiles = [ profile for ident, profile in sorted(self.profiles.items()) ]
+        if not profiles:
+            self.logger.warning("Nothing was profiled; %s not written" % self.path)
+            return
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(self.path)
+        self.logger.info("Wrote profile of %d thread(s) to %s" % (len(profiles), self.path))
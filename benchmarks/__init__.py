@@ -0,0 +1 @@
+__all__ = [ 'extraction', 'load', 'site', 'store' ]
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+Offline benchmark for recipe extraction.  Runs each extraction method over the pages in
+benchmarks/fixtures, reports pages per second, p50/p99 latency per page and peak memory, and
+compares the results with the golden records in fixtures/golden.json.  Needs neither network
+access nor mongo.
+
+    python -m benchmarks.extraction [-n REPEAT] [-m METHOD ...] [-s FILE] [-b FILE] [-u]
+
+Exits with status 1 if any result differs from the golden records or (with -b) any method is
+slower than the saved baseline by more than the tolerance.
+"""
+
+import argparse, logging, json
+import os, sys, time, hashlib, resource
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from lxml import html
+
+from application.collection.extractor import Extractor
+from application.collection.profile_builder import ProfileBuilder
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+class Corpus(object):
+    """The fixture pages, with the site profile and fields to extract them with."""
+
+    def __init__(self, path = FIXTURES):
+
+        self.path = path
+        manifest = json.loads(open(os.path.join(path, "corpus.json")).read())
+        self.store_fields = manifest["store_fields"]
+        self.required_fields = manifest["required_fields"]
+        self.pages = manifest["pages"]
+        for page in self.pages:
+            with open(os.path.join(path, page["file"]), "rb") as f:
+                page["content"] = f.read()
+
+    def extractor(self, page):
+
+        return Extractor(page["site_profile"], self.store_fields, self.required_fields)
+
+    def golden(self):
+
+        try:
+            return json.loads(open(os.path.join(self.path, "golden.json")).read())
+        except FileNotFoundError:
+            return { }
+
+    def save_golden(self, golden):
+
+        with open(os.path.join(self.path, "golden.json"), "w") as f:
+            f.write(json.dumps(golden, indent = 2, sort_keys = True, ensure_ascii = False))
+            f.write("\n")
+
+class FixtureSession(object):
+    """Stands in for an http session, answering every request with a fixture page."""
+
+    def __init__(self, content):
+
+        self.content = content
+
+    def get(self, url, **kwargs):
+
+        return self
+
+    def raise_for_status(self):
+
+        pass
+
+def is_recipe_page(page, method = None):
+
+    return not page.get("index", False) and method in [ None, page["site_profile"]["extract_method"] ]
+
+def extract_records(site_extractor, page):
+
+    records, links = site_extractor.parse(page["content"], page["url"])
+    return records
+
+def extract_records_from_tree(site_extractor, page):
+
+    return site_extractor.extract_from_json_ld(html.fromstring(page["content"]), page["url"])
+
+def find_links(site_extractor, page):
+
+    records, links = site_extractor.parse(page["content"], page["url"], extract = False, follow_links = True)
+    return links
+
+def build_profile(site_extractor, page):
+
+    return ProfileBuilder(page["url"], FixtureSession(page["content"]))
+
+# Method name: (golden result it is checked against, pages it runs on, function to run)
+METHODS = {
+    "json-ld": ("records", lambda page: is_recipe_page(page, "json-ld"), extract_records),
+    "json-ld-tree": ("records", lambda page: is_recipe_page(page, "json-ld"), extract_records_from_tree),
+    "microdata": ("records", lambda page: is_recipe_page(page, "microdata"), extract_records),
+    "RDFa": ("records", lambda page: is_recipe_page(page, "RDFa"), extract_records),
+    "links": ("links", lambda page: page.get("index", False), find_links),
+    "profile": ("profile", is_recipe_page, build_profile),
+}
+METHOD_ORDER = [ "json-ld", "json-ld-tree", "microdata", "RDFa", "links", "profile" ]
+
+def normalize(key, result):
+    """Convert the result of a method to the json form kept in the golden records."""
+
+    if key == "records":
+        records = [ dict([ (k, v) for k, v in rec.items() if k != "collect_time" ]) for rec in result ]
+        return json.loads(json.dumps(records))
+    elif key == "links":
+        return {
+            "count": len(result),
+            "unique": len(set(result)),
+            "sha1": hashlib.sha1("\n".join(result).encode("utf-8")).hexdigest(),
+        }
+    else:
+        profile = result.get_profile()
+        profile["fields"] = sorted(result.fields)
+        return profile
+
+def peak_rss():
+    """Peak resident memory of this process in MB (ru_maxrss is in bytes on macOS, kB elsewhere)."""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+def init_worker(log_level):
+
+    logging.basicConfig(level = log_level.upper(), format = "[%(levelname)s:%(module)s] %(message)s")
+
+def run_method(name, repeat):
+    """
+    Run one method over its pages: once to collect the results, then repeat times to time
+    each page.  Runs in a fresh process so that the peak memory belongs to this method alone.
+    """
+
+    key, select, run = METHODS[name]
+    corpus = Corpus()
+    pages = [ page for page in corpus.pages if select(page) ]
+    extractors = dict([ (page["file"], corpus.extractor(page)) for page in pages ])
+
+    results = dict([ (page["file"], normalize(key, run(extractors[page["file"]], page))) for page in pages ])
+
+    samples = [ ]
+    for i in range(repeat):
+        for page in pages:
+            start = time.perf_counter()
+            run(extractors[page["file"]], page)
+            samples.append(time.perf_counter() - start)
+
+    return { "pages": len(pages), "samples": samples, "results": results, "peak_rss": peak_rss() }
+
+def percentile(samples, q):
+
+    ordered = sorted(samples)
+    return ordered[min([ len(ordered) - 1, int(q * len(ordered)) ])] if ordered else 0.0
+
+def summarize(run):
+
+    samples = run["samples"]
+    return {
+        "pages": run["pages"],
+        "pages_per_second": round(len(samples) / sum(samples), 1) if samples else 0.0,
+        "p50_ms": round(percentile(samples, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+        "peak_rss_mb": round(run["peak_rss"], 1),
+    }
+
+def check_golden(name, results, golden, updated = None):
+    """
+    Compare results with the golden records and return the pages that differ.  If updating
+    (updated is a set), results replace the golden records instead, unless another method
+    with the same kind of result has already replaced them in this run.
+    """
+
+    key = METHODS[name][0]
+    differ = [ ]
+    for page, result in sorted(results.items()):
+        expected = golden.setdefault(page, { })
+        if updated is not None and (page, key) not in updated:
+            expected[key] = result
+            updated.add((page, key))
+        elif expected.get(key) != result:
+            differ.append(page)
+    return differ
+
+def check_baseline(summary, baseline, tolerance):
+    """Return the methods that are slower than the baseline by more than the tolerance."""
+
+    slower = [ ]
+    for name, current in summary.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current["pages_per_second"] < previous["pages_per_second"] * (1 - tolerance) or \
+           current["p99_ms"] > previous["p99_ms"] * (1 + tolerance):
+            slower.append(name)
+    return slower
+
+def main(args):
+
+    init_worker(args.log_level)
+    logger = logging.getLogger()
+
+    corpus = Corpus()
+    golden = corpus.golden()
+    updated = set() if args.update_golden else None
+    summary, differ = { }, { }
+
+    sys.stdout.write("%-14s %6s %10s %9s %9s %9s  %s\n" % ("method", "pages", "pages/s", "p50 ms", "p99 ms", "peak MB", "golden"))
+    for name in args.methods:
+        with ProcessPoolExecutor(1, mp_context = get_context("spawn"), initializer = init_worker,
+                                 initargs = (args.worker_log_level, )) as pool:
+            run = pool.submit(run_method, name, args.repeat).result()
+        summary[name] = summarize(run)
+        differ[name] = check_golden(name, run["results"], golden, updated)
+        sys.stdout.write("%-14s %6d %10.1f %9.3f %9.3f %9.1f  %s\n" % (name, summary[name]["pages"],
+                         summary[name]["pages_per_second"], summary[name]["p50_ms"], summary[name]["p99_ms"],
+                         summary[name]["peak_rss_mb"], "differs" if differ[name] else "ok"))
+
+    failed = False
+    if args.update_golden:
+        corpus.save_golden(golden)
+        logger.info("Golden records written to %s" % os.path.join(corpus.path, "golden.json"))
+    for name in args.methods:
+        for page in differ[name]:
+            logger.error("%s: result for %s differs from the golden records" % (name, page))
+            failed = True
+
+    if args.baseline is not None:
+        baseline = json.loads(open(args.baseline).read())
+        for name in check_baseline(summary, baseline, args.tolerance):
+            logger.error("%s: slower than baseline (%.1f pages/s, p99 %.3f ms; was %.1f pages/s, p99 %.3f ms)" % (
+                         name, summary[name]["pages_per_second"], summary[name]["p99_ms"],
+                         baseline[name]["pages_per_second"], baseline[name]["p99_ms"]))
+            failed = True
+
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            f.write(json.dumps(summary, indent = 2, sort_keys = True))
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "offline recipe extraction benchmark")
+    parser.add_argument("-n", "--repeat", metavar = "N", dest = "repeat", default = 50, type = int,
+                        help = "time each page %(metavar)s times [default: %(default)d]")
+    parser.add_argument("-m", "--methods", metavar = "METHOD", dest = "methods", nargs = "+",
+                        default = METHOD_ORDER, choices = METHOD_ORDER,
+                        help = "benchmark only %(metavar)s [default: all of %(choices)s]")
+    parser.add_argument("-s", "--save", metavar = "FILE", dest = "save", default = None,
+                        help = "save the results to %(metavar)s for use as a baseline")
+    parser.add_argument("-b", "--baseline", metavar = "FILE", dest = "baseline", default = None,
+                        help = "fail if any method is slower than the results saved in %(metavar)s")
+    parser.add_argument("-t", "--tolerance", metavar = "FRACTION", dest = "tolerance", default = 0.2, type = float,
+                        help = "allow methods to be slower than the baseline by %(metavar)s [default: %(default)s]")
+    parser.add_argument("-u", "--update-golden", dest = "update_golden", action = "store_true", default = False,
+                        help = "replace the golden records with the current results")
+    parser.add_argument("-l", "--log-level", metavar = "LOGLEVEL", dest = "log_level", default = "INFO",
+                        help = "set the log level to %(metavar)s [default: %(default)s]")
+    parser.add_argument("-L", "--worker-log-level", metavar = "LOGLEVEL", dest = "worker_log_level", default = "ERROR",
+                        help = "set the log level while extracting to %(metavar)s [default: %(default)s]")
+
+    args = parser.parse_args()
+    sys.exit(main(args))
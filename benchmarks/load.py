@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+End to end crawl load test.  Starts the synthetic recipe site (benchmarks.site) in a separate
+process, crawls it with a Collector storing into an in-memory collection, and reports the
+throughput of the whole pipeline: fetching, parsing and storing.
+
+    python -m benchmarks.load [-n CONCURRENCY] [-P PARSE_WORKERS] [-H HOSTS] [site options]
+
+The crawl starts from the home page of each host, so with the default depth of 2 it covers
+the index pages and every recipe they list; use -d 3 to follow related recipe links too.
+"""
+
+import argparse, logging, json
+import sys, time
+from threading import Event
+from multiprocessing import get_context
+
+from application.collection.collector import Collector
+from application.collection.session import make_session
+from application.collection.telemetry import Telemetry
+
+from .site import add_site_arguments, make_site, serve
+from .store import MemoryCollection
+
+STORE_FIELDS = [
+    "name", "author", "image", "datePublished", "totalTime", "prepTime", "cookTime", "recipeYield",
+    "recipeIngredient", "recipeInstructions", "cookingMethod", "recipeCategory", "recipeCuisine",
+]
+REQUIRED_FIELDS = [ "name", "recipeIngredient" ]
+
+def run_sites(args, hosts, ready):
+    """Serve the site on hosts free ports (each port is a separate host to the crawler) until terminated."""
+
+    logging.basicConfig(level = args.log_level.upper(), format = "[%(levelname)s:%(module)s] %(message)s")
+    servers = [ serve(make_site(args)) for i in range(hosts) ]
+    ready.put([ "http://127.0.0.1:%d" % server.server_address[1] for server in servers ])
+    Event().wait()
+
+def start_sites(args):
+
+    context = get_context("spawn")
+    ready = context.Queue()
+    process = context.Process(target = run_sites, args = (args, args.hosts, ready), daemon = True)
+    process.start()
+    return process, ready.get(timeout = 30)
+
+def server_stats(session, urls):
+    """Add up the responses served by each host."""
+
+    stats = { }
+    for url in urls:
+        for status, count in session.get(url + "/_stats").json().items():
+            stats[status] = stats.get(status, 0) + count
+    return stats
+
+def main(args):
+
+    logging.basicConfig(level = args.log_level.upper(), format = "[%(levelname)s:%(module)s] %(message)s")
+    logger = logging.getLogger()
+
+    process = None
+    if args.url is None:
+        process, urls = start_sites(args)
+    else:
+        urls = [ url.rstrip("/") for url in args.url ]
+    logger.info("Crawling %s" % ", ".join(urls))
+
+    site_profile = {
+        "base_url": urls[0],
+        "link_prefix": "http://[^/]+/recipes/",
+        "extract_method": args.markup,
+    }
+    collection = MemoryCollection(latency = args.store_latency)
+    telemetry = Telemetry(args.stats_interval)
+    session = make_session(timeout = 60, pool_maxsize = max([ 10, args.concurrency ]))
+
+    coll = Collector(collection, [ url + "/" for url in urls ], site_profile,
+                     store_fields = STORE_FIELDS, required_fields = REQUIRED_FIELDS,
+                     link_depth = args.depth, pause = args.wait, min_pause = args.min_wait,
+                     concurrency = args.concurrency, parse_workers = args.parse_workers,
+                     queue_size = args.queue_size, session = session, telemetry = telemetry)
+    coll.retry_interval = args.retry_interval
+
+    start = time.time()
+    try:
+        coll.process_links()
+    finally:
+        coll.close()
+    elapsed = time.time() - start
+
+    summary = telemetry.summary()
+    results = {
+        "elapsed": round(elapsed, 2),
+        "pages": summary["counters"]["pages"],
+        "pages_per_second": round(summary["counters"]["pages"] / elapsed, 2),
+        "records": collection.count_documents(),
+        "records_per_second": round(collection.count_documents() / elapsed, 2),
+        "bulk_writes": collection.writes,
+        "client": summary,
+        "server": server_stats(session, urls),
+        "options": dict([ (name, value) for name, value in vars(args).items() if name not in [ "log_level", "stats_file" ] ]),
+    }
+    session.close()
+    if process is not None:
+        process.terminate()
+
+    sys.stdout.write("\nCrawled %d page(s) in %.1fs: %.1f pages/s, %d record(s) stored (%.1f/s) in %d bulk write(s)\n" % (
+                     results["pages"], elapsed, results["pages_per_second"], results["records"],
+                     results["records_per_second"], results["bulk_writes"]))
+    sys.stdout.write("Server responses: %s\n" % " ".join([ "%s:%d" % item for item in sorted(results["server"].items()) ]))
+    for host, latency in sorted(summary["fetch_latency"].items()):
+        sys.stdout.write("Fetch latency for %s: mean %.3fs, p50 %.3fs, p99 %.3fs, max %.3fs\n" % (
+                         host, latency["mean"], latency["p50"], latency["p99"], latency["max"]))
+    sys.stdout.write("Parse %.4fs avg, extract %.4fs avg, store %.4fs avg, %d retries, %d failure(s)\n" % (
+                     summary["timings"]["parse"]["mean"], summary["timings"]["extract"]["mean"],
+                     summary["timings"]["store"]["mean"],
+                     summary["counters"]["retries"], summary["counters"]["failures"]))
+
+    if args.stats_file is not None:
+        with open(args.stats_file, "w") as output:
+            json.dump(results, output, indent = 2, sort_keys = True)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "crawl load test against a synthetic recipe site")
+    parser.add_argument("-u", "--url", metavar = "URL", dest = "url", nargs = "+", default = None,
+                        help = "crawl a synthetic site already running at %(metavar)s instead of starting one")
+    parser.add_argument("-H", "--hosts", metavar = "N", dest = "hosts", default = 1, type = int,
+                        help = "serve the site as %(metavar)s separate hosts [default: %(default)d]")
+    add_site_arguments(parser)
+    parser.add_argument("-d", "--depth", metavar = "N", dest = "depth", default = 2, type = int,
+                        help = "follow links to depth %(metavar)s [default: %(default)d]")
+    parser.add_argument("-n", "--concurrency", metavar = "N", dest = "concurrency", default = 10, type = int,
+                        help = "retrieve up to %(metavar)s pages at once [default: %(default)d]")
+    parser.add_argument("-P", "--parse-workers", metavar = "N", dest = "parse_workers", default = 0, type = int,
+                        help = "parse pages in %(metavar)s separate processes [default: parse as retrieved]")
+    parser.add_argument("-q", "--queue-size", metavar = "N", dest = "queue_size", default = 100, type = int,
+                        help = "allow %(metavar)s pages to wait for parsing or storage [default: %(default)d]")
+    parser.add_argument("-w", "--wait", metavar = "SECONDS", dest = "wait", default = 0, type = float,
+                        help = "wait %(metavar)s between requests to a host [default: %(default)s]")
+    parser.add_argument("-W", "--min-wait", metavar = "SECONDS", dest = "min_wait", default = None, type = float,
+                        help = "speed up to %(metavar)s between requests to a responsive host [default: same as wait]")
+    parser.add_argument("-r", "--retry-interval", metavar = "SECONDS", dest = "retry_interval", default = 1, type = float,
+                        help = "wait at least %(metavar)s times the number of tries before retrying [default: %(default)s]")
+    parser.add_argument("-D", "--store-latency", metavar = "SECONDS", dest = "store_latency", default = 0.0, type = float,
+                        help = "delay each bulk write by %(metavar)s [default: %(default)s]")
+    parser.add_argument("-s", "--stats-file", metavar = "FILE", dest = "stats_file", default = None,
+                        help = "write the results as json to %(metavar)s")
+    parser.add_argument("-i", "--stats-interval", metavar = "SECONDS", dest = "stats_interval", default = 10, type = int,
+                        help = "log crawl statistics every %(metavar)s [default: %(default)d]")
+    parser.add_argument("-l", "--log-level", metavar = "LOGLEVEL", dest = "log_level", default = "INFO",
+                        help = "set the log level to %(metavar)s [default: %(default)s]")
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+"""
+Synthetic recipe site for crawl load tests.  Serves index pages listing recipes and recipe
+pages (marked up with json-ld, microdata or RDFa) that link to related recipes, with
+configurable latency, server errors and throttling.
+
+    python -m benchmarks.site [-p PORT] [-N PAGES] [-f FANOUT] [-m MARKUP] ...
+
+The site is laid out as:
+
+    /                       links to every index page
+    /recipes/page/<n>       index page n, listing fanout recipes
+    /recipes/<n>            recipe n, linking to fanout related recipes
+    /_stats                 json counts of the responses served so far
+"""
+
+import argparse, logging, json
+import sys, time, random, math, zlib
+from threading import Lock, Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+INGREDIENTS = [
+    "olive oil", "unsalted butter", "garlic cloves", "yellow onion", "kosher salt", "black pepper",
+    "all-purpose flour", "large eggs", "whole milk", "parmesan", "lemon", "fresh thyme", "leeks",
+    "chicken thighs", "canned tomatoes", "red pepper flakes", "brown sugar", "heavy cream",
+    "white wine", "shallots", "carrots", "celery", "fresh parsley", "rice", "chickpeas",
+]
+UNITS = [ "1 cup", "2 tablespoons", "1 teaspoon", "3", "½ cup", "1 pound", "4 ounces", "a pinch of" ]
+STEPS = [
+    "Heat the oven and prepare a baking dish.", "Chop the vegetables and set them aside.",
+    "Cook, stirring occasionally, until softened.", "Season generously with salt and pepper.",
+    "Simmer until thickened and reduced by half.", "Whisk together until smooth.",
+    "Transfer to a serving dish and garnish.", "Let rest for ten minutes before serving.",
+]
+CATEGORIES = [ "Dinner", "Lunch", "Breakfast", "Dessert", "Side" ]
+CUISINES = [ "Italian", "French", "Mexican", "Thai", "American", "Indian" ]
+MARKUPS = [ "json-ld", "microdata", "RDFa" ]
+
+class SyntheticSite(object):
+    """
+    Generates the pages of the site and decides how each request is answered.  Content is
+    determined by the seed, so every run of a load test sees the same site; latency, errors
+    and throttling are random.
+
+    Latency is log-normally distributed with the given median and sigma (zero for a fixed
+    delay).  A fraction error_rate of requests fail with a 500 or 503, and a fraction
+    throttle_rate are answered with a 429 and a Retry-After header of retry_after seconds.
+    If rate_limit is set, requests beyond that many per second are throttled as well.
+    Pages are padded to roughly padding bytes to resemble real pages.
+    """
+
+    def __init__(self, pages = 1000, fanout = 10, markup = "json-ld", latency = 0.0, latency_sigma = 0.5,
+                 error_rate = 0.0, throttle_rate = 0.0, retry_after = 1, rate_limit = None,
+                 padding = 20000, seed = 0):
+
+        if markup not in MARKUPS:
+            raise Exception("Invalid markup!  Valid types: %s" % ", ".join(MARKUPS))
+
+        self.logger = logging.getLogger(__name__)
+        self.pages = pages
+        self.fanout = fanout
+        self.markup = markup
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rate_limit = rate_limit
+        self.padding = padding
+        self.seed = seed
+
+        self.random = random.Random()
+        self.lock = Lock()
+        self.tokens = rate_limit
+        self.refilled = time.time()
+        self.stats = { }
+
+    def index_pages(self):
+
+        return int(math.ceil(self.pages / float(self.fanout)))
+
+    def respond(self, path, base_url, headers = { }):
+        """Return the status, headers and body for a request, after the simulated latency."""
+
+        if path == "/_stats":
+            with self.lock:
+                return 200, { "Content-Type": "application/json" }, json.dumps(self.stats).encode("utf-8")
+
+        status, extra, body = self.choose(path, base_url, headers)
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+
+        with self.lock:
+            self.stats[str(status)] = self.stats.get(str(status), 0) + 1
+        return status, extra, body
+
+    def choose(self, path, base_url, headers):
+
+        with self.lock:
+            draw = self.random.random()
+            if self.rate_limit is not None:
+                now = time.time()
+                self.tokens = min([ self.rate_limit, self.tokens + (now - self.refilled) * self.rate_limit ])
+                self.refilled = now
+                limited = self.tokens < 1
+                if not limited:
+                    self.tokens -= 1
+            else:
+                limited = False
+
+        if limited or draw < self.throttle_rate:
+            return 429, { "Retry-After": str(self.retry_after) }, b"Too many requests"
+        if draw < self.throttle_rate + self.error_rate:
+            return self.random.choice([ 500, 503 ]), { }, b"Server error"
+
+        body = self.render(path.split("?", 1)[0], base_url)
+        if body is None:
+            return 404, { }, b"Not found"
+        etag = '"%s-%d"' % (self.markup, zlib.crc32(body))
+        if headers.get("If-None-Match") == etag:
+            return 304, { "ETag": etag }, b""
+        return 200, { "Content-Type": "text/html; charset=utf-8", "ETag": etag }, body
+
+    def delay(self):
+
+        if self.latency <= 0:
+            return 0.0
+        if self.latency_sigma <= 0:
+            return self.latency
+        with self.lock:
+            return self.random.lognormvariate(math.log(self.latency), self.latency_sigma)
+
+    def render(self, path, base_url):
+
+        parts = [ part for part in path.split("/") if part ]
+        try:
+            if not parts:
+                return self.render_home(base_url)
+            if len(parts) == 3 and parts[:2] == [ "recipes", "page" ] and 0 < int(parts[2]) <= self.index_pages():
+                return self.render_index(int(parts[2]), base_url)
+            if len(parts) == 2 and parts[0] == "recipes" and 0 <= int(parts[1]) < self.pages:
+                return self.render_recipe(int(parts[1]), base_url)
+        except ValueError:
+            pass
+        return None
+
+    def render_home(self, base_url):
+
+        links = [ '<li><a href="%s/recipes/page/%d">Recipes, page %d</a></li>' % (base_url, n, n)
+                  for n in range(1, self.index_pages() + 1) ]
+        return self.page("Synthetic recipes", "<ul>%s</ul>" % "".join(links))
+
+    def render_index(self, number, base_url):
+
+        first = (number - 1) * self.fanout
+        cards = [ '<div class="card"><a href="%s/recipes/%d?ref=index">%s</a></div>' % (base_url, n, self.recipe_name(n))
+                  for n in range(first, min([ first + self.fanout, self.pages ])) ]
+        pager = '<a href="%s/recipes/page/%d">Next</a>' % (base_url, number + 1) if number < self.index_pages() else ""
+        return self.page("Recipes, page %d" % number, "".join(cards) + pager)
+
+    def recipe(self, number):
+
+        rnd = random.Random("%d-%d" % (self.seed, number))
+        return {
+            "name": self.recipe_name(number),
+            "author": "Cook %d" % rnd.randrange(100),
+            "image": "/images/%d.jpg" % number,
+            "datePublished": "20%02d-%02d-%02d" % (rnd.randrange(10, 22), rnd.randrange(1, 13), rnd.randrange(1, 29)),
+            "totalTime": "PT%dM" % rnd.randrange(15, 120, 5),
+            "recipeYield": "%d servings" % rnd.randrange(2, 9),
+            "recipeIngredient": [ "%s %s" % (rnd.choice(UNITS), item) for item in rnd.sample(INGREDIENTS, rnd.randrange(4, 12)) ],
+            "recipeInstructions": rnd.sample(STEPS, rnd.randrange(3, len(STEPS))),
+            "recipeCategory": rnd.choice(CATEGORIES),
+            "recipeCuisine": rnd.choice(CUISINES),
+            "related": [ rnd.randrange(self.pages) for i in range(self.fanout) ],
+        }
+
+    def recipe_name(self, number):
+
+        rnd = random.Random("%d-name-%d" % (self.seed, number))
+        return "%s %s with %s" % (rnd.choice([ "Roasted", "Braised", "Quick", "Crispy", "Spiced", "Classic" ]),
+                                  rnd.choice(INGREDIENTS).title(), rnd.choice(INGREDIENTS))
+
+    def render_recipe(self, number, base_url):
+
+        recipe = self.recipe(number)
+        related = "".join([ '<li><a href="%s/recipes/%d">%s</a></li>' % (base_url, n, self.recipe_name(n))
+                            for n in recipe.pop("related") ])
+        if self.markup == "json-ld":
+            data = dict(recipe)
+            data.update({ "@context": "http://schema.org", "@type": "Recipe" })
+            head = '<script type="application/ld+json">%s</script>' % json.dumps(data)
+            body = "<h1>%s</h1>" % recipe["name"]
+        else:
+            head = ""
+            body = self.render_html(recipe)
+        return self.page(recipe["name"], '<article>%s</article><ul class="related">%s</ul>' % (body, related), head)
+
+    def render_html(self, recipe):
+
+        if self.markup == "microdata":
+            scope, attr = 'itemscope itemtype="http://schema.org/Recipe"', "itemprop"
+        else:
+            scope, attr = 'vocab="http://schema.org/" typeof="Recipe"', "property"
+        return "".join([
+            '<div %s>' % scope,
+            '<h1 %s="name">%s</h1>' % (attr, recipe["name"]),
+            '<p>By <span %s="author">%s</span></p>' % (attr, recipe["author"]),
+            '<img %s="image" src="%s">' % (attr, recipe["image"]),
+            '<meta %s="datePublished" content="%s">' % (attr, recipe["datePublished"]),
+            '<meta %s="totalTime" content="%s">' % (attr, recipe["totalTime"]),
+            '<p>Serves <span %s="recipeYield">%s</span></p>' % (attr, recipe["recipeYield"]),
+            '<ul>%s</ul>' % "".join([ '<li %s="recipeIngredient">%s</li>' % (attr, item) for item in recipe["recipeIngredient"] ]),
+            '<ol %s="recipeInstructions">%s</ol>' % (attr, "".join([ "<li>%s</li>" % step for step in recipe["recipeInstructions"] ])),
+            '<span %s="recipeCategory">%s</span>' % (attr, recipe["recipeCategory"]),
+            '<span %s="recipeCuisine">%s</span>' % (attr, recipe["recipeCuisine"]),
+            '</div>',
+        ])
+
+    def page(self, title, body, head = ""):
+
+        content = '<!DOCTYPE html><html><head><meta charset="utf-8"><title>%s</title>%s</head><body>%s' % (title, head, body)
+        filler = '<p class="filler">Sponsored content and comments from readers go here.</p>'
+        content += filler * max([ 0, (self.padding - len(content)) // len(filler) ])
+        return (content + "</body></html>").encode("utf-8")
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, keep-alive responses stall on delayed acks
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+
+        base_url = "http://%s" % self.headers.get("Host", "%s:%d" % self.server.server_address)
+        status, headers, body = self.server.site.respond(self.path, base_url, self.headers)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+
+        logging.getLogger(__name__).debug(format % args)
+
+def serve(site, host = "127.0.0.1", port = 0, background = True):
+    """Serve the site on host and port (any free port if 0); returns the server, running in a thread if background is set."""
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.site = site
+    if background:
+        Thread(target = server.serve_forever, daemon = True).start()
+    else:
+        server.serve_forever()
+    return server
+
+def add_site_arguments(parser):
+    """Add the options describing the site, shared with the load test."""
+
+    parser.add_argument("-N", "--pages", metavar = "N", dest = "pages", default = 1000, type = int,
+                        help = "serve %(metavar)s recipe pages [default: %(default)d]")
+    parser.add_argument("-f", "--fanout", metavar = "N", dest = "fanout", default = 10, type = int,
+                        help = "link to %(metavar)s recipes from each page [default: %(default)d]")
+    parser.add_argument("-m", "--markup", metavar = "TYPE", dest = "markup", default = "json-ld", choices = MARKUPS,
+                        help = "mark up recipes with %(metavar)s, one of %(choices)s [default: %(default)s]")
+    parser.add_argument("-L", "--latency", metavar = "SECONDS", dest = "latency", default = 0.0, type = float,
+                        help = "delay responses by a median of %(metavar)s [default: %(default)s]")
+    parser.add_argument("--latency-sigma", metavar = "SIGMA", dest = "latency_sigma", default = 0.5, type = float,
+                        help = "spread delays log-normally with %(metavar)s, 0 for a fixed delay [default: %(default)s]")
+    parser.add_argument("-e", "--error-rate", metavar = "FRACTION", dest = "error_rate", default = 0.0, type = float,
+                        help = "fail %(metavar)s of requests with a 500 or 503 [default: %(default)s]")
+    parser.add_argument("-t", "--throttle-rate", metavar = "FRACTION", dest = "throttle_rate", default = 0.0, type = float,
+                        help = "answer %(metavar)s of requests with a 429 [default: %(default)s]")
+    parser.add_argument("-R", "--retry-after", metavar = "SECONDS", dest = "retry_after", default = 1, type = int,
+                        help = "ask for a wait of %(metavar)s in 429 responses [default: %(default)d]")
+    parser.add_argument("--rate-limit", metavar = "N", dest = "rate_limit", default = None, type = float,
+                        help = "throttle requests beyond %(metavar)s per second [default: no limit]")
+    parser.add_argument("--padding", metavar = "BYTES", dest = "padding", default = 20000, type = int,
+                        help = "pad pages to about %(metavar)s [default: %(default)d]")
+    parser.add_argument("--seed", metavar = "N", dest = "seed", default = 0, type = int,
+                        help = "generate content from seed %(metavar)s [default: %(default)d]")
+
+def make_site(args):
+
+    return SyntheticSite(pages = args.pages, fanout = args.fanout, markup = args.markup, latency = args.latency,
+                         latency_sigma = args.latency_sigma, error_rate = args.error_rate,
+                         throttle_rate = args.throttle_rate, retry_after = args.retry_after,
+                         rate_limit = args.rate_limit, padding = args.padding, seed = args.seed)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "synthetic recipe site for load tests")
+    parser.add_argument("-H", "--host", metavar = "HOST", dest = "host", default = "127.0.0.1",
+                        help = "listen on %(metavar)s [default: %(default)s]")
+    parser.add_argument("-p", "--port", metavar = "PORT", dest = "port", default = 8000, type = int,
+                        help = "listen on %(metavar)s [default: %(default)d]")
+    add_site_arguments(parser)
+    parser.add_argument("-l", "--log-level", metavar = "LOGLEVEL", dest = "log_level", default = "INFO",
+                        help = "set the log level to %(metavar)s [default: %(default)s]")
+
+    args = parser.parse_args()
+    logging.basicConfig(level = args.log_level.upper(), format = "[%(levelname)s:%(module)s] %(message)s")
+    logging.getLogger(__name__).info("Serving %d recipe(s) marked up with %s on http://%s:%d" % (
+                                     args.pages, args.markup, args.host, args.port))
+    try:
+        serve(make_site(args), args.host, args.port, background = False)
+    except KeyboardInterrupt:
+        pass
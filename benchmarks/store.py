@@ -0,0 +1,115 @@
+import time
+from threading import Lock
+from pymongo import InsertOne, UpdateOne
+
+class MemoryCollection(object):
+    """
+    Stands in for the mongo collection in load tests: just enough of the pymongo collection
+    interface for the collector (url lookups, index creation and bulk writes), with documents
+    kept in memory and indexed by url.  Each bulk write can be delayed by latency seconds to
+    simulate a round trip to the database.
+    """
+
+    def __init__(self, name = "memory", latency = 0.0):
+
+        self.name = name
+        self.latency = latency
+        self.lock = Lock()
+        self.documents = [ ]
+        self.by_url = { }
+        self.indexes = { "_id_": { "key": [ ("_id", 1) ] } }
+        self.writes = 0
+
+    def matches(self, document, query):
+
+        for field, value in query.items():
+            if isinstance(value, dict) and "$in" in value:
+                if document.get(field) not in value["$in"]:
+                    return False
+            elif document.get(field) != value:
+                return False
+        return True
+
+    def candidates(self, query):
+        """Documents that might match a query, using the url index where possible."""
+
+        urls = query.get("url")
+        if urls is None:
+            return list(self.documents)
+        if isinstance(urls, dict) and "$in" in urls:
+            urls = urls["$in"]
+        else:
+            urls = [ urls ]
+        return [ doc for url in set(urls) for doc in self.by_url.get(url, [ ]) ]
+
+    def find(self, query = { }, projection = None, **kwargs):
+
+        with self.lock:
+            found = [ doc for doc in self.candidates(query) if self.matches(doc, query) ]
+        if projection is None:
+            return [ dict(doc) for doc in found ]
+        fields = [ field for field, value in (projection.items() if isinstance(projection, dict) else
+                                              [ (field, 1) for field in projection ]) if value ]
+        return [ dict([ (field, doc[field]) for field in fields + [ "_id" ] if field in doc ]) for doc in found ]
+
+    def find_one(self, query = { }, projection = None):
+
+        found = self.find(query, projection)
+        return found[0] if found else None
+
+    def count_documents(self, query = { }):
+
+        return len(self.find(query))
+
+    def index_information(self):
+
+        return dict(self.indexes)
+
+    def create_index(self, keys, name = None, **kwargs):
+
+        name = name or "_".join([ "%s_%s" % key for key in keys ])
+        self.indexes[name] = dict(kwargs, key = keys)
+        return name
+
+    def insert(self, document):
+
+        document.setdefault("_id", len(self.documents))
+        self.documents.append(document)
+        self.by_url.setdefault(document.get("url"), [ ]).append(document)
+
+    def insert_many(self, documents, ordered = True):
+
+        with self.lock:
+            for document in documents:
+                self.insert(document)
+
+    def bulk_write(self, operations, ordered = True):
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        result = { "nInserted": 0, "nModified": 0, "nUpserted": 0 }
+        with self.lock:
+            self.writes += 1
+            for op in operations:
+                if isinstance(op, InsertOne):
+                    self.insert(op._doc)
+                    result["nInserted"] += 1
+                elif isinstance(op, UpdateOne):
+                    found = [ doc for doc in self.candidates(op._filter) if self.matches(doc, op._filter) ]
+                    if found:
+                        found[0].update(op._doc.get("$set", { }))
+                        result["nModified"] += 1
+                    elif op._upsert:
+                        document = dict(op._filter)
+                        document.update(op._doc.get("$set", { }))
+                        document.update(op._doc.get("$setOnInsert", { }))
+                        self.insert(document)
+                        result["nUpserted"] += 1
+        return BulkResult(result)
+
+class BulkResult(object):
+
+    def __init__(self, bulk_api_result):
+
+        self.bulk_api_result = bulk_api_result
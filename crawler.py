@@ -1,11 +1,18 @@
 #!/usr/bin/env python
 
-import argparse, logging, importlib, json
+import argparse, logging, importlib, json, os
 import sys, traceback
 from pymongo import MongoClient
 
 from application.collection.collector import Collector
 from application.collection.profile_builder import ProfileBuilder
+from application.collection.session import make_session
+from application.collection.frontier import JournaledFrontier
+from application.collection.cache import ResponseCache
+from application.collection.archive import PageArchive
+from application.collection.telemetry import Telemetry
+from application.collection.stats import FieldStats
+from application.profiling import Profiler, MODES, REGIONS
 
 def init_logging(args):
 
@@ -20,6 +27,54 @@ def init_logging(args):
     logger.addHandler(handler)
     return logger
 
+def load_profile(args, logger):
+
+    try:
+        profile = importlib.import_module("profiles." + args.profile)
+    except Exception as exc:
+        raise
+    logger.debug("Profile initialized")
+    return profile
+
+def get_collection(args, config, logger):
+
+    try:
+        client = MongoClient(host = config["mongo"]["host"], port = config["mongo"]["port"])
+        db = client[config["mongo"]["db"]]
+        if args.collection is None:
+            collection = db[args.profile]
+        else:
+            collection = db[args.collection]
+    except Exception as exc:
+        raise
+    logger.debug("Mongo initialized")
+    return client, collection
+
+def get_field_stats(collection, config, logger):
+    """The field stats to keep up to date, if they have been computed for the collection."""
+
+    field_stats = FieldStats(collection, config["collector"]["store_fields"])
+    if not field_stats.exists():
+        return None
+    logger.debug("Updating field stats")
+    return field_stats
+
+def reextract(args, config, logger):
+
+    profile = load_profile(args, logger)
+    client, collection = get_collection(args, config, logger)
+    archive = PageArchive(args.archive)
+
+    coll = Collector(collection, [ ], profile.site_profile,
+                    store_fields = config["collector"]["store_fields"],
+                    required_fields = config["collector"]["required_fields"],
+                    field_stats = get_field_stats(collection, config, logger))
+    coll.reextract(archive)
+    coll.close()
+
+    archive.close()
+    client.close()
+
 def main(args):
 
     logger = init_logging(args)
@@ -27,7 +82,7 @@ def main(args):
 
     if args.subcommand == "build":
         try:
-            profile = ProfileBuilder(args.url)
+            profile = ProfileBuilder(args.url, make_session())
         except Exception as exc:
             raise
         sys.__stdout__.write("\n%s\n" % str(profile))
@@ -39,38 +94,91 @@ def main(args):
         raise
     logger.debug("Configuration initialized")
 
-    try:
-        profile = importlib.import_module("profiles." + args.profile)
-    except Exception as exc:
-        raise
-    logger.debug("Profile initialized")
+    if args.subcommand == "reextract":
+        return reextract(args, config, logger)
 
-    try:
-        client = MongoClient(host = config["mongo"]["host"], port = config["mongo"]["port"])
-        db = client[config["mongo"]["db"]]
-        if args.collection is None:
-            collection = db[args.profile]
+    http_config = config.get("http", { })
+    session = make_session(timeout = http_config.get("timeout", 60),
+                           pool_connections = http_config.get("pool_connections", 10),
+                           pool_maxsize = max([ http_config.get("pool_maxsize", 10), args.concurrency ]))
+    logger.debug("HTTP session initialized")
+
+    frontier = None
+    if args.resume is not None:
+        frontier = JournaledFrontier(args.resume, bloom_capacity = args.bloom_capacity)
+        args.profile = args.profile or frontier.get_meta("profile")
+        args.collection = args.collection or frontier.get_meta("collection")
+        if frontier.get_meta("seeded", False):
+            args.depth = frontier.current_depth()
         else:
-            collection = db[args.collection]
-    except Exception as exc:
-        raise
-    logger.debug("Mongo initialized")
+            # The crawl stopped before all of its seeds were queued, so they are generated
+            # again; those already in the journal are skipped
+            logger.info("Seed links in %s are incomplete, generating them again" % args.resume)
+            args.link_file = frontier.get_meta("link_file", args.link_file)
+            args.profile_args = frontier.get_meta("profile_args", args.profile_args)
+            args.depth = frontier.get_meta("seed_depth", frontier.current_depth())
+        if args.depth is None:
+            logger.info("Nothing left to collect in %s" % args.resume)
+            frontier.close()
+            return
+        logger.debug("Resuming %s at depth %d" % (args.resume, args.depth))
 
-    # Make collection and wait time available to profile
+    profile = load_profile(args, logger)
+    client, collection = get_collection(args, config, logger)
+
+    # Make collection, wait time and http session available to profile
     profile.collection = collection
     profile.wait = args.wait
+    profile.session = session
 
-    if args.link_file is None:
+    if args.resume is not None and frontier.get_meta("seeded", False):
+        links = [ ]
+    elif args.link_file is None:
         links = profile.generate_links(*args.profile_args)
     else:
         links = [ url.strip() for url in open(args.link_file) ]
 
+    if args.journal is not None and args.resume is None:
+        frontier = JournaledFrontier(args.journal, bloom_capacity = args.bloom_capacity)
+        frontier.set_meta("profile", args.profile)
+        frontier.set_meta("collection", collection.name)
+        frontier.set_meta("seed_depth", args.depth)
+        frontier.set_meta("link_file", None if args.link_file is None else os.path.abspath(args.link_file))
+        frontier.set_meta("profile_args", args.profile_args)
+
+    cache = None
+    if args.cache is not None:
+        cache = ResponseCache(args.cache, args.cache_size * 1024 ** 2)
+
+    archive = None
+    if args.archive is not None:
+        archive = PageArchive(args.archive)
+
+    telemetry = Telemetry(args.stats_interval, args.prometheus_file)
+
     coll = Collector(collection, links, profile.site_profile,
                     store_fields = config["collector"]["store_fields"],
                     required_fields = config["collector"]["required_fields"],
-                    link_depth = args.depth, pause = args.wait)
-    coll.process_links()
+                    link_depth = args.depth, pause = args.wait,
+                    concurrency = args.concurrency, min_pause = args.min_wait,
+                    timeout = http_config.get("timeout", 60), session = session,
+                    bloom_capacity = args.bloom_capacity, frontier = frontier, cache = cache,
+                    archive = archive, parse_workers = args.parse_workers, queue_size = args.queue_size,
+                    telemetry = telemetry, field_stats = get_field_stats(collection, config, logger))
+    try:
+        coll.process_links()
+    finally:
+        coll.close()
+        if args.stats_file is not None:
+            telemetry.write_json(args.stats_file)
+        if args.prometheus_file is not None:
+            telemetry.write_prometheus(args.prometheus_file)
+
+    for store in [ cache, archive ]:
+        if store is not None:
+            store.close()
 
+    session.close()
     client.close()
 
 if __name__ == "__main__":
@@ -82,8 +190,8 @@ if __name__ == "__main__":
     build.add_argument("url", metavar = "URL", help = "attempt to build a profile based on %(metavar)s")
 
     collect = subparsers.add_parser("collect", help = "collect recipes based on a profile")
-    collect.add_argument("-p", "--profile", metavar = "SOURCE", dest = "profile", required = True,
-                        help = "use profile for %(metavar)s")
+    collect.add_argument("-p", "--profile", metavar = "SOURCE", dest = "profile", default = None,
+                        help = "use profile for %(metavar)s (required unless resuming)")
     collect.add_argument("-a", "--profile-args", metavar = "ARGS", dest = "profile_args", nargs = "*", default = [ ],
                         help = "pass %(metavar)s to link generation function")
     collect.add_argument("-o", "--link-file", metavar = "FILE", dest = "link_file", default = None,
@@ -93,19 +201,75 @@ if __name__ == "__main__":
     collect.add_argument("-c", "--config", metavar = "FILE", dest = "config", default = "config.json",
                         help = "use storage options in %(metavar)s [default: %(default)s]")
     collect.add_argument("-w", "--wait", metavar = "SECONDS", dest = "wait", default = 10, type = int,
-                        help = "wait %(metavar)s between requests [default: %(default)d]")
+                        help = "wait %(metavar)s between requests to a host [default: %(default)d]")
+    collect.add_argument("-W", "--min-wait", metavar = "SECONDS", dest = "min_wait", default = None, type = float,
+                        help = "speed up to %(metavar)s between requests to a responsive host [default: same as wait]")
     collect.add_argument("-d", "--depth", metavar = "N", dest = "depth", default = 0, type = int,
                         help = "follow links to depth %(metavar)s [default: %(default)d]")
+    collect.add_argument("-n", "--concurrency", metavar = "N", dest = "concurrency", default = 1, type = int,
+                        help = "retrieve up to %(metavar)s pages at once [default: %(default)d]")
+    collect.add_argument("-P", "--parse-workers", metavar = "N", dest = "parse_workers", default = 0, type = int,
+                        help = "parse pages in %(metavar)s separate processes [default: parse as retrieved]")
+    collect.add_argument("-q", "--queue-size", metavar = "N", dest = "queue_size", default = 100, type = int,
+                        help = "allow %(metavar)s pages to wait for parsing or storage [default: %(default)d]")
+    collect.add_argument("-b", "--bloom-filter", metavar = "N", dest = "bloom_capacity", default = None, type = int,
+                        help = "track crawled urls with a bloom filter sized for %(metavar)s urls [default: exact set]")
+    collect.add_argument("-j", "--journal", metavar = "FILE", dest = "journal", default = None,
+                        help = "record crawl progress in %(metavar)s so that it can be resumed")
+    collect.add_argument("-r", "--resume", metavar = "FILE", dest = "resume", default = None,
+                        help = "resume the crawl recorded in %(metavar)s")
+    collect.add_argument("-C", "--cache", metavar = "FILE", dest = "cache", default = None,
+                        help = "cache responses in %(metavar)s and only download changed pages")
+    collect.add_argument("-S", "--cache-size", metavar = "MB", dest = "cache_size", default = 1024, type = int,
+                        help = "limit the response cache to %(metavar)s [default: %(default)d]")
+    collect.add_argument("-A", "--archive", metavar = "DIR", dest = "archive", default = None,
+                        help = "keep a compressed copy of every page retrieved in %(metavar)s")
+    collect.add_argument("-s", "--stats-file", metavar = "FILE", dest = "stats_file", default = None,
+                        help = "write a json summary of crawl statistics to %(metavar)s")
+    collect.add_argument("-i", "--stats-interval", metavar = "SECONDS", dest = "stats_interval", default = 60, type = int,
+                        help = "log crawl statistics every %(metavar)s [default: %(default)d]")
+    collect.add_argument("--prometheus-file", metavar = "FILE", dest = "prometheus_file", default = None,
+                        help = "keep crawl statistics in %(metavar)s in prometheus text format")
+
+    reext = subparsers.add_parser("reextract", help = "extract recipes from archived pages again")
+    reext.add_argument("archive", metavar = "DIR", help = "use pages archived in %(metavar)s")
+    reext.add_argument("-p", "--profile", metavar = "SOURCE", dest = "profile", required = True,
+                        help = "use profile for %(metavar)s")
+    reext.add_argument("-m", "--mongo-collection", metavar = "COLLECTION", dest = "collection", default = None,
+                        help = "store recipes in mongo collection %(metavar)s [default: <profile name>]")
+    reext.add_argument("-c", "--config", metavar = "FILE", dest = "config", default = "config.json",
+                        help = "use storage options in %(metavar)s [default: %(default)s]")
 
     parser.add_argument("-l", "--log-level", metavar = "LOGLEVEL", dest = "log_level", default = "INFO",
                         help = "set the log level to %(metavar)s [default: %(default)s]")
     parser.add_argument("-f", "--log-file", metavar = "LOGFILE", dest = "log_file", default = None,
                         help = "write logs to %(metavar)s, [default: stdout]")
+    parser.add_argument("--profile-out", metavar = "FILE", dest = "profile_out", default = None,
+                        help = "profile the run and write the results to %(metavar)s")
+    parser.add_argument("--profile-mode", metavar = "MODE", dest = "profile_mode", default = "cprofile", choices = MODES,
+                        help = "write cProfile stats or sampled collapsed stacks, one of %(choices)s [default: %(default)s]")
+    parser.add_argument("--profile-regions", metavar = "REGIONS", dest = "profile_regions", default = None,
+                        help = "only profile comma-separated %%(metavar)s, from %s [default: everything]" % ", ".join(REGIONS))
 
     args = parser.parse_args()
+    if args.subcommand == "collect" and args.profile is None and args.resume is None:
+        parser.error("a profile is required unless resuming a crawl")
+
+    regions = args.profile_regions.split(",") if args.profile_regions else None
+    if regions and [ name for name in regions if name not in REGIONS ]:
+        parser.error("profile regions must be from %s" % ", ".join(REGIONS))
+
+    profiler = None
+    if args.profile_out is not None:
+        profiler = Profiler(args.profile_out, args.profile_mode, regions)
+        profiler.start()
 
     try:
         main(args)
     except:
         sys.__stderr__.write(traceback.format_exc())
         sys.exit(1)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write()
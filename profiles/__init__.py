@@ -1 +1 @@
-__all__ = [ 'bonappetit', 'gourmet', 'nyt', 'saveur' ]
+__all__ = [ 'bonappetit', 'gourmet', 'nyt', 'saveur', 'synthetic' ]
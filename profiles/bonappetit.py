@@ -1,6 +1,6 @@
 # Settings for Bon Appetit
 
-import requests, time
+import time
 from calendar import monthrange
 from datetime import datetime, timedelta
 import logging
@@ -15,11 +15,11 @@ site_profile = {
 }
 
 def generate_links(first_issue, last_issue = None):
+    """Yield recipe links from each issue between the first and last (inclusive)."""
 
     if last_issue is None:
         last_issue = first_issue
 
-    links = [ ]
     api_url = "http://www.bonappetit.com/api/search"
     api_params = "page=%d&types=recipes&status=published&issueDate=%s&{}"
 
@@ -30,7 +30,7 @@ def generate_links(first_issue, last_issue = None):
         while next_pg:
 
             try:
-                r = requests.get("%s?%s" % (api_url, api_params % (pg, pub_date)), timeout = 60)
+                r = session.get("%s?%s" % (api_url, api_params % (pg, pub_date)), timeout = 60)
                 js = r.json()
             except Exception as exc:
                 logger.error("Request failed for page %d" % pg, exc_info = True)
@@ -43,8 +43,7 @@ def generate_links(first_issue, last_issue = None):
                 next_pg = False
 
             for item in js["items"]:
-                url = "%s%s" % (site_profile["base_url"], item["url"])
-                links.append(url)
+                yield "%s%s" % (site_profile["base_url"], item["url"])
 
             time.sleep(wait)
 
@@ -55,8 +54,6 @@ def generate_links(first_issue, last_issue = None):
         raise
 
     while current <= end:
-        get_issue(current.strftime("%Y-%m-%d"))
+        yield from get_issue(current.strftime("%Y-%m-%d"))
         f, inc = monthrange(current.year, current.month)
         current += timedelta(days = inc)
-    
-    return links
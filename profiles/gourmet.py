@@ -1,5 +1,4 @@
 import time
-import requests
 from lxml import html
 
 # Settings for Gourmet
@@ -12,13 +11,16 @@ site_profile = {
 }
 
 def generate_links(first_page, last_page):
+    """Yield recipe links from each archive page between the first and last (inclusive)."""
 
     links = set([ ])
     for p in range(int(first_page), int(last_page) + 1):
-        resp = requests.get(f"{site_profile['base_url']}/source/gourmet?page={p}")
+        resp = session.get(f"{site_profile['base_url']}/source/gourmet?page={p}")
         content = html.fromstring(resp.content)
         for link in content.xpath(f".//a[starts-with(@href, '{site_profile['link_prefix']}')]"):
-            links.add(f"{site_profile['base_url']}{link.attrib['href']}")
+            url = f"{site_profile['base_url']}{link.attrib['href']}"
+            if url not in links:
+                links.add(url)
+                yield url
         time.sleep(2)
-    return list(links)
 
@@ -8,9 +8,10 @@ site_profile = {
 }
 
 def generate_links(count=0):
+    """Yield the main cooking page and a sample of previously collected recipes."""
 
-    links = [ "http://cooking.nytimes.com" ]
-    for rcp in collection.aggregate([ { "$sample": { "size": int(count) } } ]):
-        links.append(rcp["url"])
-    return links
+    yield "http://cooking.nytimes.com"
+    if int(count) > 0:
+        for rcp in collection.aggregate([ { "$sample": { "size": int(count) } } ]):
+            yield rcp["url"]
 
@@ -1,7 +1,7 @@
 # Settings for Saveur
 
 import logging
-import requests, time
+import time
 from lxml import html
 
 logger = logging.getLogger(__name__)
@@ -14,16 +14,17 @@ site_profile = {
 }
 
 def generate_links(first_page, last_page=None):
+    """Yield recipe links from each page between the first and last (inclusive)."""
 
     if last_page is None:
         last_page = int(first_page)
 
     links = set([])
     for p in range(int(first_page), int(last_page) + 1):
-        resp = requests.get(f"{site_profile['base_url']}/tags/recipes/page/{p}")
+        resp = session.get(f"{site_profile['base_url']}/tags/recipes/page/{p}")
         content = html.fromstring(resp.content)
         for link in content.xpath(".//a[@class='Post-link']"):
-            links.add(link.attrib['href'])
+            if link.attrib['href'] not in links:
+                links.add(link.attrib['href'])
+                yield link.attrib['href']
         time.sleep(2)
-
-    return links
@@ -0,0 +1,19 @@
+# Settings for the synthetic recipe site used in load tests (python -m benchmarks.site)
+
+import os
+
+# The site's address and markup are set when it is started, so they are taken from the
+# environment rather than fixed here
+base_url = os.environ.get("SYNTHETIC_SITE", "http://127.0.0.1:8000").rstrip("/")
+
+site_profile = {
+    "display_name": "Synthetic recipes",
+    "base_url": base_url,
+    "link_prefix": base_url + "/recipes/",
+    "extract_method": os.environ.get("SYNTHETIC_MARKUP", "json-ld"),
+}
+
+def generate_links():
+    """Yield the home page, which links to every index page."""
+
+    yield base_url + "/"
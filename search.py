@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 import argparse
-import sys, traceback, logging
+import sys, os, traceback, logging
 import re, json
 from math import ceil
 
@@ -9,6 +9,7 @@ from pymongo import MongoClient
 
 from application.collection import manager
 from application.cmdlineutils import RecipeUtil
+from application.profiling import Profiler, MODES, REGIONS
 
 def init_logging(args):
 
@@ -43,10 +44,23 @@ def main(args):
     try:
         mgr = manager.Manager(config["mongo"], 
                               args.collection, 
-                              config["collector"]["store_fields"])
+                              config["collector"]["store_fields"],
+                              query_cache_size = 64 if args.query_cache > 0 else 0,
+                              query_cache_bytes = args.query_cache * 1024 ** 2,
+                              text_index_path = os.path.join(args.index_dir, args.collection) if args.engine == "local" else None,
+                              pantry_index_path = os.path.join(args.index_dir, "%s-pantry" % args.collection))
     except Exception as exc:
         raise
 
+    created = mgr.ensure_indexes(text = args.engine == "mongo")
+    if created:
+        logger.info("Created index(es): %s" % ", ".join(created))
+
+    if args.engine == "local":
+        if mgr.text_index_info() is None:
+            sys.stdout.write("Building text index in %s...\n" % os.path.join(args.index_dir, args.collection))
+        mgr.refresh_text_index()
+
     # Attempt to get screen size, requires unix-specific services
     try:
         nrows, ncols = get_terminal_size()
@@ -73,13 +87,35 @@ if __name__ == "__main__":
                         help = "store recipes in mongo collection %(metavar)s")
     parser.add_argument("-s", "--screen", metavar = "NxN", dest = "screen", default = None,
                         help = "assume %(metavar)s display [default: autodetect]")
+    parser.add_argument("-e", "--engine", metavar = "ENGINE", dest = "engine", default = "mongo", choices = [ "mongo", "local" ],
+                        help = "search text with mongo's text index or a local index (which only stems plurals), "
+                               "one of %(choices)s [default: %(default)s]")
+    parser.add_argument("-x", "--index-dir", metavar = "DIR", dest = "index_dir", default = "index",
+                        help = "keep local text and pantry indexes in %(metavar)s [default: %(default)s]")
+    parser.add_argument("-Q", "--query-cache", metavar = "MB", dest = "query_cache", default = 64, type = int,
+                        help = "cache recent searches in up to %(metavar)s, 0 to turn off [default: %(default)d]")
     parser.add_argument("-l", "--log-level", metavar = "LOGLEVEL", dest = "log_level", default = "WARN",
                         help = "set the log level to %(metavar)s [default: %(default)s]")
     parser.add_argument("-f", "--log-file", metavar = "LOGFILE", dest = "log_file", default = None,
                         help = "write logs to %(metavar)s, [default: stdout]")
+    parser.add_argument("--profile-out", metavar = "FILE", dest = "profile_out", default = None,
+                        help = "profile the run and write the results to %(metavar)s")
+    parser.add_argument("--profile-mode", metavar = "MODE", dest = "profile_mode", default = "cprofile", choices = MODES,
+                        help = "write cProfile stats or sampled collapsed stacks, one of %(choices)s [default: %(default)s]")
+    parser.add_argument("--profile-regions", metavar = "REGIONS", dest = "profile_regions", default = None,
+                        help = "only profile comma-separated %%(metavar)s, from %s [default: everything]" % ", ".join(REGIONS))
 
     args = parser.parse_args()
 
+    regions = args.profile_regions.split(",") if args.profile_regions else None
+    if regions and [ name for name in regions if name not in REGIONS ]:
+        parser.error("profile regions must be from %s" % ", ".join(REGIONS))
+
+    profiler = None
+    if args.profile_out is not None:
+        profiler = Profiler(args.profile_out, args.profile_mode, regions)
+        profiler.start()
+
     try:
         main(args)
     except SystemExit:
@@ -87,4 +123,8 @@ if __name__ == "__main__":
     except Exception as exc:
         sys.__stderr__.write(traceback.format_exc())
         sys.exit(1)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write()
 
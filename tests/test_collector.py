@@ -0,0 +1,119 @@
+import json, unittest
+from concurrent.futures import Future
+from datetime import datetime
+
+from pymongo import InsertOne, UpdateOne
+from requests import ConnectionError
+
+from application.collection.collector import Collector
+from application.collection.frontier import Frontier
+from application.collection.scheduler import RetryLater
+from application.collection.writer import BulkWriter
+
+PROFILE = { "base_url": "http://example.com/", "extract_method": "json-ld" }
+
+class Result(object):
+
+    def __init__(self, operations):
+
+        self.bulk_api_result = { "nInserted": len(operations) }
+
+class Collection(object):
+
+    def __init__(self, records = [ ]):
+
+        self.records = records
+        self.batches = [ ]
+        self.updates = [ ]
+
+    def index_information(self):
+
+        return { "url_1": { "key": [ ("url", 1) ] } }
+
+    def find(self, query, projection = None):
+
+        return [ dict(record) for record in self.records if record["url"] in query["url"]["$in"] ]
+
+    def bulk_write(self, operations, ordered = True):
+
+        for operation in operations:
+            if isinstance(operation, UpdateOne):
+                self.updates.append(operation._doc["$set"])
+        self.batches.append([ operation._doc["url"] for operation in operations if isinstance(operation, InsertOne) ])
+        return Result(operations)
+
+class RecordingFrontier(Frontier):
+
+    def __init__(self):
+
+        super(RecordingFrontier, self).__init__()
+        self.completed = [ ]
+
+    def done(self, url, depth):
+
+        super(RecordingFrontier, self).done(url, depth)
+        self.completed.append(url)
+
+def content(*recipes):
+
+    return "".join([ '<script type="application/ld+json">%s</script>' % json.dumps(dict(recipe, **{ "@type": "Recipe" }))
+                     for recipe in recipes ]).encode("utf-8")
+
+def page(*names):
+
+    result = Future()
+    result.set_result(content(*[ { "name": name } for name in names ]))
+    return result
+
+class CollectorTest(unittest.TestCase):
+
+    def test_done_after_write(self):
+
+        collection, frontier = Collection(), RecordingFrontier()
+        writer = BulkWriter(collection, max_count = 3, max_delay = 60)
+        collector = Collector(collection, [ ], PROFILE, [ "name" ], [ "name" ],
+                              frontier = frontier, writer = writer)
+        writer.on_write, collector.pages = collector.records_written, 0
+
+        # Two recipes fill the buffer with one more, so the first page waits for the second
+        collector.process_pages([ ("http://example.com/a", page("A1", "A2")) ], set())
+        self.assertEqual([ ], frontier.completed)
+        collector.process_pages([ ("http://example.com/b", page("B1", "B2")),
+                                  ("http://example.com/c", page()) ], set())
+        self.assertEqual([ "http://example.com/a", "http://example.com/c" ], frontier.completed)
+
+        writer.flush()
+        collector.mark_written()
+        self.assertEqual([ "http://example.com/a", "http://example.com/c", "http://example.com/b" ],
+                         frontier.completed)
+        writer.close()
+
+    def test_update_duplicate_links(self):
+
+        url = "http://example.com/a"
+        collection = Collection([ { "url": url, "name": "A", "collect_time": datetime.utcnow() } ])
+        collector = Collector(collection, [ url, url ], PROFILE, [ "name", "recipeYield" ], [ "name" ],
+                              pause = 0, writer = BulkWriter(collection, max_delay = 60))
+        collector.get_content = lambda url, tries = 1: content({ "name": "A", "recipeYield": "2" })
+        collector.update_recipes(update_existing = False)
+        collector.close()
+
+        self.assertEqual(1, len(collection.updates))
+        self.assertEqual([ "recipeYield", "update_time" ], sorted(collection.updates[0]))
+
+    def test_connection_error_retried(self):
+
+        class Session(object):
+            def get(self, url, headers = { }, timeout = None):
+                raise ConnectionError("Connection refused")
+
+        collection = Collection()
+        collector = Collector(collection, [ ], PROFILE, [ "name" ], [ "name" ], pause = 1, session = Session(),
+                              writer = BulkWriter(collection, max_delay = 60))
+        with self.assertRaises(RetryLater):
+            collector.get_content("http://example.com/a")
+        self.assertLess(collector.scheduler.get_host("http://example.com/a")["rate"], 1.0)
+        collector.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+from application.collection.facets import FacetCache
+
+class Collection(object):
+
+    name = "recipes"
+
+    def __init__(self, results):
+
+        self.results = results
+        self.database = { "recipes_facets": None }
+
+    def aggregate(self, pipeline):
+
+        return iter(self.results)
+
+class CountValuesTest(unittest.TestCase):
+
+    def test_unhashable_values(self):
+
+        cache = FacetCache(Collection([
+            { "_id": "Soup", "count": 3 },
+            { "_id": [ "Main", "Side" ], "count": 2 },
+            { "_id": { "name": "Dessert" }, "count": 1 },
+        ]))
+        counts = cache.count_values("recipeCategory")
+        self.assertEqual(3, counts["Soup"])
+        self.assertEqual(2, counts['["Main", "Side"]'])
+        self.assertEqual(1, counts['{"name": "Dessert"}'])
+
+if __name__ == "__main__":
+    unittest.main()
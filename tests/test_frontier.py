@@ -0,0 +1,68 @@
+import os, shutil, tempfile, unittest
+
+from application.collection.frontier import JournaledFrontier, LinkStream
+
+def seeds(count = 10):
+
+    for n in range(count):
+        yield "http://example.com/recipe/%d" % n
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "journal.db")
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+    def take_all(self, frontier, depth = 0):
+
+        taken = [ ]
+        while True:
+            urls = frontier.take(depth, 2)
+            if not urls:
+                return taken
+            for url in urls:
+                frontier.done(url, depth)
+            taken += urls
+
+    def test_resume_mid_stream(self):
+
+        frontier = JournaledFrontier(self.path)
+        frontier.add_source(0, LinkStream(seeds(), maxsize = 2))
+        first = frontier.take(0, 3)
+        for url in first[:2]:
+            frontier.done(url, 0)
+        # Interrupted with seeds still being generated, and one url in progress
+        frontier.close()
+
+        frontier = JournaledFrontier(self.path)
+        self.assertFalse(frontier.get_meta("seeded", False))
+        frontier.add_source(0, LinkStream(seeds(), maxsize = 2))
+        rest = self.take_all(frontier)
+        self.assertEqual(sorted(first[2:] + [ url for url in seeds() if url not in first ]), sorted(rest))
+        self.assertTrue(frontier.get_meta("seeded", False))
+        frontier.close()
+
+        frontier = JournaledFrontier(self.path)
+        self.assertTrue(frontier.get_meta("seeded", False))
+        self.assertIsNone(frontier.current_depth())
+        frontier.close()
+
+    def test_failed_stream_not_seeded(self):
+
+        def broken():
+            yield "http://example.com/recipe/0"
+            raise IOError("listing unavailable")
+
+        frontier = JournaledFrontier(self.path)
+        frontier.add_source(0, LinkStream(broken()))
+        self.assertEqual([ "http://example.com/recipe/0" ], self.take_all(frontier))
+        self.assertFalse(frontier.get_meta("seeded", False))
+        frontier.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import logging, unittest
+
+from pymongo.errors import DuplicateKeyError
+
+from application.collection.indexes import create_url_index
+
+class Collection(object):
+    """Fails to build a unique index, as with duplicate urls, unless it is built in the background."""
+
+    def __init__(self):
+
+        self.created = [ ]
+
+    def create_index(self, keys, name = None, unique = False, background = False):
+
+        if unique and not background:
+            raise DuplicateKeyError("E11000 duplicate key error", 11000)
+        self.created.append((name, unique))
+        return name
+
+class CreateUrlIndexTest(unittest.TestCase):
+
+    def test_duplicate_urls(self):
+
+        collection = Collection()
+        create_url_index(collection, logging.getLogger(__name__))
+        self.assertEqual([ ("url", False) ], collection.created)
+
+if __name__ == "__main__":
+    unittest.main()
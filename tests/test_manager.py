@@ -0,0 +1,50 @@
+import unittest
+from datetime import datetime, timedelta
+
+from application.collection.facets import SETTLE_TIME
+from application.collection.manager import Manager
+
+class Index(object):
+
+    def __init__(self, watermark):
+
+        self.watermark = watermark
+        self.refreshes = 0
+
+    def refresh(self):
+
+        self.refreshes += 1
+        self.watermark = datetime.utcnow() - SETTLE_TIME
+
+class CheckWritesTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.manager = Manager({ "host": "localhost", "port": 27017, "db": "test" }, "recipes", [ "name" ],
+                               query_cache_size = 0)
+        self.index = self.manager.text_index = Index(datetime.utcnow() - SETTLE_TIME - timedelta(seconds = 10))
+
+    def check_writes(self, latest):
+
+        self.manager.latest_write = lambda: latest
+        self.manager.check_writes()
+
+    def test_refresh_once_settled(self):
+
+        latest = datetime.utcnow() - timedelta(seconds = 1)
+        for search in range(3):
+            self.check_writes(latest)
+        self.assertEqual(0, self.index.refreshes)
+
+        self.check_writes(datetime.utcnow() - SETTLE_TIME - timedelta(seconds = 1))
+        self.assertEqual(1, self.index.refreshes)
+
+    def test_refresh_while_writes_continue(self):
+
+        self.index.watermark -= SETTLE_TIME
+        for search in range(3):
+            self.check_writes(datetime.utcnow())
+        self.assertEqual(1, self.index.refreshes)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import shutil, tempfile, unittest
+
+from bson import ObjectId
+
+from application.collection import pantry
+from application.collection.pantry import PantryIndex, normalize, pantry_keys
+
+class Collection(object):
+
+    def __init__(self, recipes):
+
+        self.recipes = recipes
+
+    def find(self, query, projection = None, batch_size = None):
+
+        return [ dict(recipe) for recipe in self.recipes ]
+
+class NormalizeTest(unittest.TestCase):
+
+    def test_quantities_dropped(self):
+
+        self.assertEqual([ [ "parmesan" ] ], normalize("½ cup grated parmesan"))
+        self.assertEqual([ [ "egg" ] ], normalize("2 large eggs, beaten"))
+        self.assertEqual([ [ "tomato" ] ], normalize("1 (14 oz) can diced tomatoes"))
+
+    def test_head_noun_phrase(self):
+
+        self.assertEqual([ [ "red bell pepper" ] ], normalize("2 red bell peppers"))
+        self.assertEqual([ [ "egg noodle" ] ], normalize("8 oz egg noodles"))
+        self.assertEqual([ [ "parsley" ] ], normalize("parsley for garnish"))
+
+    def test_parts_and_alternatives(self):
+
+        self.assertEqual([ [ "salt" ], [ "black pepper" ] ], normalize("Salt and freshly ground black pepper, to taste"))
+        self.assertEqual([ [ "butter", "olive oil" ] ], normalize("2 tbsp butter or olive oil"))
+
+class PantryIndexTests(object):
+    """Searches, run with numpy set to the scoring module to use (None for pure python)."""
+
+    numpy = None
+
+    def setUp(self):
+
+        self.installed, pantry.numpy = pantry.numpy, self.numpy
+        self.dir = tempfile.mkdtemp()
+        self.recipes = [
+            { "_id": ObjectId(), "name": "Stuffed peppers",
+              "recipeIngredient": [ "4 red bell peppers", "1 cup cooked rice", "salt and pepper to taste" ] },
+            { "_id": ObjectId(), "name": "Noodles",
+              "recipeIngredient": [ "8 oz egg noodles", "2 tbsp butter or olive oil", "½ cup grated parmesan" ] },
+            { "_id": ObjectId(), "name": "Omelette",
+              "recipeIngredient": [ "3 eggs", "1 tbsp butter", "Salt and freshly ground black pepper" ] },
+        ]
+        self.index = PantryIndex(self.dir, Collection(self.recipes))
+        self.index.build()
+
+    def tearDown(self):
+
+        self.index.close()
+        shutil.rmtree(self.dir)
+        pantry.numpy = self.installed
+
+    def search(self, items, **kwargs):
+
+        names = dict([ (recipe["_id"], recipe["name"]) for recipe in self.recipes ])
+        return dict([ (names[doc_id], (covered, total))
+                      for doc_id, covered, total in self.index.search(pantry_keys(items), **kwargs) ])
+
+    def test_staples_match_exactly(self):
+
+        self.assertEqual({ "Stuffed peppers": (2, 3), "Omelette": (1, 3) }, self.search("rice"))
+        self.assertEqual((3, 3), self.search("rice, bell pepper")["Stuffed peppers"])
+
+    def test_head_noun_must_match(self):
+
+        found = self.search("eggs")
+        self.assertNotIn("Noodles", found)
+        self.assertEqual((2, 3), found["Omelette"])
+
+    def test_alternatives(self):
+
+        self.assertEqual((2, 3), self.search("olive oil, parmesan")["Noodles"])
+        self.assertEqual({ "Noodles": (3, 3) }, self.search("egg noodles, oil, parmesan", max_missing = 0))
+
+    def test_refresh_replaces_earlier_versions(self):
+
+        self.recipes[2]["recipeIngredient"] = [ "3 eggs", "1 cup cooked rice" ]
+        self.index.meta["watermark"] = self.index.meta["watermark"].replace(year = 2000)
+        self.assertEqual(3, self.index.refresh())
+        self.assertEqual(3, self.index.info()["docs"])
+        self.assertEqual({ "Stuffed peppers": (2, 3), "Omelette": (1, 2) }, self.search("rice"))
+
+    def test_merged_segments(self):
+
+        self.index.close()
+        self.index = PantryIndex(self.dir, Collection(self.recipes), segment_docs = 1, max_segments = 2)
+        self.index.build()
+        self.assertEqual((2, 3), (self.index.info()["segments"], self.index.info()["docs"]))
+        self.assertEqual({ "Stuffed peppers": (2, 3), "Omelette": (1, 3) }, self.search("rice"))
+
+class PurePythonPantryIndexTest(PantryIndexTests, unittest.TestCase):
+
+    numpy = None
+
+@unittest.skipIf(pantry.numpy is None, "numpy is not installed")
+class NumpyPantryIndexTest(PantryIndexTests, unittest.TestCase):
+
+    numpy = pantry.numpy
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from application.collection.extractor import Extractor
+from application.collection.pipeline import timed_parse
+
+PAGE = b"""<html><body><a href="/recipes/2">Next</a>
+<div itemscope itemtype="http://schema.org/Recipe"><h1 itemprop="name">Leek soup</h1></div>
+<script type="application/ld+json">{ "@type": "Recipe", "name": "Leek soup" }</script>
+</body></html>"""
+
+class TimedParseTest(unittest.TestCase):
+
+    def parse(self, method, follow_links = False):
+
+        extractor = Extractor({ "base_url": "http://example.com/", "extract_method": method }, [ "name" ], [ "name" ])
+        records, links, timings, rejected = timed_parse(extractor, PAGE, "http://example.com/recipes/1", True, follow_links)
+        self.assertEqual([ "Leek soup" ], [ record["name"] for record in records ])
+        return sorted(timings)
+
+    def test_stages_timed_separately(self):
+
+        self.assertEqual([ "extract", "parse" ], self.parse("microdata"))
+        # json-ld recipes are found without parsing the html, unless links are needed
+        self.assertEqual([ "extract" ], self.parse("json-ld"))
+        self.assertEqual([ "extract", "parse" ], self.parse("json-ld", follow_links = True))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,17 @@
+import unittest
+
+from application.collection.scheduler import HostScheduler
+
+class HostSchedulerTest(unittest.TestCase):
+
+    def test_hosts_take_turns(self):
+
+        scheduler = HostScheduler(wait = 0)
+        for host in [ "a", "b", "c" ]:
+            for page in range(3):
+                scheduler.add("http://%s.example.com/%d" % (host, page))
+        urls = [ scheduler.next()[0] for i in range(6) ]
+        self.assertEqual([ "a", "b", "c", "a", "b", "c" ], [ url[7] for url in urls ])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import shutil, tempfile, unittest
+from datetime import datetime
+
+from bson import ObjectId
+
+from application.collection.textindex import LocalIndex, stem
+
+class Collection(object):
+
+    def __init__(self, recipes):
+
+        self.recipes = recipes
+
+    def find(self, query, projection = None, batch_size = None):
+
+        return [ dict(recipe) for recipe in self.recipes ]
+
+class StemTest(unittest.TestCase):
+
+    def test_plurals(self):
+
+        for plural, singular in [ ("tomatoes", "tomato"), ("berries", "berry"), ("cookies", "cookie"),
+                                  ("dishes", "dish"), ("glasses", "glass"), ("leeks", "leek") ]:
+            self.assertEqual(stem(singular), stem(plural))
+        self.assertEqual("hummus", stem("hummus"))
+
+class LocalIndexTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.dir = tempfile.mkdtemp()
+        self.recipes = [
+            { "_id": ObjectId(), "name": "Tomato soup", "recipeIngredient": [ "4 tomatoes" ] },
+            { "_id": ObjectId(), "name": "Leek gratin", "recipeIngredient": [ "3 leeks", "cream" ] },
+        ]
+        self.index = LocalIndex(self.dir, Collection(self.recipes), segment_docs = 1)
+        self.index.build()
+
+    def tearDown(self):
+
+        self.index.close()
+        shutil.rmtree(self.dir)
+
+    def test_plural_matches_singular(self):
+
+        self.assertEqual([ self.recipes[0]["_id"] ], [ doc_id for doc_id, score in self.index.search("tomato") ])
+        self.assertEqual([ self.recipes[1]["_id"] ], [ doc_id for doc_id, score in self.index.search("leek") ])
+
+    def test_refresh_replaces_earlier_versions(self):
+
+        self.recipes[1]["name"] = "Leek tart"
+        self.index.meta["watermark"] = self.index.meta["watermark"].replace(year = 2000)
+        self.assertEqual(2, self.index.refresh())
+        info = self.index.info()
+        self.assertEqual((2, 2), (info["docs"], info["deleted"]))
+        self.assertEqual([ self.recipes[1]["_id"] ], [ doc_id for doc_id, score in self.index.search("tart") ])
+        self.assertEqual([ ], self.index.search("gratin"))
+
+    def test_refresh_without_changes(self):
+
+        segments = list(self.index.segments)
+        self.index.meta["watermark"] = self.index.meta["watermark"].replace(year = 2000)
+        self.recipes[:] = [ ]
+        self.assertEqual(0, self.index.refresh())
+        self.assertEqual(segments, self.index.segments)
+        self.assertEqual(datetime.utcnow().year, self.index.watermark.year)
+
+if __name__ == "__main__":
+    unittest.main()
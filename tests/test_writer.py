@@ -0,0 +1,64 @@
+import unittest
+from threading import Event, Thread
+
+from application.collection.writer import BulkWriter
+
+class Result(object):
+
+    def __init__(self, operations):
+
+        self.bulk_api_result = { "nInserted": len(operations) }
+
+class SlowCollection(object):
+    """Holds each bulk write until released."""
+
+    def __init__(self):
+
+        self.started = Event()
+        self.release = Event()
+        self.batches = [ ]
+
+    def bulk_write(self, operations, ordered = True):
+
+        self.started.set()
+        self.release.wait(5)
+        self.batches.append([ operation._doc["url"] for operation in operations ])
+        return Result(operations)
+
+class BulkWriterTest(unittest.TestCase):
+
+    def test_add_during_write(self):
+
+        collection = SlowCollection()
+        writer = BulkWriter(collection, max_count = 2, max_delay = 60)
+        writer.insert({ "url": "a" })
+        flushing = Thread(target = writer.insert, args = ({ "url": "b" }, ))
+        flushing.start()
+        self.assertTrue(collection.started.wait(5))
+
+        # The first batch is being written; adding to the buffer doesn't wait for it
+        adding = Thread(target = writer.insert, args = ({ "url": "c" }, ))
+        adding.start()
+        adding.join(1)
+        self.assertFalse(adding.is_alive())
+
+        collection.release.set()
+        flushing.join(5)
+        writer.close()
+        self.assertEqual([ [ "a", "b" ], [ "c" ] ], collection.batches)
+        self.assertEqual(3, writer.stats["inserted"])
+
+    def test_failed_batch_reported(self):
+
+        class BrokenCollection(object):
+            def bulk_write(self, operations, ordered = True):
+                raise Exception("Not connected")
+
+        reports = [ ]
+        writer = BulkWriter(BrokenCollection(), max_delay = 60, on_write = lambda *urls: reports.append(urls))
+        writer.insert({ "url": "a" })
+        writer.close()
+        self.assertEqual([ ([ ], [ "a" ]) ], reports)
+
+if __name__ == "__main__":
+    unittest.main()